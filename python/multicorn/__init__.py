@@ -212,6 +212,78 @@ class ForeignDataWrapper(object):
         """
         return []
 
+    def can_limit(self, limit, offset, quals, sortkeys):
+        """
+        Method called from the planner (PostgreSQL 12 and later) to ask the
+        FDW whether it can apply the LIMIT and OFFSET clauses of a query
+        on this single table, such as::
+
+            SELECT * FROM logs ORDER BY ts DESC LIMIT 20
+
+        This is only asked when the whole WHERE clause can be converted to
+        quals, and the sort, if any, is done by the FDW. If True is
+        returned, :meth:`execute` is given the "limit" and "offset" keyword
+        arguments, and must skip the first "offset" rows matching the quals,
+        in the order of the sortkeys, then return at most "limit" rows.
+
+        Args:
+            limit (int): the maximum number of rows, or None if only an
+                OFFSET is given.
+            offset (int): the number of rows to skip, 0 if no OFFSET is
+                given.
+            quals (list): the :class:`Qual` instances of the WHERE clause.
+            sortkeys (list): the :class:`SortKey` instances which will be
+                given to :meth:`execute`.
+
+        Return:
+            True if the FDW can apply the limit and the offset.
+        """
+        return False
+
+    def can_aggregate(self, groups, aggs, quals):
+        """
+        Method called from the planner (PostgreSQL 12 and later) to ask the
+        FDW whether it can compute the aggregates of a query on this single
+        table, such as::
+
+            SELECT status, count(*), max(size) FROM logs GROUP BY status
+
+        This is only asked when the whole WHERE clause can be converted to
+        quals, the query has no HAVING clause nor grouping sets, and every
+        aggregate is a plain count, sum, min, max or avg of a column (or
+        count(*)). If True is returned, the rows are computed by
+        :meth:`execute_aggregate` instead of :meth:`execute`.
+
+        Args:
+            groups (list): the names of the columns in the GROUP BY clause.
+            aggs (list): the aggregates, as (function, column) tuples such
+                as ('max', 'size'). The column is None for count(*).
+            quals (list): the :class:`Qual` instances of the WHERE clause.
+
+        Return:
+            True if the FDW can compute the aggregates.
+        """
+        return False
+
+    def execute_aggregate(self, groups, aggs, quals):
+        """
+        Compute the aggregates accepted by :meth:`can_aggregate`.
+
+        Args:
+            groups (list): the names of the grouped columns.
+            aggs (list): the (function, column) tuples of the aggregates.
+            quals (list): the :class:`Qual` instances the aggregated rows
+                must match.
+
+        Return:
+            An iterable of sequences, one per group, holding the values of
+            the grouped columns followed by the value of every aggregate, in
+            order. Without a GROUP BY clause, exactly one row must be
+            returned, even if no row matches the quals.
+        """
+        raise NotImplementedError(
+            "This FDW does not support aggregate pushdown")
+
     def get_path_keys(self):
         u"""
         Method called from the planner to add additional Path to the planner.
@@ -269,6 +341,23 @@ class ForeignDataWrapper(object):
         """
         return []
 
+    def get_type_hints(self):
+        """
+        Method called at the beginning of a scan to learn which python
+        types will be returned for each column.
+
+        This is only an optimization: the conversion of those values is
+        chosen once, instead of being guessed for every value. Returning
+        a value of another type for a column is still supported.
+
+        Returns:
+            A dict mapping column names to python types, for example::
+
+                {'id': int, 'name': str, 'tags': list}
+
+        """
+        return {}
+
     def explain(self, quals, columns, sortkeys=None, verbose=False):
         """Hook called on explain.
 
@@ -314,18 +403,141 @@ class ForeignDataWrapper(object):
             sortkeys (list): A list of :class:`SortKey`
                 that the FDW said it can enforce.
 
+        The "limit" and "offset" keyword arguments are also given if
+        :meth:`can_limit` accepted them.
+
         Returns:
             An iterable of python objects which can be converted back to PostgreSQL.
             Currently, such objects are:
             - sequences containing exactly as much columns as the
             underlying tables
             - dictionaries mapping column names to their values.
+            - :class:`ColumnBatch` instances, holding several rows.
+            - objects implementing the Arrow C data interface
+              (``__arrow_c_array__`` or ``__arrow_c_stream__``), such as
+              ``pyarrow.RecordBatch`` and ``pyarrow.Table``. Their fields
+              are matched to the columns by name.
+            A single batch (or arrow object) can also be returned instead
+            of an iterable.
             If the sortkeys wasn't empty, the FDW has to return the data in the
             expected order.
 
         """
         pass
 
+    def execute_batches(self, quals, columns, sortkeys=None, batch_size=1000,
+                        **kwargs):
+        """Execute a query, returning the rows in batches.
+
+        This method is called instead of :meth:`execute` when the
+        "batch_size" option is set on the foreign table (or its server), and
+        the FDW overrides it. The rows of each batch are converted without
+        going back to the python interpreter, which greatly reduces the
+        per-row overhead for narrow rows.
+
+        FDWs which already fetch their data in chunks should override it to
+        return those chunks directly. The default implementation, which
+        groups the rows returned by :meth:`execute`, is only used by
+        overrides calling it.
+
+        Args:
+            quals, columns, sortkeys: the same as in :meth:`execute`.
+            batch_size (int): the value of the "batch_size" option. It is
+                only a hint, batches of any size can be returned.
+            kwargs: the "limit" and "offset" given to :meth:`execute`, if
+                any.
+
+        Returns:
+            An iterable of sequences (lists, tuples) of rows, or of
+            :class:`ColumnBatch`. Each row is the same as a row returned by
+            :meth:`execute`.
+        """
+        if sortkeys:
+            kwargs['sortkeys'] = sortkeys
+        rows = self.execute(quals, columns, **kwargs)
+        if rows is None:
+            return
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def get_partitions(self, quals, columns):
+        """Method called to split a scan between parallel workers.
+
+        FDWs overriding this method can be scanned in parallel (PostgreSQL
+        9.6 and later). When the planner chooses a parallel plan, it is
+        called once, in the leader process, and each participant of the
+        scan then calls :meth:`execute_partition` for some of the returned
+        partitions, until all of them have been executed. The rows of
+        every partition are returned exactly once.
+
+        Args:
+            quals, columns: the same as in :meth:`execute`.
+
+        Returns:
+            An iterable of partitions, which can be any picklable object:
+            a file name, a range of keys... If None is returned, the scan is
+            not split, and :meth:`execute` is called by a single
+            participant.
+        """
+        return None
+
+    def execute_partition(self, partition, quals, columns):
+        """Execute a query for one of the partitions returned by
+        :meth:`get_partitions`.
+
+        This method is called in the leader and in the parallel workers,
+        each running its own instance of the FDW.
+
+        Args:
+            partition: one of the objects returned by :meth:`get_partitions`
+            quals, columns: the same as in :meth:`execute`.
+
+        Returns:
+            The rows of this partition, as returned by :meth:`execute`.
+            The "batch_size" option does not apply to partitions, which
+            can still return :class:`ColumnBatch` or arrow objects.
+        """
+        raise NotImplementedError("This FDW does not support parallel scans")
+
+    def direct_modify(self, kind, quals, assignments, returning):
+        """
+        Execute an UPDATE or DELETE statement as a whole.
+
+        FDWs overriding this method are given UPDATE and DELETE statements
+        directly, instead of a scan followed by a call to :meth:`update`
+        or :meth:`delete` for each row, when:
+
+            - every condition of the WHERE clause can be converted to a
+              :class:`Qual`
+            - every new value is a constant, or a parameter
+            - the statement does not involve another table
+
+        :attr:`rowid_column` must still be implemented.
+
+        Args:
+            kind (str): "update" or "delete"
+            quals (list): A list of :class:`Qual` instances. Unlike in
+                :meth:`execute`, they are NOT checked again by PostgreSQL:
+                every one of them must be enforced.
+            assignments (dict): a dictionary mapping the updated columns to
+                their new values, empty for a delete.
+            returning (list): the columns needed by the RETURNING clause,
+                if any.
+
+        Returns:
+            The number of modified rows, or an iterable of the modified
+            rows if the statement has a RETURNING clause. Rows are the same
+            as those returned by :meth:`execute`, and must contain at least
+            the ``returning`` columns.
+        """
+        raise NotImplementedError("This FDW does not support direct modify")
+
     @property
     def rowid_column(self):
         """
@@ -355,6 +567,24 @@ class ForeignDataWrapper(object):
         """
         raise NotImplementedError("This FDW does not support the writable API")
 
+    def bulk_insert(self, rows):
+        """
+        Insert several tuples at once in the foreign table.
+
+        This method is called instead of :meth:`insert` when the
+        "batch_size" option is set on the foreign table (or its server),
+        on PostgreSQL 14 and later. Rows are inserted one at a time when
+        the statement has a RETURNING clause, or when the table has row
+        triggers.
+
+        The default implementation calls :meth:`insert` for each row.
+
+        Args:
+            rows (list): a list of dictionaries, as given to :meth:`insert`.
+        """
+        for values in rows:
+            self.insert(values)
+
     def update(self, oldvalues, newvalues):
         """
         Update a tuple containing ''oldvalues'' to the ''newvalues''.
@@ -414,6 +644,38 @@ class ForeignDataWrapper(object):
         """
         pass
 
+    def for_table(self, options, columns):
+        """
+        Method called on the shared instance of a server with the
+        "shared_instance" option, to get the object handling a foreign table.
+
+        With this option, the FDW class is instantiated once per server and
+        user, with the server and user mapping options and no columns. This
+        method is then called for each foreign table, and the object it
+        returns is used for every call regarding that table. It can share
+        connections, or any other resource, with the shared instance.
+
+        Args:
+            options (dict): the options of the foreign table, as given to
+                :py:meth:`__init__`
+            columns (dict): the columns of the foreign table, as given to
+                :py:meth:`__init__`
+
+        Returns:
+            A ForeignDataWrapper instance for the table.
+        """
+        raise NotImplementedError(
+            "This FDW does not support the shared_instance option")
+
+    def close(self):
+        """
+        Hook called when the instance is evicted from the cache of the
+        backend, because of the multicorn.max_instances or
+        multicorn.max_instances_memory settings. Connections and other
+        resources held by the instance should be released here.
+        """
+        pass
+
     def begin(self, serializable):
         """
         Hook called at the beginning of a transaction.
@@ -482,6 +744,38 @@ class TransactionAwareForeignDataWrapper(ForeignDataWrapper):
         self._init_transaction_state()
 
 
+class ColumnBatch(object):
+    """A batch of rows, stored column by column.
+
+    A ColumnBatch can be returned by :meth:`ForeignDataWrapper.execute`, or
+    :meth:`ForeignDataWrapper.execute_batches`, in place of a row or a batch
+    of rows. Columns exposing a one-dimensional buffer of integers, floats or
+    booleans (such as ``array.array``, ``memoryview`` or NumPy arrays) are
+    read directly from that buffer, without creating a python object per
+    value. Other columns can be any sequence, whose values are converted
+    like the values of a row.
+
+    Args:
+        columns (dict): A mapping of column names to their values. Every
+            column must have the same length. Missing columns are NULL.
+        nulls (dict): An optional mapping of column names to null bitmaps.
+            A bitmap is a bytes-like object, where the bit ``i % 8`` of the
+            byte ``i // 8`` is set if the i-th value is NULL.
+    """
+
+    def __init__(self, columns, nulls=None):
+        self.columns = columns
+        self.nulls = nulls
+        sizes = set(len(values) for values in columns.values())
+        if len(sizes) > 1:
+            raise ValueError("All the columns of a batch must have the same"
+                             " length")
+        self.size = sizes.pop() if sizes else 0
+
+    def __len__(self):
+        return self.size
+
+
 """Code from python2.7 importlib.import_module."""
 """Backport of importlib.import_module from 3.x."""
 # While not critical (and in no way guaranteed!), it would be nice to keep this
@@ -544,6 +838,98 @@ def get_class(module_path):
     return getattr(module, wrapper_class)
 
 
+def implements(fdw, method_name):
+    """
+    Internal function called from c code to check whether a foreign data
+    wrapper overrides an optional method, such as get_partitions.
+
+
+    Args:
+        fdw (ForeignDataWrapper): the foreign data wrapper instance.
+        method_name (str): the name of the ForeignDataWrapper method.
+
+
+    Returns:
+        True if the class of the foreign data wrapper overrides the method.
+    """
+    def function(method):
+        # Unbound methods wrap the function on python 2
+        return getattr(method, '__func__', method)
+    return (function(getattr(type(fdw), method_name)) is not
+            function(getattr(ForeignDataWrapper, method_name)))
+
+
+def instance_memory(fdw, max_objects=100000):
+    """
+    Internal function called from c code to estimate the memory used by a
+    foreign data wrapper instance.
+
+    The objects referenced by the instance are followed recursively, and
+    each one is counted once. Modules, classes and functions are shared by
+    every instance, and are not counted. The walk stops after max_objects
+    objects, so the result is a lower bound for very large instances.
+
+
+    Args:
+        fdw (ForeignDataWrapper): the foreign data wrapper instance.
+        max_objects (int): the maximum number of objects to visit.
+
+
+    Returns:
+        The estimated size of the instance, in bytes.
+    """
+    import gc
+    import types
+    shared = (type, types.ModuleType, types.FunctionType,
+              types.BuiltinFunctionType)
+    seen = set()
+    pending = [fdw]
+    memory = 0
+    while pending and len(seen) < max_objects:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, shared):
+            continue
+        seen.add(id(obj))
+        try:
+            memory += sys.getsizeof(obj)
+        except TypeError:
+            pass
+        pending.extend(gc.get_referents(obj))
+    return memory
+
+
+def preload(names):
+    """
+    Internal function called from c code to import the modules and classes
+    listed in the multicorn.preload setting.
+
+
+    Args:
+        names (str): A comma separated list of module names, or fully
+                     qualified class names.
+
+
+    Returns:
+        a list of error messages, one for each name which could not be
+        imported.
+    """
+    errors = []
+    for name in names.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            try:
+                import_module(name)
+            except ImportError:
+                if '.' not in name:
+                    raise
+                get_class(name)
+        except Exception as e:
+            errors.append('%s: %s' % (name, e))
+    return errors
+
+
 def quote_identifier(value):
     return '"' + value.replace('"', '""') + '"'
 
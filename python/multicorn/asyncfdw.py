@@ -0,0 +1,150 @@
+"""
+Support for foreign data wrappers fetching their rows with asyncio.
+
+On PostgreSQL 14 and later, the scans of such foreign data wrappers below
+the same Append node run concurrently, and their rows are returned as they
+arrive.
+"""
+import asyncio
+import os
+from weakref import WeakSet
+
+from . import ForeignDataWrapper
+
+
+class AsyncForeignDataWrapper(ForeignDataWrapper):
+    """Base class for asynchronous foreign data wrappers.
+
+    The :meth:`execute` method of subclasses is an asynchronous generator,
+    for example::
+
+        async def execute(self, quals, columns, sortkeys=None):
+            for url in self.urls:
+                rows = await fetch_json(url)
+                for row in rows:
+                    yield row
+
+    Every scan of the backend is driven by the event loop returned by
+    :func:`get_event_loop`. When several scans are below the same Append
+    node, PostgreSQL requests a row from each of them and waits for the
+    first one to arrive.
+
+    The "batch_size" option only applies to inserts.
+    """
+
+
+_loop = None
+
+# Scans waited for by each requestor (Append node), see AsyncScan.wait
+_waiting = {}
+
+
+def get_event_loop():
+    """Return the event loop running the asynchronous scans of the backend.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+
+def _forget(scan):
+    """Stop waiting for a scan, and forget the requestors left without any.
+    """
+    for requestor, scans in list(_waiting.items()):
+        scans.discard(scan)
+        if not scans:
+            del _waiting[requestor]
+
+
+class AsyncScan(object):
+    """
+    Internal class wrapping the asynchronous iterable returned by execute.
+
+    It can be iterated over like the result of a synchronous scan, or polled
+    from c code by the asynchronous executor. In that case, a pipe becomes
+    readable once the next row has been fetched.
+    """
+
+    def __init__(self, iterable):
+        self.loop = get_event_loop()
+        self.iterator = iterable.__aiter__()
+        self.task = None
+        self.reader, self.writer = os.pipe()
+        os.set_blocking(self.reader, False)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        task = self._fetch()
+        if not task.done():
+            self.loop.run_until_complete(asyncio.wait([task]))
+        self._consume()
+        try:
+            return task.result()
+        except StopAsyncIteration:
+            raise StopIteration
+
+    def _fetch(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.iterator.__anext__(),
+                                              loop=self.loop)
+            self.task.add_done_callback(self._wakeup)
+        return self.task
+
+    def _wakeup(self, task):
+        try:
+            os.write(self.writer, b'\0')
+        except OSError:
+            pass
+
+    def _consume(self):
+        self.task = None
+        _forget(self)
+        try:
+            os.read(self.reader, 4096)
+        except OSError:
+            pass
+
+    def _run(self, tasks, timeout):
+        self.loop.run_until_complete(asyncio.wait(
+            tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED))
+
+    def fileno(self):
+        return self.reader
+
+    def poll(self):
+        """Start fetching the next row, and tell if it is already there."""
+        task = self._fetch()
+        if not task.done():
+            self._run([task], 0)
+        return task.done()
+
+    def wait(self, requestor, timeout):
+        """Run the event loop until the next row of this scan, or of another
+        scan waited for by the same requestor, has been fetched.
+
+        Returns True if one of them is there before the timeout.
+        """
+        scans = _waiting.setdefault(requestor, WeakSet())
+        scans.add(self)
+        self._fetch()
+        tasks = set(scan.task for scan in scans if scan.task is not None)
+        if not any(task.done() for task in tasks):
+            self._run(tasks, timeout)
+        return any(task.done() for task in tasks)
+
+    def close(self):
+        # __init__ may have failed before setting every attribute
+        task = getattr(self, 'task', None)
+        if task is not None and not task.done():
+            task.cancel()
+        self.task = None
+        _forget(self)
+        if getattr(self, 'reader', None) is not None:
+            os.close(self.reader)
+            os.close(self.writer)
+            self.reader = self.writer = None
+
+    __del__ = close
@@ -73,6 +73,11 @@ Other options
 ``schema``
   The schema in which this table resides on the remote side
 
+When the ``shared_instance`` option is set to ``true`` on the server, the
+foreign tables of that server share a single engine, and thus a single pool of
+connections. The connection options must then be set on the server, or on the
+user mapping.
+
 When defining the table, the local column names will be used to retrieve the
 remote column data.
 Moreover, the local column types will be used to interpret the results in the
@@ -154,7 +159,7 @@ from . import ForeignDataWrapper, TableDefinition, ColumnDefinition
 from .utils import log_to_postgres, ERROR, WARNING, DEBUG
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import make_url, URL
-from sqlalchemy.sql import select, operators as sqlops, and_
+from sqlalchemy.sql import select, func, operators as sqlops, and_
 from sqlalchemy.sql.expression import nullsfirst, nullslast
 
 # Handle the sqlalchemy 0.8 / 0.9 changes
@@ -273,13 +278,24 @@ class SqlAlchemyFdw(ForeignDataWrapper):
 
     """
 
-    def __init__(self, fdw_options, fdw_columns):
+    def __init__(self, fdw_options, fdw_columns, engine=None):
         super(SqlAlchemyFdw, self).__init__(fdw_options, fdw_columns)
-        if 'tablename' not in fdw_options:
+        self.transaction = None
+        self._connection = None
+        self._row_id_column = fdw_options.get('primary_key', None)
+        self.table = None
+        # The engine is disposed on close, unless it is shared
+        self._owns_engine = engine is None
+        if 'tablename' not in fdw_options and fdw_columns:
             log_to_postgres('The tablename parameter is required', ERROR)
+        if engine is None:
+            url = _parse_url_from_options(fdw_options)
+            engine = create_engine(url)
+        self.engine = engine
+        if not fdw_columns and 'tablename' not in fdw_options:
+            # Shared instance of a server: it only holds the engine
+            return
         self.metadata = MetaData()
-        url = _parse_url_from_options(fdw_options)
-        self.engine = create_engine(url)
         schema = fdw_options['schema'] if 'schema' in fdw_options else None
         tablename = fdw_options['tablename']
         sqlacols = []
@@ -288,11 +304,20 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             sqlacols.append(Column(col.column_name, col_type))
         self.table = Table(tablename, self.metadata, schema=schema,
                            *sqlacols)
-        self.transaction = None
-        self._connection = None
-        self._row_id_column = fdw_options.get('primary_key', None)
 
+    def for_table(self, fdw_options, fdw_columns):
+        """
+        The foreign tables of a server share the engine, and thus the
+        connection pool, of its instance.
+        """
+        return type(self)(fdw_options, fdw_columns, engine=self.engine)
 
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._owns_engine:
+            self.engine.dispose()
 
     def _need_explicit_null_ordering(self, key):
         support = SORT_SUPPORT[self.engine.dialect.name]
@@ -321,12 +346,42 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             return []
         return sortkeys
 
+    def can_limit(self, limit, offset, quals, sortkeys):
+        # Rows must not be filtered locally after the limit
+        return all(qual.operator in OPERATORS for qual in quals)
+
+    def can_aggregate(self, groups, aggs, quals):
+        # Rows must not be filtered locally before they are aggregated
+        return all(qual.operator in OPERATORS for qual in quals)
+
+    def execute_aggregate(self, groups, aggs, quals):
+        """
+        The aggregates are computed by the foreign db, grouped by the
+        given columns.
+        """
+        groups = [self.table.c[col] for col in groups]
+        columns = list(groups)
+        for function, col in aggs:
+            function = getattr(func, function)
+            if col is None:
+                columns.append(function())
+            else:
+                columns.append(function(self.table.c[col]))
+        statement = self._build_statement(quals, [], [])
+        statement = statement.with_only_columns(columns)
+        if groups:
+            statement = statement.group_by(*groups)
+        log_to_postgres(str(statement), DEBUG)
+        for item in self.connection.execute(statement):
+            yield tuple(item)
+
     def explain(self, quals, columns, sortkeys=None, verbose=False):
         sortkeys = sortkeys or []
         statement = self._build_statement(quals, columns, sortkeys)
         return [str(statement)]
 
-    def _build_statement(self, quals, columns, sortkeys):
+    def _build_statement(self, quals, columns, sortkeys, limit=None,
+                         offset=0):
         statement = select([self.table])
         clauses = []
         for qual in quals:
@@ -355,15 +410,20 @@ class SqlAlchemyFdw(ForeignDataWrapper):
             if null_ordering:
                 column = null_ordering(column)
             statement = statement.order_by(column)
+        if limit is not None:
+            statement = statement.limit(limit)
+        if offset:
+            statement = statement.offset(offset)
         return statement
 
 
-    def execute(self, quals, columns, sortkeys=None):
+    def execute(self, quals, columns, sortkeys=None, limit=None, offset=0):
         """
         The quals are turned into an and'ed where clause.
         """
         sortkeys = sortkeys or []
-        statement = self._build_statement(quals, columns, sortkeys)
+        statement = self._build_statement(quals, columns, sortkeys, limit,
+                                          offset)
         log_to_postgres(str(statement), DEBUG)
         rs = (self.connection
               .execution_options(stream_results=True)
@@ -412,6 +472,9 @@ class SqlAlchemyFdw(ForeignDataWrapper):
     def insert(self, values):
         self.connection.execute(self.table.insert(values=values))
 
+    def bulk_insert(self, rows):
+        self.connection.execute(self.table.insert(), rows)
+
     def update(self, rowid, newvalues):
         self.connection.execute(
             self.table.update()
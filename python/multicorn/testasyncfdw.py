@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from multicorn.asyncfdw import AsyncForeignDataWrapper
+
+
+class AsyncTestForeignDataWrapper(AsyncForeignDataWrapper):
+
+    def __init__(self, options, columns):
+        super(AsyncTestForeignDataWrapper, self).__init__(options, columns)
+        self.name = options.get('name', 'async')
+        self.delay = float(options.get('delay', 0))
+
+    async def execute(self, quals, columns, sortkeys=None):
+        for index in range(10):
+            await asyncio.sleep(self.delay)
+            yield {'test1': '%s %s' % (self.name, index), 'test2': index}
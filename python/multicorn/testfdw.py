@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
-from multicorn import ForeignDataWrapper, TableDefinition, ColumnDefinition
+from multicorn import (ForeignDataWrapper, TableDefinition, ColumnDefinition,
+                       ColumnBatch)
 from multicorn.compat import unicode_
 from .utils import log_to_postgres, WARNING, ERROR
-from itertools import cycle
-from datetime import datetime
+from array import array
+import ctypes
+from itertools import cycle, islice
+from datetime import datetime, timedelta, tzinfo
+from decimal import Decimal
 from operator import itemgetter
 
 
@@ -18,7 +22,7 @@ class TestForeignDataWrapper(ForeignDataWrapper):
         self.test_subtype = options.get('test_subtype', None)
         self.tx_hook = options.get('tx_hook', False)
         self._row_id_column = options.get('row_id_column',
-                                          list(self.columns.keys())[0])
+                                          next(iter(self.columns), None))
         log_to_postgres(str(sorted(options.items())))
         log_to_postgres(str(sorted([(key, column.type_name) for key, column in
                                     columns.items()])))
@@ -41,6 +45,8 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                     else:
                         line.append('%s %s %s' % (column_name,
                                                   next(random_thing), index))
+                if self.test_subtype == 'short':
+                    line.pop()
             else:
                 line = {}
                 for column_name, column in self.columns.items():
@@ -69,14 +75,51 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                             [column_name, column_name],
                             [next(random_thing), '{some value, \\" 2}'],
                             [index, '%s,"%s"' % (column_name, index)]]
+                    elif self.test_type == 'buffer':
+                        value = ('%s %s %s' % (column_name, next(random_thing),
+                                               index)).encode('utf-8')
+                        if column_name == 'test1':
+                            line[column_name] = bytearray(value)
+                        else:
+                            line[column_name] = memoryview(value)
                     elif self.test_type == 'float':
                         line[column_name] = 1. / float(next(random_thing))
+                    elif self.test_type == 'json':
+                        if column.type_name == 'jsonb':
+                            line[column_name] = {
+                                "column": column_name,
+                                "index": index,
+                                "flags": [True, False, None],
+                                "ratio": 0.5}
+                        else:
+                            line[column_name] = [
+                                column_name, index, {"quote": 'say "hi"'},
+                                (None, 0.5)]
                     else:
                         line[column_name] = '%s %s %s' % (column_name,
                                                           next(random_thing),
                                                           index)
             yield line
 
+    def _as_column_batches(self):
+        # Two batches of 10 rows, with a NULL in test1 every 3 rows
+        for start in (0, 10):
+            values = {}
+            indexes = range(start, start + 10)
+            for column_name, column in self.columns.items():
+                if column.type_name == 'integer':
+                    values[column_name] = array('l', indexes)
+                elif column.type_name == 'double precision':
+                    values[column_name] = array('d', [i / 4. for i in indexes])
+                else:
+                    values[column_name] = ['%s %s' % (column_name, i)
+                                           for i in indexes]
+            bitmap = bytearray(2)
+            for i, index in enumerate(indexes):
+                if index % 3 == 0:
+                    bitmap[i >> 3] |= 1 << (i & 7)
+            yield ColumnBatch(values, nulls={'test1': bitmap})
+
     def execute(self, quals, columns, sortkeys=None):
         sortkeys = sortkeys or []
         log_to_postgres(str(sorted(quals)))
@@ -89,6 +132,8 @@ class TestForeignDataWrapper(ForeignDataWrapper):
             return None
         elif self.test_type == 'iter_none':
             return [None, None]
+        elif self.test_type == 'columnar':
+            return self._as_column_batches()
         else:
             if (len(sortkeys) > 0):
                 # testfdw don't have tables with more than 2 fields, without
@@ -114,6 +159,11 @@ class TestForeignDataWrapper(ForeignDataWrapper):
             return [(('test1',), 1)]
         return []
 
+    def get_type_hints(self):
+        if self.test_type == 'int':
+            return dict((name, int) for name in self.columns)
+        return {}
+
     def can_sort(self, sortkeys):
         # assume sort pushdown ok for all cols, in any order, any collation
         return sortkeys
@@ -142,6 +192,17 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                 values[key] = "INSERTED: %s" % values.get(key, None)
             return values
 
+    def bulk_insert(self, rows):
+        log_to_postgres("BULK INSERTING: %d rows" % len(rows))
+        for values in rows:
+            self.insert(values)
+
+    def for_table(self, options, columns):
+        return TestForeignDataWrapper(options, columns)
+
+    def close(self):
+        log_to_postgres('CLOSE')
+
     @property
     def rowid_column(self):
         return self._row_id_column
@@ -198,3 +259,316 @@ class TestForeignDataWrapper(ForeignDataWrapper):
                                      options={"option1": "value1"}))
             rv.append(table)
         return rv
+
+
+class PartitionedTestForeignDataWrapper(TestForeignDataWrapper):
+
+    def get_partitions(self, quals, columns):
+        return [(start, start + 5) for start in range(0, 20, 5)]
+
+    def execute_partition(self, partition, quals, columns):
+        start, stop = partition
+        return islice(self._as_generator(quals, columns), start, stop)
+
+
+class DirectModifyTestForeignDataWrapper(TestForeignDataWrapper):
+
+    def direct_modify(self, kind, quals, assignments, returning):
+        log_to_postgres("DIRECT %s: %s %s RETURNING %s" % (
+            kind.upper(), sorted(quals),
+            sorted(assignments.items()), returning))
+        if returning:
+            return [dict((column, '%s %sd' % (column, kind))
+                         for column in returning)]
+        return 1
+
+
+class BatchTestForeignDataWrapper(TestForeignDataWrapper):
+
+    def execute_batches(self, quals, columns, sortkeys=None, batch_size=1000,
+                        **kwargs):
+        log_to_postgres("BATCHES OF %d" % batch_size)
+        return super(BatchTestForeignDataWrapper, self).execute_batches(
+            quals, columns, sortkeys, batch_size, **kwargs)
+
+
+class LimitTestForeignDataWrapper(TestForeignDataWrapper):
+
+    def can_limit(self, limit, offset, quals, sortkeys):
+        return True
+
+    def execute(self, quals, columns, sortkeys=None, limit=None, offset=0):
+        log_to_postgres("LIMIT %s OFFSET %s" % (limit, offset))
+        rows = super(LimitTestForeignDataWrapper, self).execute(
+            quals, columns, sortkeys)
+        stop = None if limit is None else offset + limit
+        return islice(rows, offset, stop)
+
+
+class AggregateTestForeignDataWrapper(TestForeignDataWrapper):
+
+    def _rows(self, quals):
+        for index in range(20):
+            row = {'test1': 'group %d' % (index % 3), 'test2': index}
+            if all(row[qual.field_name] == qual.value for qual in quals
+                   if qual.operator == '='):
+                yield row
+
+    def execute(self, quals, columns, sortkeys=None):
+        log_to_postgres(str(sorted(quals)))
+        log_to_postgres(str(sorted(columns)))
+        return self._rows(quals)
+
+    def get_rel_size(self, quals, columns):
+        return (1000, len(columns) * 10)
+
+    def can_aggregate(self, groups, aggs, quals):
+        return all(qual.operator == '=' for qual in quals)
+
+    def execute_aggregate(self, groups, aggs, quals):
+        log_to_postgres("AGGREGATE: %s %s %s" % (sorted(quals), groups, aggs))
+        grouped = {}
+        for row in self._rows(quals):
+            key = tuple(row[column] for column in groups)
+            grouped.setdefault(key, []).append(row)
+        if not groups:
+            grouped.setdefault((), [])
+        functions = {'sum': sum, 'min': min, 'max': max,
+                     'avg': lambda values: float(sum(values)) / len(values)}
+        for key, rows in sorted(grouped.items()):
+            line = list(key)
+            for function, column in aggs:
+                if column is None:
+                    # count(*)
+                    line.append(len(rows))
+                    continue
+                values = [row[column] for row in rows
+                          if row[column] is not None]
+                if function == 'count':
+                    line.append(len(values))
+                elif values:
+                    line.append(functions[function](values))
+                else:
+                    line.append(None)
+            yield line
+
+
+class FixedOffset(tzinfo):
+
+    def __init__(self, minutes):
+        self.offset = timedelta(minutes=minutes)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+
+class ValuesTestForeignDataWrapper(ForeignDataWrapper):
+    """Return a single row, made of the python expressions given in the
+    "value" option of each column."""
+
+    def __init__(self, options, columns):
+        super(ValuesTestForeignDataWrapper, self).__init__(options, columns)
+        namespace = {'datetime': datetime, 'Decimal': Decimal,
+                     'FixedOffset': FixedOffset}
+        self.row = dict((name, eval(column.options['value'], namespace))
+                        for name, column in columns.items())
+
+    def execute(self, quals, columns):
+        return [self.row]
+
+
+# The Arrow C data interface, to test arrow scans without pyarrow.
+
+class ArrowSchema(ctypes.Structure):
+    pass
+
+
+class ArrowArray(ctypes.Structure):
+    pass
+
+
+class ArrowArrayStream(ctypes.Structure):
+    pass
+
+
+RELEASE_ARRAY = ctypes.CFUNCTYPE(None, ctypes.POINTER(ArrowArray))
+
+ArrowSchema._fields_ = [
+    ('format', ctypes.c_char_p),
+    ('name', ctypes.c_char_p),
+    ('metadata', ctypes.c_char_p),
+    ('flags', ctypes.c_int64),
+    ('n_children', ctypes.c_int64),
+    ('children', ctypes.POINTER(ctypes.POINTER(ArrowSchema))),
+    ('dictionary', ctypes.POINTER(ArrowSchema)),
+    ('release', ctypes.c_void_p),
+    ('private_data', ctypes.c_void_p)]
+
+ArrowArray._fields_ = [
+    ('length', ctypes.c_int64),
+    ('null_count', ctypes.c_int64),
+    ('offset', ctypes.c_int64),
+    ('n_buffers', ctypes.c_int64),
+    ('n_children', ctypes.c_int64),
+    ('buffers', ctypes.POINTER(ctypes.c_void_p)),
+    ('children', ctypes.POINTER(ctypes.POINTER(ArrowArray))),
+    ('dictionary', ctypes.POINTER(ArrowArray)),
+    ('release', RELEASE_ARRAY),
+    ('private_data', ctypes.c_void_p)]
+
+GET_SCHEMA = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ArrowArrayStream),
+                              ctypes.POINTER(ArrowSchema))
+GET_NEXT = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ArrowArrayStream),
+                            ctypes.POINTER(ArrowArray))
+GET_LAST_ERROR = ctypes.CFUNCTYPE(ctypes.c_void_p,
+                                  ctypes.POINTER(ArrowArrayStream))
+RELEASE_STREAM = ctypes.CFUNCTYPE(None, ctypes.POINTER(ArrowArrayStream))
+
+ArrowArrayStream._fields_ = [
+    ('get_schema', GET_SCHEMA),
+    ('get_next', GET_NEXT),
+    ('get_last_error', GET_LAST_ERROR),
+    ('release', RELEASE_STREAM),
+    ('private_data', ctypes.c_void_p)]
+
+_capsule_new = ctypes.pythonapi.PyCapsule_New
+_capsule_new.restype = ctypes.py_object
+_capsule_new.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_void_p]
+
+# The capsule names must outlive the capsules.
+_SCHEMA_NAME = b'arrow_schema'
+_ARRAY_NAME = b'arrow_array'
+_STREAM_NAME = b'arrow_array_stream'
+
+
+@RELEASE_ARRAY
+def _release_array(array):
+    array.contents.release = RELEASE_ARRAY()
+
+
+class ArrowTestBatch(object):
+    """A record batch exposing __arrow_c_array__ like pyarrow.RecordBatch,
+    built from (name, format, values) tuples."""
+
+    def __init__(self, fields):
+        self._buffers = []
+        schemas = (ctypes.POINTER(ArrowSchema) * len(fields))()
+        arrays = (ctypes.POINTER(ArrowArray) * len(fields))()
+        for index, (name, format, values) in enumerate(fields):
+            schema, array = self._field(name, format, values)
+            schemas[index] = ctypes.pointer(schema)
+            arrays[index] = ctypes.pointer(array)
+        self.schema = ArrowSchema(format=b'+s', name=b'',
+                                  n_children=len(fields), children=schemas)
+        buffers = (ctypes.c_void_p * 1)()
+        self.array = ArrowArray(length=len(fields[0][2]), n_buffers=1,
+                                buffers=buffers, n_children=len(fields),
+                                children=arrays)
+        self._buffers.extend([schemas, arrays, buffers])
+
+    def _field(self, name, format, values):
+        validity = (ctypes.c_uint8 * ((len(values) + 7) // 8))()
+        for index, value in enumerate(values):
+            if value is not None:
+                validity[index >> 3] |= 1 << (index & 7)
+        if format == 'u':
+            encoded = [(value or '').encode('utf-8') for value in values]
+            offsets = [0]
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+            buffers = [validity,
+                       (ctypes.c_int32 * len(offsets))(*offsets),
+                       ctypes.create_string_buffer(b''.join(encoded))]
+        elif format == 'b':
+            bits = (ctypes.c_uint8 * len(validity))()
+            for index, value in enumerate(values):
+                if value:
+                    bits[index >> 3] |= 1 << (index & 7)
+            buffers = [validity, bits]
+        else:
+            ctype = {'g': ctypes.c_double, 'tdD': ctypes.c_int32}.get(
+                format, ctypes.c_int64)
+            buffers = [validity, (ctype * len(values))(
+                *[value or 0 for value in values])]
+        pointers = (ctypes.c_void_p * len(buffers))(
+            *[ctypes.addressof(buffer) for buffer in buffers])
+        self._buffers.extend(buffers)
+        self._buffers.append(pointers)
+        schema = ArrowSchema(format=format.encode('ascii'),
+                             name=name.encode('ascii'))
+        array = ArrowArray(length=len(values),
+                           null_count=values.count(None),
+                           n_buffers=len(buffers), buffers=pointers)
+        return schema, array
+
+    def __arrow_c_array__(self, requested_schema=None):
+        return (_capsule_new(ctypes.addressof(self.schema), _SCHEMA_NAME,
+                             None),
+                _capsule_new(ctypes.addressof(self.array), _ARRAY_NAME, None))
+
+
+class ArrowTestStream(object):
+    """A stream of ArrowTestBatch, exposing __arrow_c_stream__."""
+
+    def __init__(self, batches):
+        self.batches = batches
+
+    def __arrow_c_stream__(self, requested_schema=None):
+        batches = iter(self.batches)
+
+        def get_schema(stream, out):
+            ctypes.memmove(out, ctypes.addressof(self.batches[0].schema),
+                           ctypes.sizeof(ArrowSchema))
+            return 0
+
+        def get_next(stream, out):
+            batch = next(batches, None)
+            if batch is None:
+                out.contents.release = RELEASE_ARRAY()
+            else:
+                ctypes.memmove(out, ctypes.addressof(batch.array),
+                               ctypes.sizeof(ArrowArray))
+                out.contents.release = _release_array
+            return 0
+
+        # The callbacks must outlive the stream.
+        self.stream = ArrowArrayStream(get_schema=GET_SCHEMA(get_schema),
+                                       get_next=GET_NEXT(get_next),
+                                       get_last_error=GET_LAST_ERROR(),
+                                       release=RELEASE_STREAM())
+        return _capsule_new(ctypes.addressof(self.stream), _STREAM_NAME, None)
+
+
+class ArrowTestForeignDataWrapper(ForeignDataWrapper):
+
+    def __init__(self, options, columns):
+        super(ArrowTestForeignDataWrapper, self).__init__(options, columns)
+        self.test_type = options.get('test_type', None)
+        self.batches = [
+            ArrowTestBatch([
+                ('id', 'l', [1, 2, None]),
+                ('name', 'u', ['one', None, 'three']),
+                ('ratio', 'g', [0.5, 1.5, 2.5]),
+                ('day', 'tdD', [0, 15000, None]),
+                ('stamp', 'tsu:', [0, 3600 * 10 ** 6, None]),
+                ('stamptz', 'tsu:UTC', [0, 3600 * 10 ** 6, None]),
+                ('flag', 'b', [True, False, None])]),
+            ArrowTestBatch([
+                ('id', 'l', [4, 5]),
+                ('name', 'u', ['four', 'five']),
+                ('ratio', 'g', [1e50, None]),
+                ('day', 'tdD', [-1, 365]),
+                ('stamp', 'tsu:', [-10 ** 6, 0]),
+                ('stamptz', 'tsu:UTC', [-10 ** 6, 0]),
+                ('flag', 'b', [True, True])])]
+
+    def execute(self, quals, columns):
+        if self.test_type == 'stream':
+            return ArrowTestStream(self.batches)
+        return self.batches
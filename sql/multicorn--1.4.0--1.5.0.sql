@@ -0,0 +1,11 @@
+-- complain if script is sourced in psql, rather than via ALTER EXTENSION
+\echo Use "ALTER EXTENSION multicorn UPDATE TO '1.5.0'" to load this file. \quit
+
+-- list the fdw instances cached by the current backend
+CREATE OR REPLACE FUNCTION multicorn_cache_stats (
+    OUT foreign_table regclass,
+    OUT memory bigint,
+    OUT in_transaction bool)
+RETURNS SETOF record
+AS 'MODULE_PATHNAME'
+LANGUAGE C STRICT;
@@ -11,3 +11,12 @@ LANGUAGE C STRICT;
 
 CREATE FOREIGN DATA WRAPPER multicorn
 VALIDATOR multicorn_validator HANDLER multicorn_handler;
+
+-- list the fdw instances cached by the current backend
+CREATE OR REPLACE FUNCTION multicorn_cache_stats (
+    OUT foreign_table regclass,
+    OUT memory bigint,
+    OUT in_transaction bool)
+RETURNS SETOF record
+AS 'MODULE_PATHNAME'
+LANGUAGE C STRICT;
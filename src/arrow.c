@@ -0,0 +1,745 @@
+/*-------------------------------------------------------------------------
+ *
+ * The Multicorn Foreign Data Wrapper allows you to fetch foreign data in
+ * Python in your PostgreSQL server.
+ *
+ * This module reads scan results exposed through the Arrow C data
+ * interface (pyarrow RecordBatch and Table, or any object implementing
+ * __arrow_c_array__ or __arrow_c_stream__), directly into datums.
+ *
+ * This software is released under the postgresql licence
+ *
+ * author: Kozea
+ *
+ *
+ *-------------------------------------------------------------------------
+ */
+#include "multicorn.h"
+#include "mb/pg_wchar.h"
+#include "utils/date.h"
+#include "utils/lsyscache.h"
+#include "utils/timestamp.h"
+
+/*
+ * The Arrow C data interface ABI.
+ *
+ * See https://arrow.apache.org/docs/format/CDataInterface.html
+ */
+#ifndef ARROW_C_DATA_INTERFACE
+#define ARROW_C_DATA_INTERFACE
+
+struct ArrowSchema
+{
+	const char *format;
+	const char *name;
+	const char *metadata;
+	int64_t		flags;
+	int64_t		n_children;
+	struct ArrowSchema **children;
+	struct ArrowSchema *dictionary;
+	void		(*release) (struct ArrowSchema *);
+	void	   *private_data;
+};
+
+struct ArrowArray
+{
+	int64_t		length;
+	int64_t		null_count;
+	int64_t		offset;
+	int64_t		n_buffers;
+	int64_t		n_children;
+	const void **buffers;
+	struct ArrowArray **children;
+	struct ArrowArray *dictionary;
+	void		(*release) (struct ArrowArray *);
+	void	   *private_data;
+};
+#endif   /* ARROW_C_DATA_INTERFACE */
+
+#ifndef ARROW_C_STREAM_INTERFACE
+#define ARROW_C_STREAM_INTERFACE
+
+struct ArrowArrayStream
+{
+	int			(*get_schema) (struct ArrowArrayStream *, struct ArrowSchema *out);
+	int			(*get_next) (struct ArrowArrayStream *, struct ArrowArray *out);
+	const char *(*get_last_error) (struct ArrowArrayStream *);
+	void		(*release) (struct ArrowArrayStream *);
+	void	   *private_data;
+};
+#endif   /* ARROW_C_STREAM_INTERFACE */
+
+/* The arrow types we know how to read. */
+typedef enum MulticornArrowType
+{
+	ARROW_MISSING,
+	ARROW_BOOL,
+	ARROW_INT8,
+	ARROW_UINT8,
+	ARROW_INT16,
+	ARROW_UINT16,
+	ARROW_INT32,
+	ARROW_UINT32,
+	ARROW_INT64,
+	ARROW_UINT64,
+	ARROW_FLOAT32,
+	ARROW_FLOAT64,
+	ARROW_STRING,
+	ARROW_LARGE_STRING,
+	ARROW_BINARY,
+	ARROW_LARGE_BINARY,
+	ARROW_DATE32,
+	ARROW_DATE64,
+	ARROW_TIMESTAMP
+}	MulticornArrowType;
+
+typedef struct MulticornArrowColumn
+{
+	MulticornArrowType type;
+	/* Child of the record batch holding the column values. */
+	int			child;
+	/* Timestamps: multiplier and divisor to get microseconds */
+	int64		usecs_mul;
+	int64		usecs_div;
+	/* Timestamps: whether a timezone is attached to the values */
+	bool		has_timezone;
+}	MulticornArrowColumn;
+
+struct MulticornArrowState
+{
+	/* The python objects owning the arrow structures we read. */
+	PyObject   *p_owner;
+	struct ArrowSchema *schema;
+	struct ArrowArray *array;
+	/* Streams: the stream, and the schema and batch we own. */
+	struct ArrowArrayStream *stream;
+	struct ArrowSchema stream_schema;
+	struct ArrowArray stream_array;
+	int64		index;
+	int			natts;
+	MulticornArrowColumn *columns;
+};
+
+MulticornArrowType arrowTypeFromFormat(const char *format,
+					MulticornArrowColumn * column);
+void		arrowPrepareColumns(MulticornArrowState * state,
+					ConversionInfo ** cinfos);
+bool		arrowNextStreamBatch(MulticornArrowState * state);
+void		arrowReleaseBatch(MulticornArrowState * state);
+bool		arrowIsValid(const struct ArrowArray *array, int64 index);
+Datum		arrowValueToDatum(MulticornArrowColumn * column,
+				  const struct ArrowArray *array, int64 index,
+				  ConversionInfo * cinfo);
+Datum		arrowIntToDatum(int64 value, ConversionInfo * cinfo);
+Datum		arrowFloatToDatum(double value, ConversionInfo * cinfo);
+Datum		arrowStringToDatum(const char *data, int64 length, bool binary,
+				   ConversionInfo * cinfo);
+Datum		convertDatum(Datum value, Oid typeoid, ConversionInfo * cinfo);
+void	   *arrowCapsulePointer(PyObject *p_capsule, const char *name);
+
+
+/*
+ * Allocate the state used to read arrow batches, for a scan on a relation
+ * with natts attributes.
+ */
+MulticornArrowState *
+initArrowState(int natts)
+{
+	MulticornArrowState *state = palloc0(sizeof(MulticornArrowState));
+
+	state->natts = natts;
+	state->columns = palloc0(sizeof(MulticornArrowColumn) * natts);
+	return state;
+}
+
+/*
+ * Returns true if the value exposes the Arrow C data interface.
+ */
+bool
+isArrowBatch(PyObject *p_value)
+{
+	/* Last static type known not to be an arrow object */
+	static PyTypeObject *row_type = NULL;
+
+	/* Avoid attribute lookups for regular rows. */
+	if (Py_TYPE(p_value) == row_type || PyDict_Check(p_value) ||
+		PyTuple_Check(p_value) || PyList_Check(p_value))
+	{
+		return false;
+	}
+	if (PyObject_HasAttrString(p_value, "__arrow_c_stream__") ||
+		PyObject_HasAttrString(p_value, "__arrow_c_array__"))
+	{
+		return true;
+	}
+	/* Heap types may go away, only remember the static ones. */
+	if (!PyType_HasFeature(Py_TYPE(p_value), Py_TPFLAGS_HEAPTYPE))
+	{
+		row_type = Py_TYPE(p_value);
+	}
+	return false;
+}
+
+void *
+arrowCapsulePointer(PyObject *p_capsule, const char *name)
+{
+	void	   *pointer;
+
+	if (p_capsule == NULL || !PyCapsule_IsValid(p_capsule, name))
+	{
+		ereport(ERROR, (errmsg("Invalid arrow object"),
+						errdetail("Expected a PyCapsule named %s", name)));
+	}
+	pointer = PyCapsule_GetPointer(p_capsule, name);
+	errorCheck();
+	return pointer;
+}
+
+/*
+ * Start reading an arrow record batch, table or stream.
+ *
+ * Record batches are read in place, while they are kept alive by their
+ * capsules. Streams are read one batch at a time.
+ */
+void
+beginArrowBatch(MulticornArrowState * state, PyObject *p_value,
+				ConversionInfo ** cinfos)
+{
+	endArrowBatch(state);
+	if (PyObject_HasAttrString(p_value, "__arrow_c_stream__"))
+	{
+		PyObject   *p_capsule = PyObject_CallMethod(p_value,
+													"__arrow_c_stream__",
+													"()");
+		int			error;
+
+		errorCheck();
+		state->p_owner = p_capsule;
+		state->stream = arrowCapsulePointer(p_capsule, "arrow_array_stream");
+		error = state->stream->get_schema(state->stream, &state->stream_schema);
+		if (error != 0)
+		{
+			const char *message = state->stream->get_last_error(state->stream);
+
+			state->stream_schema.release = NULL;
+			ereport(ERROR, (errmsg("Could not read the arrow stream schema"),
+							errdetail("%s", message ? message : strerror(error))));
+		}
+		state->schema = &state->stream_schema;
+		state->array = NULL;
+	}
+	else
+	{
+		PyObject   *p_capsules = PyObject_CallMethod(p_value,
+													 "__arrow_c_array__",
+													 "()");
+
+		errorCheck();
+		state->p_owner = p_capsules;
+		if (!PyTuple_Check(p_capsules) || PyTuple_Size(p_capsules) != 2)
+		{
+			ereport(ERROR, (errmsg("Invalid arrow object"),
+							errdetail("__arrow_c_array__ must return a tuple of two capsules")));
+		}
+		state->schema = arrowCapsulePointer(PyTuple_GET_ITEM(p_capsules, 0),
+											"arrow_schema");
+		state->array = arrowCapsulePointer(PyTuple_GET_ITEM(p_capsules, 1),
+										   "arrow_array");
+	}
+	state->index = 0;
+	arrowPrepareColumns(state, cinfos);
+}
+
+/*
+ * Match the relation attributes to the record batch fields, by name.
+ */
+void
+arrowPrepareColumns(MulticornArrowState * state, ConversionInfo ** cinfos)
+{
+	struct ArrowSchema *schema = state->schema;
+	int			i;
+
+	if (strcmp(schema->format, "+s") != 0)
+	{
+		ereport(ERROR, (errmsg("Invalid arrow object"),
+						errdetail("Only record batches (struct arrays) can be read, got format %s",
+								  schema->format)));
+	}
+	for (i = 0; i < state->natts; i++)
+	{
+		MulticornArrowColumn *column = &state->columns[i];
+		int64		child;
+
+		memset(column, 0, sizeof(MulticornArrowColumn));
+		column->type = ARROW_MISSING;
+		if (cinfos[i] == NULL)
+		{
+			continue;
+		}
+		for (child = 0; child < schema->n_children; child++)
+		{
+			struct ArrowSchema *field = schema->children[child];
+
+			if (field->name != NULL && strcmp(field->name, cinfos[i]->attrname) == 0)
+			{
+				column->child = (int) child;
+				column->type = arrowTypeFromFormat(field->format, column);
+				if (column->type == ARROW_MISSING || field->dictionary != NULL)
+				{
+					ereport(ERROR, (errmsg("Unsupported arrow type %s for column %s",
+										   field->format, cinfos[i]->attrname)));
+				}
+				break;
+			}
+		}
+	}
+}
+
+MulticornArrowType
+arrowTypeFromFormat(const char *format, MulticornArrowColumn * column)
+{
+	if (format[0] != '\0' && format[1] == '\0')
+	{
+		switch (format[0])
+		{
+			case 'b':
+				return ARROW_BOOL;
+			case 'c':
+				return ARROW_INT8;
+			case 'C':
+				return ARROW_UINT8;
+			case 's':
+				return ARROW_INT16;
+			case 'S':
+				return ARROW_UINT16;
+			case 'i':
+				return ARROW_INT32;
+			case 'I':
+				return ARROW_UINT32;
+			case 'l':
+				return ARROW_INT64;
+			case 'L':
+				return ARROW_UINT64;
+			case 'f':
+				return ARROW_FLOAT32;
+			case 'g':
+				return ARROW_FLOAT64;
+			case 'u':
+				return ARROW_STRING;
+			case 'U':
+				return ARROW_LARGE_STRING;
+			case 'z':
+				return ARROW_BINARY;
+			case 'Z':
+				return ARROW_LARGE_BINARY;
+			default:
+				return ARROW_MISSING;
+		}
+	}
+	if (strcmp(format, "tdD") == 0)
+	{
+		return ARROW_DATE32;
+	}
+	if (strcmp(format, "tdm") == 0)
+	{
+		return ARROW_DATE64;
+	}
+	/* Timestamps: ts[smun]:timezone */
+	if (strncmp(format, "ts", 2) == 0 && format[2] != '\0' && format[3] == ':')
+	{
+		column->usecs_mul = 1;
+		column->usecs_div = 1;
+		switch (format[2])
+		{
+			case 's':
+				column->usecs_mul = USECS_PER_SEC;
+				break;
+			case 'm':
+				column->usecs_mul = 1000;
+				break;
+			case 'u':
+				break;
+			case 'n':
+				column->usecs_div = 1000;
+				break;
+			default:
+				return ARROW_MISSING;
+		}
+		column->has_timezone = format[4] != '\0';
+		return ARROW_TIMESTAMP;
+	}
+	return ARROW_MISSING;
+}
+
+/*
+ * Fetch the next batch from the stream.
+ *
+ * Returns false at the end of the stream.
+ */
+bool
+arrowNextStreamBatch(MulticornArrowState * state)
+{
+	int			error;
+
+	arrowReleaseBatch(state);
+	error = state->stream->get_next(state->stream, &state->stream_array);
+	if (error != 0)
+	{
+		const char *message = state->stream->get_last_error(state->stream);
+
+		state->stream_array.release = NULL;
+		ereport(ERROR, (errmsg("Could not read the next arrow batch"),
+						errdetail("%s", message ? message : strerror(error))));
+	}
+	/* A released array marks the end of the stream. */
+	if (state->stream_array.release == NULL)
+	{
+		return false;
+	}
+	state->array = &state->stream_array;
+	state->index = 0;
+	return true;
+}
+
+/*
+ * Release the current batch of a stream.
+ */
+void
+arrowReleaseBatch(MulticornArrowState * state)
+{
+	if (state->stream != NULL && state->array != NULL)
+	{
+		if (state->stream_array.release != NULL)
+		{
+			state->stream_array.release(&state->stream_array);
+		}
+		state->array = NULL;
+	}
+}
+
+/*
+ * Release everything held for the current arrow object, if any.
+ */
+void
+endArrowBatch(MulticornArrowState * state)
+{
+	if (state->p_owner == NULL)
+	{
+		return;
+	}
+	arrowReleaseBatch(state);
+	if (state->stream != NULL && state->stream_schema.release != NULL)
+	{
+		state->stream_schema.release(&state->stream_schema);
+	}
+	state->stream = NULL;
+	state->schema = NULL;
+	state->array = NULL;
+	/* The capsules release the rest. */
+	Py_DECREF(state->p_owner);
+	state->p_owner = NULL;
+}
+
+bool
+arrowIsValid(const struct ArrowArray *array, int64 index)
+{
+	const uint8 *validity = (const uint8 *) array->buffers[0];
+
+	if (array->null_count == 0 || validity == NULL)
+	{
+		return true;
+	}
+	return (validity[index >> 3] >> (index & 7)) & 1;
+}
+
+/*
+ * Fill the slot with the next row of the current arrow object.
+ *
+ * Returns false, after releasing the arrow object, once it is exhausted.
+ */
+bool
+arrowBatchToTuple(MulticornArrowState * state, TupleTableSlot *slot,
+				  ConversionInfo ** cinfos, Bitmapset *required_attrs)
+{
+	int			i;
+	struct ArrowArray *array;
+
+	if (state->p_owner == NULL)
+	{
+		return false;
+	}
+	while (state->array == NULL || state->index >= state->array->length)
+	{
+		if (state->stream == NULL || !arrowNextStreamBatch(state))
+		{
+			endArrowBatch(state);
+			return false;
+		}
+	}
+	array = state->array;
+	for (i = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	{
+		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor, i);
+		AttrNumber	cinfo_idx = attr->attnum - 1;
+		MulticornArrowColumn *column = &state->columns[cinfo_idx];
+		struct ArrowArray *child;
+		int64		index;
+
+		slot->tts_values[i] = (Datum) 0;
+		slot->tts_isnull[i] = true;
+		if (cinfos[cinfo_idx] == NULL || column->type == ARROW_MISSING ||
+			!bms_is_member(attr->attnum, required_attrs))
+		{
+			continue;
+		}
+		child = array->children[column->child];
+		/* The offset of the record batch applies to its children */
+		index = child->offset + array->offset + state->index;
+		if (!arrowIsValid(child, index))
+		{
+			continue;
+		}
+		slot->tts_values[i] = arrowValueToDatum(column, child, index,
+												cinfos[cinfo_idx]);
+		slot->tts_isnull[i] = false;
+	}
+	state->index++;
+	return true;
+}
+
+/*
+ * Convert a datum of the given type to the column type, through their text
+ * representation. The output function is cached in the ConversionInfo.
+ */
+Datum
+convertDatum(Datum value, Oid typeoid, ConversionInfo * cinfo)
+{
+	DatumOutputInfo *outinfo;
+	char	   *str;
+
+	/* Type modifiers are enforced by the input function. */
+	if (typeoid == cinfo->atttypoid && cinfo->atttypmod < 0)
+	{
+		return value;
+	}
+	outinfo = getDatumOutputInfo(typeoid, cinfo);
+	str = OutputFunctionCall(&outinfo->outfunc, value);
+	return InputFunctionCall(cinfo->attinfunc, str, cinfo->attioparam,
+							 cinfo->atttypmod);
+}
+
+Datum
+arrowIntToDatum(int64 value, ConversionInfo * cinfo)
+{
+	switch (cinfo->atttypoid)
+	{
+		case INT2OID:
+			if (value >= SHRT_MIN && value <= SHRT_MAX)
+			{
+				return Int16GetDatum((int16) value);
+			}
+			break;
+		case INT4OID:
+			if (value >= INT_MIN && value <= INT_MAX)
+			{
+				return Int32GetDatum((int32) value);
+			}
+			break;
+		case FLOAT4OID:
+			return arrowFloatToDatum((double) value, cinfo);
+		case FLOAT8OID:
+			return Float8GetDatum((float8) value);
+		default:
+			break;
+	}
+	/* Out of range values are reported by the input function. */
+	return convertDatum(Int64GetDatum(value), INT8OID, cinfo);
+}
+
+/*
+ * Convert a float value to a float4 column, or through the text
+ * representation for other columns.
+ */
+Datum
+arrowFloatToDatum(double value, ConversionInfo * cinfo)
+{
+	if (cinfo->atttypoid == FLOAT4OID)
+	{
+		float4		shortvalue = (float4) value;
+
+		/* Let float4in complain about overflows and underflows */
+		if (!(isinf(shortvalue) && !isinf(value)) &&
+			!(shortvalue == 0.0 && value != 0.0))
+		{
+			return Float4GetDatum(shortvalue);
+		}
+	}
+	return convertDatum(Float8GetDatum(value), FLOAT8OID, cinfo);
+}
+
+Datum
+arrowStringToDatum(const char *data, int64 length, bool binary,
+				   ConversionInfo * cinfo)
+{
+	char	   *str;
+
+	if (cinfo->atttypoid == BYTEAOID)
+	{
+		return PointerGetDatum(cstring_to_text_with_len(data, length));
+	}
+	if (binary)
+	{
+		str = pnstrdup(data, length);
+	}
+	else
+	{
+		/* Arrow strings are utf8 */
+		str = pg_any_to_server(data, length, PG_UTF8);
+		if (str == data)
+		{
+			str = pnstrdup(data, length);
+		}
+		else
+		{
+			length = strlen(str);
+		}
+	}
+	if (cinfo->atttypoid == TEXTOID || cinfo->atttypoid == VARCHAROID)
+	{
+		return PointerGetDatum(cstring_to_text_with_len(str, length));
+	}
+	return InputFunctionCall(cinfo->attinfunc, str, cinfo->attioparam,
+							 cinfo->atttypmod);
+}
+
+Datum
+arrowValueToDatum(MulticornArrowColumn * column, const struct ArrowArray *array,
+				  int64 index, ConversionInfo * cinfo)
+{
+	const void *values = array->buffers[1];
+
+	switch (column->type)
+	{
+		case ARROW_BOOL:
+			{
+				bool		value = (((const uint8 *) values)[index >> 3] >> (index & 7)) & 1;
+
+				return convertDatum(BoolGetDatum(value), BOOLOID, cinfo);
+			}
+		case ARROW_INT8:
+			return arrowIntToDatum(((const int8 *) values)[index], cinfo);
+		case ARROW_UINT8:
+			return arrowIntToDatum(((const uint8 *) values)[index], cinfo);
+		case ARROW_INT16:
+			return arrowIntToDatum(((const int16 *) values)[index], cinfo);
+		case ARROW_UINT16:
+			return arrowIntToDatum(((const uint16 *) values)[index], cinfo);
+		case ARROW_INT32:
+			return arrowIntToDatum(((const int32 *) values)[index], cinfo);
+		case ARROW_UINT32:
+			return arrowIntToDatum(((const uint32 *) values)[index], cinfo);
+		case ARROW_INT64:
+			return arrowIntToDatum(((const int64 *) values)[index], cinfo);
+		case ARROW_UINT64:
+			{
+				uint64		value = ((const uint64 *) values)[index];
+				char		str[32];
+
+				if (value <= (uint64) INT64CONST(0x7FFFFFFFFFFFFFFF))
+				{
+					return arrowIntToDatum((int64) value, cinfo);
+				}
+				snprintf(str, sizeof(str), UINT64_FORMAT, value);
+				return InputFunctionCall(cinfo->attinfunc, str,
+										 cinfo->attioparam, cinfo->atttypmod);
+			}
+		case ARROW_FLOAT32:
+			if (cinfo->atttypoid == FLOAT4OID)
+			{
+				return Float4GetDatum(((const float4 *) values)[index]);
+			}
+			return convertDatum(Float8GetDatum(((const float4 *) values)[index]),
+								FLOAT8OID, cinfo);
+		case ARROW_FLOAT64:
+			return arrowFloatToDatum(((const float8 *) values)[index], cinfo);
+		case ARROW_STRING:
+		case ARROW_BINARY:
+			{
+				const int32 *offsets = (const int32 *) values;
+				const char *data = (const char *) array->buffers[2];
+
+				return arrowStringToDatum(data + offsets[index],
+										  offsets[index + 1] - offsets[index],
+										  column->type == ARROW_BINARY,
+										  cinfo);
+			}
+		case ARROW_LARGE_STRING:
+		case ARROW_LARGE_BINARY:
+			{
+				const int64 *offsets = (const int64 *) values;
+				const char *data = (const char *) array->buffers[2];
+
+				return arrowStringToDatum(data + offsets[index],
+										  offsets[index + 1] - offsets[index],
+										  column->type == ARROW_LARGE_BINARY,
+										  cinfo);
+			}
+		case ARROW_DATE32:
+			return convertDatum(DateADTGetDatum(((const int32 *) values)[index] +
+									 UNIX_EPOCH_JDATE - POSTGRES_EPOCH_JDATE),
+								DATEOID, cinfo);
+		case ARROW_DATE64:
+			{
+				int64		msecs = ((const int64 *) values)[index];
+				int64		days = msecs / (SECS_PER_DAY * INT64CONST(1000));
+
+				/* Round towards minus infinity */
+				if (msecs < 0 && msecs % (SECS_PER_DAY * INT64CONST(1000)) != 0)
+				{
+					days--;
+				}
+				return convertDatum(DateADTGetDatum(days + UNIX_EPOCH_JDATE -
+													POSTGRES_EPOCH_JDATE),
+									DATEOID, cinfo);
+			}
+		case ARROW_TIMESTAMP:
+			{
+				int64		value = ((const int64 *) values)[index];
+				int64		usecs;
+				Timestamp	result;
+
+				if (column->usecs_div > 1)
+				{
+					usecs = value / column->usecs_div;
+					if (value < 0 && value % column->usecs_div != 0)
+					{
+						usecs--;
+					}
+				}
+				else
+				{
+					usecs = value * column->usecs_mul;
+				}
+				usecs -= (POSTGRES_EPOCH_JDATE - UNIX_EPOCH_JDATE) * USECS_PER_DAY;
+#ifdef HAVE_INT64_TIMESTAMP
+				result = usecs;
+#else
+				result = usecs / (double) USECS_PER_SEC;
+#endif
+				/*
+				 * Timestamps with a timezone are instants, naive ones are
+				 * wall clock times.
+				 */
+				if (column->has_timezone)
+				{
+					return convertDatum(TimestampTzGetDatum(result),
+										TIMESTAMPTZOID, cinfo);
+				}
+				return convertDatum(TimestampGetDatum(result),
+									TIMESTAMPOID, cinfo);
+			}
+		default:
+			elog(ERROR, "Unexpected arrow type");
+	}
+	return (Datum) 0;
+}
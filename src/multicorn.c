@@ -12,15 +12,34 @@
 #include "optimizer/planmain.h"
 #include "optimizer/restrictinfo.h"
 #include "optimizer/clauses.h"
+#include "optimizer/cost.h"
 #if PG_VERSION_NUM < 120000
 #include "optimizer/var.h"
+#else
+#include "optimizer/optimizer.h"
+#endif
+#if PG_VERSION_NUM >= 120000
+#include "optimizer/tlist.h"
+#include "utils/selfuncs.h"
+#include "catalog/pg_aggregate.h"
+#include "catalog/pg_collation.h"
+#include "catalog/pg_namespace.h"
+#endif
+#if PG_VERSION_NUM >= 140000
+#include "optimizer/appendinfo.h"
 #endif
 #include "access/reloptions.h"
 #include "access/relscan.h"
 #include "access/sysattr.h"
 #include "access/xact.h"
+#if PG_VERSION_NUM >= 140000
+#include "executor/execAsync.h"
+#include "storage/latch.h"
+#endif
 #include "nodes/makefuncs.h"
 #include "catalog/pg_type.h"
+#include "utils/guc.h"
+#include "utils/inval.h"
 #include "utils/memutils.h"
 #include "miscadmin.h"
 #include "utils/lsyscache.h"
@@ -34,10 +53,12 @@ PG_MODULE_MAGIC;
 
 extern Datum multicorn_handler(PG_FUNCTION_ARGS);
 extern Datum multicorn_validator(PG_FUNCTION_ARGS);
+extern Datum multicorn_cache_stats(PG_FUNCTION_ARGS);
 
 
 PG_FUNCTION_INFO_V1(multicorn_handler);
 PG_FUNCTION_INFO_V1(multicorn_validator);
+PG_FUNCTION_INFO_V1(multicorn_cache_stats);
 
 
 void		_PG_init(void);
@@ -69,6 +90,65 @@ static TupleTableSlot *multicornIterateForeignScan(ForeignScanState *node);
 static void multicornReScanForeignScan(ForeignScanState *node);
 static void multicornEndForeignScan(ForeignScanState *node);
 
+#if PG_VERSION_NUM >= 90600
+static bool multicornIsForeignScanParallelSafe(PlannerInfo *root,
+								   RelOptInfo *rel,
+								   RangeTblEntry *rte);
+static Size multicornEstimateDSMForeignScan(ForeignScanState *node,
+								ParallelContext *pcxt);
+static void multicornInitializeDSMForeignScan(ForeignScanState *node,
+								  ParallelContext *pcxt,
+								  void *coordinate);
+static void multicornInitializeWorkerForeignScan(ForeignScanState *node,
+									 shm_toc *toc,
+									 void *coordinate);
+#endif
+#if PG_VERSION_NUM >= 140000
+static bool multicornIsForeignPathAsyncCapable(ForeignPath *path);
+static void multicornForeignAsyncRequest(AsyncRequest *areq);
+static void multicornForeignAsyncConfigureWait(AsyncRequest *areq);
+static void multicornForeignAsyncNotify(AsyncRequest *areq);
+#endif
+#if PG_VERSION_NUM >= 90600
+static bool multicornPlanDirectModify(PlannerInfo *root,
+						  ModifyTable *plan,
+						  Index resultRelation,
+						  int subplan_index);
+static void multicornBeginDirectModify(ForeignScanState *node, int eflags);
+static TupleTableSlot *multicornIterateDirectModify(ForeignScanState *node);
+static void multicornEndDirectModify(ForeignScanState *node);
+static bool isDirectModifyValue(Expr *expr);
+static bool extractAllRestrictions(Relids base_relids, List *clauses,
+					   List **quals);
+#endif
+#if PG_VERSION_NUM >= 120000
+static void multicornGetForeignUpperPaths(PlannerInfo *root,
+							  UpperRelationKind stage,
+							  RelOptInfo *input_rel,
+							  RelOptInfo *output_rel,
+							  void *extra);
+static void pushDownLimit(PlannerInfo *root, RelOptInfo *final_rel,
+			  FinalPathExtraData *extra);
+static bool getLimitValue(Node *node, int64 *value);
+static void pushDownAggregate(PlannerInfo *root, RelOptInfo *input_rel,
+				  RelOptInfo *grouped_rel,
+				  GroupPathExtraData *extra);
+static AttrNumber getAggregateColumn(Expr *expr, Index relid);
+static List *describeAggregate(Aggref *aggref, Index relid,
+				  Oid foreigntableid);
+static ForeignScan *getForeignAggregatePlan(PlannerInfo *root,
+						ForeignPath *best_path,
+						List *tlist,
+						Plan *outer_plan);
+static void beginForeignAggregate(ForeignScanState *node,
+					  MulticornExecState *execstate);
+#endif
+#if PG_VERSION_NUM >= 100000
+static void multicornReInitializeDSMForeignScan(ForeignScanState *node,
+									ParallelContext *pcxt,
+									void *coordinate);
+#endif
+
 #if PG_VERSION_NUM >= 90300
 static void multicornAddForeignUpdateTargets(Query *parsetree,
 								 RangeTblEntry *target_rte,
@@ -91,6 +171,14 @@ static TupleTableSlot *multicornExecForeignDelete(EState *estate, ResultRelInfo
 static TupleTableSlot *multicornExecForeignUpdate(EState *estate, ResultRelInfo *resultRelInfo,
 						   TupleTableSlot *slot, TupleTableSlot *planSlot);
 static void multicornEndForeignModify(EState *estate, ResultRelInfo *resultRelInfo);
+#if PG_VERSION_NUM >= 140000
+static int	multicornGetForeignModifyBatchSize(ResultRelInfo *resultRelInfo);
+static TupleTableSlot **multicornExecForeignBatchInsert(EState *estate,
+								ResultRelInfo *resultRelInfo,
+								TupleTableSlot **slots,
+								TupleTableSlot **planSlots,
+								int *numSlots);
+#endif
 
 static void multicorn_subxact_callback(SubXactEvent event, SubTransactionId mySubid,
 						   SubTransactionId parentSubid, void *arg);
@@ -102,6 +190,9 @@ static List *multicornImportForeignSchema(ImportForeignSchemaStmt * stmt,
 #endif
 
 static void multicorn_xact_callback(XactEvent event, void *arg);
+static void multicorn_relcache_callback(Datum arg, Oid relid);
+static void multicorn_syscache_callback(Datum arg, int cacheid,
+							uint32 hashvalue);
 
 /*	Helpers functions */
 void	   *serializePlanState(MulticornPlanState * planstate);
@@ -110,14 +201,45 @@ MulticornExecState *initializeExecState(void *internal_plan_state);
 /* Hash table mapping oid to fdw instances */
 HTAB	   *InstancesHash;
 
+/* Cache entries, the most recently used first */
+dlist_head	InstancesLRU = DLIST_STATIC_INIT(InstancesLRU);
+
+/* Cache entries used by the current transaction */
+dlist_head	ActiveInstances = DLIST_STATIC_INIT(ActiveInstances);
+
+/* Sum of the estimated memory of the cached instances */
+Size		InstancesMemory = 0;
+
+/* Limits on the number and size of cached instances, 0 for no limit */
+int			max_instances = 0;
+int			max_instances_memory = 0;
+
+/* Python modules and classes imported when the library is loaded */
+char	   *preload_modules = NULL;
+
 
 void
 _PG_init()
 {
 	HASHCTL		ctl;
-	MemoryContext oldctx = MemoryContextSwitchTo(CacheMemoryContext);
+	MemoryContext initctx,
+				oldctx;
 	bool need_import_plpy = false;
 
+	/*
+	 * With shared_preload_libraries, this runs in the postmaster, where
+	 * CacheMemoryContext does not exist yet.
+	 */
+	if (CacheMemoryContext != NULL)
+	{
+		initctx = CacheMemoryContext;
+	}
+	else
+	{
+		initctx = TopMemoryContext;
+	}
+	oldctx = MemoryContextSwitchTo(initctx);
+
 #if PY_MAJOR_VERSION >= 3
 	/* Try to load plpython3 with its own module */
 	PG_TRY();
@@ -128,6 +250,9 @@ _PG_init()
 	}
 	PG_CATCH();
 	{
+		/* plpython3 is not available: forget the error */
+		MemoryContextSwitchTo(initctx);
+		FlushErrorState();
 		need_import_plpy = false;
 	}
 	PG_END_TRY();
@@ -139,16 +264,52 @@ _PG_init()
 #if PG_VERSION_NUM >= 90300
 	RegisterSubXactCallback(multicorn_subxact_callback, NULL);
 #endif
+	/* Invalidate cached instances when their table or server changes */
+	CacheRegisterRelcacheCallback(multicorn_relcache_callback, (Datum) 0);
+	CacheRegisterSyscacheCallback(FOREIGNTABLEREL,
+								  multicorn_syscache_callback, (Datum) 0);
+	CacheRegisterSyscacheCallback(FOREIGNSERVEROID,
+								  multicorn_syscache_callback, (Datum) 0);
+	CacheRegisterSyscacheCallback(USERMAPPINGOID,
+								  multicorn_syscache_callback, (Datum) 0);
 	/* Initialize the global oid -> python instances hash */
 	MemSet(&ctl, 0, sizeof(ctl));
 	ctl.keysize = sizeof(Oid);
 	ctl.entrysize = sizeof(CacheEntry);
 	ctl.hash = oid_hash;
-	ctl.hcxt = CacheMemoryContext;
+	ctl.hcxt = TopMemoryContext;
 	InstancesHash = hash_create("multicorn instances", 32,
 								&ctl,
-								HASH_ELEM | HASH_FUNCTION);
+								HASH_ELEM | HASH_FUNCTION | HASH_CONTEXT);
 	MemoryContextSwitchTo(oldctx);
+	DefineCustomIntVariable("multicorn.max_instances",
+							"Maximum number of FDW instances cached by a backend.",
+							"The least recently used instances are closed "
+							"beyond this limit. 0 means no limit.",
+							&max_instances,
+							0, 0, INT_MAX,
+							PGC_USERSET, 0,
+							NULL, NULL, NULL);
+	DefineCustomIntVariable("multicorn.max_instances_memory",
+							"Maximum estimated memory used by the FDW "
+							"instances cached by a backend.",
+							"The least recently used instances are closed "
+							"beyond this limit. 0 means no limit.",
+							&max_instances_memory,
+							0, 0, INT_MAX,
+							PGC_USERSET, GUC_UNIT_KB,
+							NULL, NULL, NULL);
+	DefineCustomStringVariable("multicorn.preload",
+							   "Python modules or wrapper classes imported "
+							   "when multicorn is loaded.",
+							   "A comma separated list. When multicorn is in "
+							   "shared_preload_libraries, every backend "
+							   "inherits the imported modules.",
+							   &preload_modules,
+							   "",
+							   PGC_SUSET, GUC_LIST_INPUT,
+							   NULL, NULL, NULL);
+	preloadModules(preload_modules);
 }
 
 void
@@ -175,6 +336,25 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	fdw_routine->ReScanForeignScan = multicornReScanForeignScan;
 	fdw_routine->EndForeignScan = multicornEndForeignScan;
 
+#if PG_VERSION_NUM >= 90600
+	/* Parallel scans */
+	fdw_routine->IsForeignScanParallelSafe = multicornIsForeignScanParallelSafe;
+	fdw_routine->EstimateDSMForeignScan = multicornEstimateDSMForeignScan;
+	fdw_routine->InitializeDSMForeignScan = multicornInitializeDSMForeignScan;
+	fdw_routine->InitializeWorkerForeignScan = multicornInitializeWorkerForeignScan;
+#endif
+#if PG_VERSION_NUM >= 100000
+	fdw_routine->ReInitializeDSMForeignScan = multicornReInitializeDSMForeignScan;
+#endif
+
+#if PG_VERSION_NUM >= 140000
+	/* Asynchronous scans */
+	fdw_routine->IsForeignPathAsyncCapable = multicornIsForeignPathAsyncCapable;
+	fdw_routine->ForeignAsyncRequest = multicornForeignAsyncRequest;
+	fdw_routine->ForeignAsyncConfigureWait = multicornForeignAsyncConfigureWait;
+	fdw_routine->ForeignAsyncNotify = multicornForeignAsyncNotify;
+#endif
+
 #if PG_VERSION_NUM >= 90300
 	/* Code for 9.3 */
 	fdw_routine->AddForeignUpdateTargets = multicornAddForeignUpdateTargets;
@@ -186,6 +366,20 @@ multicorn_handler(PG_FUNCTION_ARGS)
 	fdw_routine->ExecForeignUpdate = multicornExecForeignUpdate;
 	fdw_routine->EndForeignModify = multicornEndForeignModify;
 #endif
+#if PG_VERSION_NUM >= 140000
+	fdw_routine->GetForeignModifyBatchSize = multicornGetForeignModifyBatchSize;
+	fdw_routine->ExecForeignBatchInsert = multicornExecForeignBatchInsert;
+#endif
+
+#if PG_VERSION_NUM >= 120000
+	fdw_routine->GetForeignUpperPaths = multicornGetForeignUpperPaths;
+#endif
+#if PG_VERSION_NUM >= 90600
+	fdw_routine->PlanDirectModify = multicornPlanDirectModify;
+	fdw_routine->BeginDirectModify = multicornBeginDirectModify;
+	fdw_routine->IterateDirectModify = multicornIterateDirectModify;
+	fdw_routine->EndDirectModify = multicornEndDirectModify;
+#endif
 
 #if PG_VERSION_NUM >= 90500
 	fdw_routine->ImportForeignSchema = multicornImportForeignSchema;
@@ -221,7 +415,19 @@ multicorn_validator(PG_FUNCTION_ARGS)
 				className = (char *) defGetString(def);
 			}
 		}
+		else if (strcmp(def->defname, "shared_instance") == 0)
+		{
+			if (catalog != ForeignServerRelationId)
+			{
+				ereport(ERROR, (errmsg("%s", "Cannot set the shared_instance option here"),
+								errhint("%s", "Set it on the server")));
+			}
+			defGetBoolean(def);
+		}
 	}
+	/* Check the batch_size and numeric_as_decimal options, if any. */
+	getBatchSize(options_list);
+	getNumericAsDecimal(options_list);
 	if (catalog == ForeignServerRelationId)
 	{
 		if (className == NULL)
@@ -236,6 +442,57 @@ multicorn_validator(PG_FUNCTION_ARGS)
 	PG_RETURN_VOID();
 }
 
+/*
+ * Returns one row per cached FDW instance, the most recently used first,
+ * with its estimated memory usage.
+ */
+Datum
+multicorn_cache_stats(PG_FUNCTION_ARGS)
+{
+	ReturnSetInfo *rsinfo = (ReturnSetInfo *) fcinfo->resultinfo;
+	TupleDesc	tupdesc;
+	Tuplestorestate *tupstore;
+	MemoryContext oldcontext;
+	dlist_iter	iter;
+
+	if (rsinfo == NULL || !IsA(rsinfo, ReturnSetInfo) ||
+		!(rsinfo->allowedModes & SFRM_Materialize))
+	{
+		ereport(ERROR, (errcode(ERRCODE_FEATURE_NOT_SUPPORTED),
+						errmsg("%s", "set-valued function called in context that cannot accept a set")));
+	}
+	if (get_call_result_type(fcinfo, NULL, &tupdesc) != TYPEFUNC_COMPOSITE)
+	{
+		elog(ERROR, "return type must be a row type");
+	}
+	oldcontext = MemoryContextSwitchTo(rsinfo->econtext->ecxt_per_query_memory);
+	tupstore = tuplestore_begin_heap(true, false, work_mem);
+	rsinfo->returnMode = SFRM_Materialize;
+	rsinfo->setResult = tupstore;
+	rsinfo->setDesc = tupdesc;
+	MemoryContextSwitchTo(oldcontext);
+
+	dlist_foreach(iter, &InstancesLRU)
+	{
+		CacheEntry *entry = dlist_container(CacheEntry, lru_node, iter.cur);
+		Datum		values[3];
+		bool		nulls[3] = {false, false, false};
+
+		values[0] = ObjectIdGetDatum(entry->hashkey);
+		if (entry->value == NULL)
+		{
+			nulls[1] = true;
+		}
+		else
+		{
+			values[1] = Int64GetDatum((int64) entry->memory);
+		}
+		values[2] = BoolGetDatum(entry->xact_depth > 0);
+		tuplestore_putvalues(tupstore, tupdesc, values, nulls);
+	}
+	return (Datum) 0;
+}
+
 
 /*
  * multicornGetForeignRelSize
@@ -252,9 +509,11 @@ multicornGetForeignRelSize(PlannerInfo *root,
 	ListCell   *lc;
 	bool		needWholeRow = false;
 	TupleDesc	desc;
+	CacheEntry *entry;
 
 	baserel->fdw_private = planstate;
-	planstate->fdw_instance = getInstance(foreigntableid);
+	entry = getCacheEntry(foreigntableid);
+	planstate->fdw_instance = entry->value;
 	planstate->foreigntableid = foreigntableid;
 	/* Initialize the conversion info array */
 	{
@@ -268,6 +527,8 @@ multicornGetForeignRelSize(PlannerInfo *root,
 		planstate->cinfos = palloc0(sizeof(ConversionInfo *) *
 									planstate->numattrs);
 		initConversioninfo(planstate->cinfos, attinmeta);
+		setNumericAsDecimal(planstate->cinfos, planstate->numattrs,
+							entry->numeric_as_decimal);
 		needWholeRow = rel->trigdesc && rel->trigdesc->trig_insert_after_row;
 		RelationClose(rel);
 	}
@@ -282,6 +543,8 @@ multicornGetForeignRelSize(PlannerInfo *root,
 			if (!att->attisdropped)
 			{
 				planstate->target_list = lappend(planstate->target_list, makeString(NameStr(att->attname)));
+				planstate->required_attrs = bms_add_member(planstate->required_attrs,
+														   att->attnum);
 			}
 		}
 	}
@@ -297,6 +560,22 @@ multicornGetForeignRelSize(PlannerInfo *root,
 			Var		   *var = (Var *) lfirst(lc);
 			Value	   *colname;
 
+			/* A whole-row reference needs every column. */
+			if (var->varattno == 0)
+			{
+				int			i;
+
+				for (i = 1; i <= planstate->numattrs; i++)
+				{
+					planstate->required_attrs = bms_add_member(planstate->required_attrs, i);
+				}
+			}
+			else if (var->varattno > 0)
+			{
+				planstate->required_attrs = bms_add_member(planstate->required_attrs,
+														   var->varattno);
+			}
+
 			/*
 			 * Store only a Value node containing the string name of the
 			 * column.
@@ -370,6 +649,33 @@ multicornGetForeignPaths(PlannerInfo *root,
 #endif
 			NULL));
 
+#if PG_VERSION_NUM >= 90600
+	/*
+	 * Add a partial path if the fdw can split the scan in partitions, each
+	 * participant of the parallel scan executing some of them.
+	 */
+	if (baserel->consider_parallel && max_parallel_workers_per_gather > 0 &&
+		bms_is_empty(baserel->lateral_relids))
+	{
+		int			parallel_workers = max_parallel_workers_per_gather;
+		double		divisor = parallel_workers + 1;
+		ForeignPath *path;
+
+		path = create_foreignscan_path(root, baserel,
+									   NULL,	/* default pathtarget */
+									   baserel->rows / divisor,
+									   planstate->startupCost,
+									   baserel->rows * baserel->reltarget->width / divisor,
+									   NIL,		/* no pathkeys */
+									   NULL,
+									   NULL,
+									   NULL);
+		path->path.parallel_aware = true;
+		path->path.parallel_workers = parallel_workers;
+		add_partial_path(baserel, (Path *) path);
+	}
+#endif
+
 	/* Handle sort pushdown */
 	if (root->query_pathkeys)
 	{
@@ -434,6 +740,12 @@ multicornGetForeignPlan(PlannerInfo *root,
 	Index		scan_relid = baserel->relid;
 	MulticornPlanState *planstate = (MulticornPlanState *) baserel->fdw_private;
 	ListCell   *lc;
+#if PG_VERSION_NUM >= 120000
+	if (IS_UPPER_REL(baserel))
+	{
+		return getForeignAggregatePlan(root, best_path, tlist, outer_plan);
+	}
+#endif
 #if PG_VERSION_NUM >= 90600
 	best_path->path.pathtarget->width = planstate->width;
 #endif
@@ -449,6 +761,7 @@ multicornGetForeignPlan(PlannerInfo *root,
 		}
 	}
 	planstate->pathkeys = (List *) best_path->fdw_private;
+	planstate->has_limit = list_member_ptr(planstate->limit_paths, best_path);
 	return make_foreignscan(tlist,
 							scan_clauses,
 							scan_relid,
@@ -471,9 +784,41 @@ multicornGetForeignPlan(PlannerInfo *root,
 static void
 multicornExplainForeignScan(ForeignScanState *node, ExplainState *es)
 {
-	PyObject *p_iterable = execute(node, es),
+	MulticornExecState *execstate = node->fdw_state;
+	PyObject *p_iterable,
 			 *p_item,
 			 *p_str;
+
+	if (execstate->is_aggregate)
+	{
+		StringInfoData description;
+		ListCell   *lc;
+
+		initStringInfo(&description);
+		foreach(lc, execstate->agg_functions)
+		{
+			List	   *agg = (List *) lfirst(lc);
+
+			appendStringInfo(&description, "%s%s(%s)",
+							 description.len > 0 ? ", " : "",
+							 strVal(linitial(agg)),
+							 list_length(agg) > 1 ? strVal(lsecond(agg)) : "*");
+		}
+		if (execstate->agg_groups != NIL)
+		{
+			appendStringInfoString(&description,
+								   description.len > 0 ? " GROUP BY " : "GROUP BY ");
+		}
+		foreach(lc, execstate->agg_groups)
+		{
+			appendStringInfo(&description, "%s%s",
+							 lc == list_head(execstate->agg_groups) ? "" : ", ",
+							 strVal(lfirst(lc)));
+		}
+		ExplainPropertyText("Multicorn", description.data, es);
+		return;
+	}
+	p_iterable = execute(node, es);
 	Py_INCREF(p_iterable);
 	while((p_item = PyIter_Next(p_iterable))){
 		p_str = PyObject_Str(p_item);
@@ -496,10 +841,24 @@ multicornBeginForeignScan(ForeignScanState *node, int eflags)
 {
 	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
 	MulticornExecState *execstate;
-	TupleDesc	tupdesc = RelationGetDescr(node->ss.ss_currentRelation);
+	TupleDesc	tupdesc;
 	ListCell   *lc;
 
 	execstate = initializeExecState(fscan->fdw_private);
+	execstate->tuple_context = AllocSetContextCreate(CurrentMemoryContext,
+													 "multicorn tuple data",
+													 ALLOCSET_DEFAULT_MINSIZE,
+													 ALLOCSET_DEFAULT_INITSIZE,
+													 ALLOCSET_DEFAULT_MAXSIZE);
+	node->fdw_state = execstate;
+#if PG_VERSION_NUM >= 120000
+	if (fscan->scan.scanrelid == 0)
+	{
+		beginForeignAggregate(node, execstate);
+		return;
+	}
+#endif
+	tupdesc = RelationGetDescr(node->ss.ss_currentRelation);
 	execstate->values = palloc(sizeof(Datum) * tupdesc->natts);
 	execstate->nulls = palloc(sizeof(bool) * tupdesc->natts);
 	execstate->qual_list = NULL;
@@ -510,7 +869,9 @@ multicornBeginForeignScan(ForeignScanState *node, int eflags)
 							&execstate->qual_list);
 	}
 	initConversioninfo(execstate->cinfos, TupleDescGetAttInMetadata(tupdesc));
-	node->fdw_state = execstate;
+	setNumericAsDecimal(execstate->cinfos, tupdesc->natts,
+						execstate->numeric_as_decimal);
+	applyTypeHints(execstate->fdw_instance, execstate->cinfos, tupdesc->natts);
 }
 
 
@@ -528,31 +889,90 @@ multicornIterateForeignScan(ForeignScanState *node)
 	TupleTableSlot *slot = node->ss.ss_ScanTupleSlot;
 	MulticornExecState *execstate = node->fdw_state;
 	PyObject   *p_value;
+	MemoryContext oldcontext;
 
+	ExecClearTuple(slot);
 	if (execstate->p_iterator == NULL)
 	{
-		execute(node, NULL);
+#if PG_VERSION_NUM >= 90600
+		if (execstate->pstate != NULL)
+		{
+			/* Parallel scan: every partition has been claimed already. */
+			if (!executeNextPartition(node))
+			{
+				return slot;
+			}
+		}
+		else
+#endif
+			execute(node, NULL);
 	}
-	ExecClearTuple(slot);
 	if (execstate->p_iterator == Py_None)
 	{
 		/* No iterator returned from get_iterator */
 		Py_DECREF(execstate->p_iterator);
 		return slot;
 	}
-	p_value = PyIter_Next(execstate->p_iterator);
-	errorCheck();
-	/* A none value results in an empty slot. */
-	if (p_value == NULL || p_value == Py_None)
-	{
-		Py_XDECREF(p_value);
-		return slot;
-	}
 	slot->tts_values = execstate->values;
 	slot->tts_isnull = execstate->nulls;
-	pythonResultToTuple(p_value, slot, execstate->cinfos, execstate->buffer);
+
+	/*
+	 * The values of the previous row are not needed anymore, convert this one
+	 * in a fresh context so that a long scan runs in constant memory.
+	 */
+	MemoryContextReset(execstate->tuple_context);
+	oldcontext = MemoryContextSwitchTo(execstate->tuple_context);
+	/* Rows left in the current columnar batch come first. */
+	while (!columnBatchToTuple(execstate, slot) &&
+		   !arrowBatchToTuple(execstate->arrow, slot, execstate->cinfos,
+							  execstate->required_attrs))
+	{
+		if (execstate->batch_size > 0)
+		{
+			p_value = nextBatchRow(execstate);
+		}
+		else
+		{
+			p_value = PyIter_Next(execstate->p_iterator);
+			errorCheck();
+		}
+#if PG_VERSION_NUM >= 90600
+		/* Move on to the next partition of a parallel scan. */
+		if (p_value == NULL && execstate->pstate != NULL)
+		{
+			Py_CLEAR(execstate->p_iterator);
+			if (executeNextPartition(node))
+			{
+				continue;
+			}
+		}
+#endif
+		/* A none value results in an empty slot. */
+		if (p_value == NULL || p_value == Py_None)
+		{
+			Py_XDECREF(p_value);
+			MemoryContextSwitchTo(oldcontext);
+			return slot;
+		}
+		if (isColumnBatch(p_value))
+		{
+			beginColumnBatch(execstate, p_value);
+		}
+		else if (isArrowBatch(p_value))
+		{
+			beginArrowBatch(execstate->arrow, p_value, execstate->cinfos);
+		}
+		else
+		{
+			pythonResultToTuple(p_value, slot, execstate->cinfos,
+								execstate->required_attrs, execstate->buffer);
+			Py_DECREF(p_value);
+			break;
+		}
+		Py_DECREF(p_value);
+	}
+	MemoryContextSwitchTo(oldcontext);
 	ExecStoreVirtualTuple(slot);
-	Py_DECREF(p_value);
 
 	return slot;
 }
@@ -571,6 +991,12 @@ multicornReScanForeignScan(ForeignScanState *node)
 		Py_DECREF(state->p_iterator);
 		state->p_iterator = NULL;
 	}
+	Py_XDECREF(state->p_batch);
+	state->p_batch = NULL;
+	state->batch_index = 0;
+	endColumnBatch(state);
+	endArrowBatch(state->arrow);
+	MemoryContextReset(state->tuple_context);
 }
 
 /*
@@ -585,10 +1011,198 @@ multicornEndForeignScan(ForeignScanState *node)
 
 	errorCheck();
 	Py_DECREF(result);
+	releaseConversionInfo(state->cinfos, state->ncolumns);
+	if (state->is_aggregate)
+	{
+		releaseConversionInfo(state->qual_cinfos, state->qual_ncolumns);
+	}
 	Py_DECREF(state->fdw_instance);
 	Py_XDECREF(state->p_iterator);
 	state->p_iterator = NULL;
+	Py_XDECREF(state->p_batch);
+	state->p_batch = NULL;
+	endColumnBatch(state);
+	endArrowBatch(state->arrow);
+#if PG_VERSION_NUM >= 90600
+	Py_XDECREF(state->p_partitions);
+	state->p_partitions = NULL;
+#endif
+}
+
+#if PG_VERSION_NUM >= 90600
+/*
+ * multicornIsForeignScanParallelSafe
+ *		A scan can run in a parallel worker if the fdw implements
+ *		get_partitions.
+ */
+static bool
+multicornIsForeignScanParallelSafe(PlannerInfo *root, RelOptInfo *rel,
+								   RangeTblEntry *rte)
+{
+	MulticornPlanState *planstate = rel->fdw_private;
+	PyObject   *p_instance;
+	bool		result;
+
+	if (planstate != NULL)
+	{
+		return implementsMethod(planstate->fdw_instance, "get_partitions");
+	}
+
+	/*
+	 * The planner asks before multicornGetForeignRelSize, which looks up the
+	 * same cache entry right after.
+	 */
+	p_instance = getInstance(rte->relid);
+	result = implementsMethod(p_instance, "get_partitions");
+	Py_DECREF(p_instance);
+	return result;
+}
+
+/*
+ * multicornEstimateDSMForeignScan
+ *		Fetch the partitions of a parallel scan, and return the size of the
+ *		shared memory needed to hand them over to the workers.
+ */
+static Size
+multicornEstimateDSMForeignScan(ForeignScanState *node, ParallelContext *pcxt)
+{
+	return getPartitions(node);
+}
+
+/*
+ * multicornInitializeDSMForeignScan
+ *		Store the partitions in the shared memory.
+ */
+static void
+multicornInitializeDSMForeignScan(ForeignScanState *node,
+								  ParallelContext *pcxt,
+								  void *coordinate)
+{
+	MulticornExecState *execstate = node->fdw_state;
+
+	storePartitions(execstate, (MulticornParallelState *) coordinate);
+	multicornInitializeWorkerForeignScan(node, NULL, coordinate);
+}
+
+/*
+ * multicornInitializeWorkerForeignScan
+ *		Attach a participant of the parallel scan to the shared state.
+ */
+static void
+multicornInitializeWorkerForeignScan(ForeignScanState *node, shm_toc *toc,
+									 void *coordinate)
+{
+	MulticornExecState *execstate = node->fdw_state;
+
+	execstate->pstate = (MulticornParallelState *) coordinate;
+	/* execute_partition returns rows, not batches of them. */
+	if (execstate->pstate->partitioned)
+	{
+		execstate->batch_size = 0;
+	}
+}
+#endif
+
+#if PG_VERSION_NUM >= 100000
+/*
+ * multicornReInitializeDSMForeignScan
+ *		Scan every partition again when the scan is restarted.
+ */
+static void
+multicornReInitializeDSMForeignScan(ForeignScanState *node,
+									ParallelContext *pcxt,
+									void *coordinate)
+{
+	MulticornParallelState *pstate = (MulticornParallelState *) coordinate;
+
+	pg_atomic_write_u32(&pstate->next_partition, 0);
+}
+#endif
+
+#if PG_VERSION_NUM >= 140000
+/*
+ * multicornIsForeignPathAsyncCapable
+ *		Scans of an AsyncForeignDataWrapper can run concurrently with the
+ *		other subplans of an Append.
+ */
+static bool
+multicornIsForeignPathAsyncCapable(ForeignPath *path)
+{
+	MulticornPlanState *planstate = path->path.parent->fdw_private;
+
+	/* Aggregate scans fetch a few rows, computed by the fdw */
+	if (path->path.parallel_aware || IS_UPPER_REL(path->path.parent))
+	{
+		return false;
+	}
+	return isAsyncInstance(planstate->fdw_instance);
+}
+
+/*
+ * multicornForeignAsyncRequest
+ *		Return the next row if it has been fetched already, or start
+ *		fetching it.
+ */
+static void
+multicornForeignAsyncRequest(AsyncRequest *areq)
+{
+	ForeignScanState *node = (ForeignScanState *) areq->requestee;
+	MulticornExecState *execstate = node->fdw_state;
+
+	if (execstate->p_iterator == NULL)
+	{
+		execute(node, NULL);
+	}
+	if (asyncScanPoll(execstate->p_iterator))
+	{
+		ExecAsyncRequestDone(areq, ExecProcNode((PlanState *) node));
+	}
+	else
+	{
+		ExecAsyncRequestPending(areq);
+	}
+}
+
+/*
+ * multicornForeignAsyncConfigureWait
+ *		Wait for the next row to be fetched.
+ *
+ *		The event loop does not run while the requestor waits: run it here
+ *		until a row of one of its scans has been fetched, unless the
+ *		requestor still has synchronous subplans to run.
+ */
+static void
+multicornForeignAsyncConfigureWait(AsyncRequest *areq)
+{
+	ForeignScanState *node = (ForeignScanState *) areq->requestee;
+	MulticornExecState *execstate = node->fdw_state;
+	AppendState *requestor = (AppendState *) areq->requestor;
+
+	if (requestor->as_syncdone)
+	{
+		while (!asyncScanWait(execstate->p_iterator, requestor, 0.1))
+		{
+			CHECK_FOR_INTERRUPTS();
+		}
+	}
+	else
+	{
+		asyncScanWait(execstate->p_iterator, requestor, 0);
+	}
+	AddWaitEventToSet(requestor->as_eventset, WL_SOCKET_READABLE,
+					  asyncScanFileno(execstate->p_iterator), NULL, areq);
+}
+
+/*
+ * multicornForeignAsyncNotify
+ *		The next row has been fetched.
+ */
+static void
+multicornForeignAsyncNotify(AsyncRequest *areq)
+{
+	multicornForeignAsyncRequest(areq);
 }
+#endif
 
 
 
@@ -684,14 +1298,19 @@ multicornBeginForeignModify(ModifyTableState *mtstate,
 	PlanState  *ps = mtstate->mt_plans[subplan_index];
 	Plan	   *subplan = ps->plan;
 	MemoryContext oldcontext;
+	CacheEntry *entry;
 	int			i;
 
 	modstate->cinfos = palloc0(sizeof(ConversionInfo *) *
 							   desc->natts);
 	modstate->buffer = makeStringInfo();
-	modstate->fdw_instance = getInstance(rel->rd_id);
+	entry = getCacheEntry(rel->rd_id);
+	modstate->fdw_instance = entry->value;
 	modstate->rowidAttrName = getRowIdColumn(modstate->fdw_instance);
 	initConversioninfo(modstate->cinfos, TupleDescGetAttInMetadata(desc));
+	setNumericAsDecimal(modstate->cinfos, desc->natts,
+						entry->numeric_as_decimal);
+	modstate->batch_size = entry->batch_size;
 	oldcontext = MemoryContextSwitchTo(TopMemoryContext);
 	MemoryContextSwitchTo(oldcontext);
 	if (ps->ps_ResultTupleSlot)
@@ -706,6 +1325,16 @@ multicornBeginForeignModify(ModifyTableState *mtstate,
 	{
 		Form_pg_attribute att = TupleDescAttr(desc, i);
 
+		if (!att->attisdropped)
+		{
+			modstate->required_attrs = bms_add_member(modstate->required_attrs,
+													  att->attnum);
+		}
+	}
+	for (i = 0; i < desc->natts; i++)
+	{
+		Form_pg_attribute att = TupleDescAttr(desc, i);
+
 		if (!att->attisdropped)
 		{
 			if (strcmp(NameStr(att->attname), modstate->rowidAttrName) == 0)
@@ -737,7 +1366,8 @@ multicornExecForeignInsert(EState *estate, ResultRelInfo *resultRelInfo,
 	if (p_new_value && p_new_value != Py_None)
 	{
 		ExecClearTuple(slot);
-		pythonResultToTuple(p_new_value, slot, modstate->cinfos, modstate->buffer);
+		pythonResultToTuple(p_new_value, slot, modstate->cinfos,
+							modstate->required_attrs, modstate->buffer);
 		ExecStoreVirtualTuple(slot);
 	}
 	Py_XDECREF(p_new_value);
@@ -746,19 +1376,72 @@ multicornExecForeignInsert(EState *estate, ResultRelInfo *resultRelInfo,
 	return slot;
 }
 
+#if PG_VERSION_NUM >= 140000
 /*
- * multicornExecForeignDelete
- *		Execute a foreign delete operation
- *		This is done by calling the python "delete" method, with the opaque
- *		rowid that was supplied.
+ * multicornGetForeignModifyBatchSize
+ *		Insert rows by batches of "batch_size", unless they must be
+ *		inserted one at a time to return them, or to run triggers.
  */
-static TupleTableSlot *
-multicornExecForeignDelete(EState *estate, ResultRelInfo *resultRelInfo,
-						   TupleTableSlot *slot, TupleTableSlot *planSlot)
+static int
+multicornGetForeignModifyBatchSize(ResultRelInfo *resultRelInfo)
 {
 	MulticornModifyState *modstate = resultRelInfo->ri_FdwState;
-	PyObject   *fdw_instance = modstate->fdw_instance,
-			   *p_row_id,
+	TriggerDesc *trigdesc = resultRelInfo->ri_TrigDesc;
+
+	if (modstate == NULL || modstate->batch_size == 0 ||
+		resultRelInfo->ri_projectReturning != NULL ||
+		resultRelInfo->ri_WithCheckOptions != NIL ||
+		(trigdesc && (trigdesc->trig_insert_before_row ||
+					  trigdesc->trig_insert_after_row)))
+	{
+		return 1;
+	}
+	return modstate->batch_size;
+}
+
+/*
+ * multicornExecForeignBatchInsert
+ *		Insert a batch of rows at once, by calling the "bulk_insert" python
+ *		method.
+ */
+static TupleTableSlot **
+multicornExecForeignBatchInsert(EState *estate, ResultRelInfo *resultRelInfo,
+								TupleTableSlot **slots,
+								TupleTableSlot **planSlots,
+								int *numSlots)
+{
+	MulticornModifyState *modstate = resultRelInfo->ri_FdwState;
+	PyObject   *p_rows = PyList_New(*numSlots),
+			   *p_result;
+	int			i;
+
+	for (i = 0; i < *numSlots; i++)
+	{
+		PyList_SET_ITEM(p_rows, i,
+						tupleTableSlotToPyObject(slots[i], modstate->cinfos));
+	}
+	p_result = PyObject_CallMethod(modstate->fdw_instance, "bulk_insert",
+								   "(O)", p_rows);
+	Py_DECREF(p_rows);
+	errorCheck();
+	Py_DECREF(p_result);
+	return slots;
+}
+#endif
+
+/*
+ * multicornExecForeignDelete
+ *		Execute a foreign delete operation
+ *		This is done by calling the python "delete" method, with the opaque
+ *		rowid that was supplied.
+ */
+static TupleTableSlot *
+multicornExecForeignDelete(EState *estate, ResultRelInfo *resultRelInfo,
+						   TupleTableSlot *slot, TupleTableSlot *planSlot)
+{
+	MulticornModifyState *modstate = resultRelInfo->ri_FdwState;
+	PyObject   *fdw_instance = modstate->fdw_instance,
+			   *p_row_id,
 			   *p_new_value;
 	bool		is_null;
 	ConversionInfo *cinfo = modstate->rowidCinfo;
@@ -773,7 +1456,8 @@ multicornExecForeignDelete(EState *estate, ResultRelInfo *resultRelInfo,
 		p_new_value = tupleTableSlotToPyObject(planSlot, modstate->resultCinfos);
 	}
 	ExecClearTuple(slot);
-	pythonResultToTuple(p_new_value, slot, modstate->cinfos, modstate->buffer);
+	pythonResultToTuple(p_new_value, slot, modstate->cinfos,
+							modstate->required_attrs, modstate->buffer);
 	ExecStoreVirtualTuple(slot);
 	Py_DECREF(p_new_value);
 	Py_DECREF(p_row_id);
@@ -807,7 +1491,8 @@ multicornExecForeignUpdate(EState *estate, ResultRelInfo *resultRelInfo,
 	if (p_new_value != NULL && p_new_value != Py_None)
 	{
 		ExecClearTuple(slot);
-		pythonResultToTuple(p_new_value, slot, modstate->cinfos, modstate->buffer);
+		pythonResultToTuple(p_new_value, slot, modstate->cinfos,
+							modstate->required_attrs, modstate->buffer);
 		ExecStoreVirtualTuple(slot);
 	}
 	Py_XDECREF(p_new_value);
@@ -828,10 +1513,756 @@ multicornEndForeignModify(EState *estate, ResultRelInfo *resultRelInfo)
 	PyObject   *result = PyObject_CallMethod(modstate->fdw_instance, "end_modify", "()");
 
 	errorCheck();
+	releaseConversionInfo(modstate->cinfos,
+						  RelationGetDescr(resultRelInfo->ri_RelationDesc)->natts);
 	Py_DECREF(modstate->fdw_instance);
 	Py_DECREF(result);
 }
 
+#if PG_VERSION_NUM >= 90600
+/*
+ * extractAllRestrictions
+ *		Convert every clause to a qual, returning false if one of them can
+ *		not be given to the fdw.
+ */
+static bool
+extractAllRestrictions(Relids base_relids, List *clauses, List **quals)
+{
+	ListCell   *lc;
+
+	foreach(lc, clauses)
+	{
+		Expr	   *clause = (Expr *) lfirst(lc);
+		int			nquals = list_length(*quals);
+
+		if (!IsA(clause, OpExpr) && !IsA(clause, NullTest) &&
+			!IsA(clause, ScalarArrayOpExpr))
+		{
+			return false;
+		}
+		extractRestrictions(base_relids, clause, quals);
+		if (list_length(*quals) != nquals + 1)
+		{
+			return false;
+		}
+	}
+	return true;
+}
+
+/*
+ * isDirectModifyValue
+ *		New values of a direct modify must be known before executing it.
+ */
+static bool
+isDirectModifyValue(Expr *expr)
+{
+	return IsA(expr, Const) ||
+		(IsA(expr, Param) && ((Param *) expr)->paramkind == PARAM_EXTERN);
+}
+
+/*
+ * multicornPlanDirectModify
+ *		Give an UPDATE or a DELETE as a whole to the fdw, if it implements
+ *		direct_modify and every part of the statement can be given to it.
+ */
+static bool
+multicornPlanDirectModify(PlannerInfo *root,
+						  ModifyTable *plan,
+						  Index resultRelation,
+						  int subplan_index)
+{
+	CmdType		operation = plan->operation;
+	RelOptInfo *baserel;
+	MulticornPlanState *planstate;
+	ForeignScan *fscan;
+	Plan	   *subplan;
+	List	   *quals = NIL,
+			   *attnums = NIL,
+			   *values = NIL,
+			   *returning = NIL,
+			   *modify;
+	Bitmapset  *attrs = NULL;
+	ListCell   *lc;
+	int			col = -1;
+
+	if (operation != CMD_UPDATE && operation != CMD_DELETE)
+	{
+		return false;
+	}
+#if PG_VERSION_NUM >= 140000
+	subplan = outerPlan(plan);
+#else
+	subplan = (Plan *) list_nth(plan->plans, subplan_index);
+#endif
+	/* Statements joining other tables are executed locally */
+	if (!IsA(subplan, ForeignScan) ||
+		((ForeignScan *) subplan)->scan.scanrelid != resultRelation)
+	{
+		return false;
+	}
+	fscan = (ForeignScan *) subplan;
+	baserel = find_base_rel(root, resultRelation);
+	planstate = baserel->fdw_private;
+	if (!implementsMethod(planstate->fdw_instance, "direct_modify"))
+	{
+		return false;
+	}
+	/* Conditions are not checked again: each one must become a qual */
+	if (!extractAllRestrictions(baserel->relids, fscan->scan.plan.qual,
+								&quals))
+	{
+		return false;
+	}
+	if (operation == CMD_UPDATE)
+	{
+#if PG_VERSION_NUM >= 140000
+		List	   *processed_tlist;
+		List	   *targetAttrs;
+		ListCell   *lc2;
+
+		get_translated_update_targetlist(root, resultRelation,
+										 &processed_tlist, &targetAttrs);
+		forboth(lc, processed_tlist, lc2, targetAttrs)
+		{
+			TargetEntry *tle = (TargetEntry *) lfirst(lc);
+
+			if (lfirst_int(lc2) <= InvalidAttrNumber ||
+				!isDirectModifyValue(tle->expr))
+			{
+				return false;
+			}
+			attnums = lappend_int(attnums, lfirst_int(lc2));
+			values = lappend(values, tle->expr);
+		}
+#else
+		RangeTblEntry *rte = planner_rt_fetch(resultRelation, root);
+
+		while ((col = bms_next_member(rte->updatedCols, col)) >= 0)
+		{
+			AttrNumber	attnum = col + FirstLowInvalidHeapAttributeNumber;
+			TargetEntry *tle;
+
+			if (attnum <= InvalidAttrNumber)
+			{
+				return false;
+			}
+			tle = get_tle_by_resno(fscan->scan.plan.targetlist, attnum);
+			if (tle == NULL || !isDirectModifyValue(tle->expr))
+			{
+				return false;
+			}
+			attnums = lappend_int(attnums, attnum);
+			values = lappend(values, tle->expr);
+		}
+		col = -1;
+#endif
+	}
+	if (plan->returningLists)
+	{
+		pull_varattnos((Node *) list_nth(plan->returningLists, subplan_index),
+					   resultRelation, &attrs);
+		while ((col = bms_next_member(attrs, col)) >= 0)
+		{
+			AttrNumber	attnum = col + FirstLowInvalidHeapAttributeNumber;
+
+			/* Whole rows and system columns are not supported */
+			if (attnum <= InvalidAttrNumber)
+			{
+				return false;
+			}
+			returning = lappend_int(returning, attnum);
+		}
+	}
+	modify = list_make2(makeInteger(operation),
+						makeInteger(plan->returningLists != NIL));
+	modify = lappend(modify, attnums);
+	modify = lappend(modify, values);
+	modify = lappend(modify, returning);
+	fscan->fdw_private = lappend(fscan->fdw_private, modify);
+	fscan->operation = operation;
+#if PG_VERSION_NUM >= 140000
+	fscan->resultRelation = resultRelation;
+	fscan->scan.plan.async_capable = false;
+#endif
+	fscan->scan.plan.qual = NIL;
+	return true;
+}
+
+/*
+ * multicornBeginDirectModify
+ *		Initialize the scan state, with the assignments and the returned
+ *		columns of the statement.
+ */
+static void
+multicornBeginDirectModify(ForeignScanState *node, int eflags)
+{
+	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
+	List	   *modify = (List *) llast(fscan->fdw_private);
+	MulticornExecState *execstate;
+	ListCell   *lc;
+
+	multicornBeginForeignScan(node, eflags);
+	execstate = node->fdw_state;
+	execstate->operation = (CmdType) intVal(linitial(modify));
+	execstate->has_returning = intVal(lsecond(modify));
+	execstate->assignment_attnums = (List *) lthird(modify);
+	foreach(lc, (List *) lfourth(modify))
+	{
+		execstate->assignment_states = lappend(execstate->assignment_states,
+											   ExecInitExpr((Expr *) lfirst(lc),
+															(PlanState *) node));
+	}
+	execstate->required_attrs = NULL;
+	foreach(lc, (List *) list_nth(modify, 4))
+	{
+		execstate->required_attrs = bms_add_member(execstate->required_attrs,
+												   lfirst_int(lc));
+	}
+}
+
+/*
+ * multicornIterateDirectModify
+ *		Execute the statement on the first call, then return the modified
+ *		rows if it has a RETURNING clause.
+ */
+static TupleTableSlot *
+multicornIterateDirectModify(ForeignScanState *node)
+{
+	TupleTableSlot *slot = node->ss.ss_ScanTupleSlot;
+	MulticornExecState *execstate = node->fdw_state;
+	EState	   *estate = node->ss.ps.state;
+#if PG_VERSION_NUM >= 140000
+	ResultRelInfo *resultRelInfo = node->resultRelInfo;
+#else
+	ResultRelInfo *resultRelInfo = estate->es_result_relation_info;
+#endif
+	PyObject   *p_value;
+	MemoryContext oldcontext;
+
+	ExecClearTuple(slot);
+	if (execstate->p_iterator == NULL)
+	{
+		PyObject   *p_result = directModify(node);
+
+		if (execstate->has_returning && p_result != Py_None)
+		{
+			execstate->p_iterator = scanResultIterator(p_result);
+		}
+		else
+		{
+			if (p_result != Py_None)
+			{
+				estate->es_processed += PyNumber_AsSsize_t(p_result, NULL);
+			}
+			execstate->p_iterator = p_result;
+			Py_INCREF(p_result);
+		}
+		Py_DECREF(p_result);
+		errorCheck();
+	}
+	if (!execstate->has_returning || execstate->p_iterator == Py_None)
+	{
+		return slot;
+	}
+	p_value = PyIter_Next(execstate->p_iterator);
+	errorCheck();
+	if (p_value == NULL || p_value == Py_None)
+	{
+		Py_XDECREF(p_value);
+		return slot;
+	}
+	slot->tts_values = execstate->values;
+	slot->tts_isnull = execstate->nulls;
+	MemoryContextReset(execstate->tuple_context);
+	oldcontext = MemoryContextSwitchTo(execstate->tuple_context);
+	pythonResultToTuple(p_value, slot, execstate->cinfos,
+						execstate->required_attrs, execstate->buffer);
+	MemoryContextSwitchTo(oldcontext);
+	Py_DECREF(p_value);
+	ExecStoreVirtualTuple(slot);
+	estate->es_processed++;
+	/* The RETURNING clause is computed from this row */
+	resultRelInfo->ri_projectReturning->pi_exprContext->ecxt_scantuple = slot;
+	return slot;
+}
+
+/*
+ * multicornEndDirectModify
+ *		Dispose the objects used for the statement.
+ */
+static void
+multicornEndDirectModify(ForeignScanState *node)
+{
+	multicornEndForeignScan(node);
+}
+#endif
+
+#if PG_VERSION_NUM >= 120000
+/*
+ * multicornGetForeignUpperPaths
+ *		Add paths for the post-scan/join processing of a query, done by the
+ *		fdw instead of PostgreSQL.
+ */
+static void
+multicornGetForeignUpperPaths(PlannerInfo *root,
+							  UpperRelationKind stage,
+							  RelOptInfo *input_rel,
+							  RelOptInfo *output_rel,
+							  void *extra)
+{
+	switch (stage)
+	{
+		case UPPERREL_GROUP_AGG:
+			pushDownAggregate(root, input_rel, output_rel,
+							  (GroupPathExtraData *) extra);
+			break;
+		case UPPERREL_FINAL:
+			pushDownLimit(root, output_rel, (FinalPathExtraData *) extra);
+			break;
+		default:
+			break;
+	}
+}
+
+/*
+ * getLimitValue
+ *		Get the value of a LIMIT or OFFSET clause, which must be known at
+ *		planning time. A missing or NULL clause leaves the value unchanged.
+ */
+static bool
+getLimitValue(Node *node, int64 *value)
+{
+	if (node == NULL)
+	{
+		return true;
+	}
+	if (!IsA(node, Const))
+	{
+		return false;
+	}
+	if (!((Const *) node)->constisnull)
+	{
+		*value = DatumGetInt64(((Const *) node)->constvalue);
+	}
+	return true;
+}
+
+/*
+ * pushDownLimit
+ *		Add paths giving the LIMIT and OFFSET of a query on a single foreign
+ *		table to the fdw, if it can apply them.
+ *
+ *		For each Limit path directly above a foreign scan, a Limit path over a
+ *		copy of the scan carrying the limit is added to the final relation.
+ *		The Limit node is kept, but since the fdw skips the OFFSET rows, it
+ *		only checks the number of rows.
+ */
+static void
+pushDownLimit(PlannerInfo *root, RelOptInfo *final_rel,
+			  FinalPathExtraData *extra)
+{
+	Query	   *parse = root->parse;
+	RelOptInfo *baserel;
+	MulticornPlanState *planstate;
+	List	   *quals = NIL,
+			   *new_paths = NIL;
+	int64		limit = -1,
+				offset = 0;
+	ListCell   *lc;
+
+	if (!extra->limit_needed || parse->commandType != CMD_SELECT ||
+		parse->rowMarks || parse->hasTargetSRFs || parse->hasAggs ||
+		parse->groupClause || parse->groupingSets || root->hasHavingQual ||
+		parse->hasWindowFuncs || parse->distinctClause ||
+		bms_membership(root->all_baserels) != BMS_SINGLETON)
+	{
+		return;
+	}
+#if PG_VERSION_NUM >= 130000
+	if (parse->limitOption == LIMIT_OPTION_WITH_TIES)
+	{
+		return;
+	}
+#endif
+	if (!getLimitValue(parse->limitCount, &limit) ||
+		!getLimitValue(parse->limitOffset, &offset))
+	{
+		return;
+	}
+	baserel = find_base_rel(root, bms_singleton_member(root->all_baserels));
+	planstate = baserel->fdw_private;
+	/* The rows must not be filtered after the limit has been applied */
+	if (!extractAllRestrictions(baserel->relids,
+								extract_actual_clauses(baserel->baserestrictinfo,
+													   false),
+								&quals))
+	{
+		return;
+	}
+	foreach(lc, final_rel->pathlist)
+	{
+		LimitPath  *limit_path = (LimitPath *) lfirst(lc);
+		ProjectionPath *projection = NULL;
+		Path	   *subpath;
+		ForeignPath *path;
+		double		fetched;
+
+		if (!IsA(limit_path, LimitPath))
+		{
+			continue;
+		}
+		subpath = limit_path->subpath;
+		if (IsA(subpath, ProjectionPath))
+		{
+			projection = (ProjectionPath *) subpath;
+			subpath = projection->subpath;
+		}
+		/* The rows must be returned already sorted by the fdw */
+		if (!IsA(subpath, ForeignPath) || subpath->parent != baserel ||
+			subpath->param_info != NULL ||
+			!pathkeys_contained_in(root->sort_pathkeys, subpath->pathkeys))
+		{
+			continue;
+		}
+		if (!canLimit(planstate, quals, ((ForeignPath *) subpath)->fdw_private,
+					  limit, offset))
+		{
+			continue;
+		}
+
+		/*
+		 * The scan only fetches the OFFSET and LIMIT rows, and only returns
+		 * the latter. It is made a little cheaper than the same limit applied
+		 * by PostgreSQL, so that it is preferred.
+		 */
+		path = makeNode(ForeignPath);
+		memcpy(path, subpath, sizeof(ForeignPath));
+		path->path.rows = clamp_row_est(subpath->rows - offset);
+		if (limit >= 0)
+		{
+			path->path.rows = Min(path->path.rows, clamp_row_est(limit));
+		}
+		fetched = Min(subpath->rows, offset + path->path.rows);
+		path->path.total_cost = path->path.startup_cost +
+			(subpath->total_cost - subpath->startup_cost) * 0.99 *
+			fetched / Max(subpath->rows, 1);
+		planstate->limit_paths = lappend(planstate->limit_paths, path);
+		subpath = (Path *) path;
+		if (projection != NULL)
+		{
+			subpath = (Path *) create_projection_path(root,
+													  projection->path.parent,
+													  subpath,
+													  projection->path.pathtarget);
+		}
+		new_paths = lappend(new_paths,
+							create_limit_path(root, final_rel, subpath,
+											  NULL,	/* no offset left */
+											  parse->limitCount,
+#if PG_VERSION_NUM >= 130000
+											  parse->limitOption,
+#endif
+											  0, limit >= 0 ? Max(limit, 1) : 0));
+	}
+	if (new_paths == NIL)
+	{
+		return;
+	}
+	planstate->limit = limit;
+	planstate->offset = offset;
+	/* Adding a path may free the ones it replaces */
+	foreach(lc, new_paths)
+	{
+		add_path(final_rel, (Path *) lfirst(lc));
+	}
+}
+
+/*
+ * getAggregateColumn
+ *		Return the attribute number of the table column given to an
+ *		aggregate or grouped by, or InvalidAttrNumber for other expressions.
+ */
+static AttrNumber
+getAggregateColumn(Expr *expr, Index relid)
+{
+	Var		   *var;
+
+	if (IsA(expr, RelabelType))
+	{
+		expr = ((RelabelType *) expr)->arg;
+	}
+	if (!IsA(expr, Var))
+	{
+		return InvalidAttrNumber;
+	}
+	var = (Var *) expr;
+	if (var->varno != relid || var->varlevelsup != 0 || var->varattno <= 0)
+	{
+		return InvalidAttrNumber;
+	}
+	return var->varattno;
+}
+
+/*
+ * describeAggregate
+ *		Describe a simple aggregate (count, sum, min, max or avg) as a list of
+ *		its name, and of the name of its column unless it is count(*).
+ *		Returns NIL for any other aggregate.
+ */
+static List *
+describeAggregate(Aggref *aggref, Index relid, Oid foreigntableid)
+{
+	char	   *name;
+	AttrNumber	attnum;
+
+	if (aggref->aggkind != AGGKIND_NORMAL || aggref->aggdistinct != NIL ||
+		aggref->aggorder != NIL || aggref->aggfilter != NULL ||
+		aggref->aggdirectargs != NIL || aggref->aggvariadic ||
+		aggref->agglevelsup != 0 || aggref->aggsplit != AGGSPLIT_SIMPLE ||
+		get_func_namespace(aggref->aggfnoid) != PG_CATALOG_NAMESPACE)
+	{
+		return NIL;
+	}
+	/* min and max of strings are only pushed with the default collation */
+	if (OidIsValid(aggref->inputcollid) &&
+		aggref->inputcollid != DEFAULT_COLLATION_OID)
+	{
+		return NIL;
+	}
+	name = get_func_name(aggref->aggfnoid);
+	if (strcmp(name, "count") != 0 && strcmp(name, "sum") != 0 &&
+		strcmp(name, "min") != 0 && strcmp(name, "max") != 0 &&
+		strcmp(name, "avg") != 0)
+	{
+		return NIL;
+	}
+	if (aggref->aggstar)
+	{
+		return list_make1(makeString(name));
+	}
+	if (list_length(aggref->args) != 1)
+	{
+		return NIL;
+	}
+	attnum = getAggregateColumn(((TargetEntry *) linitial(aggref->args))->expr,
+								relid);
+	if (attnum == InvalidAttrNumber)
+	{
+		return NIL;
+	}
+	return list_make2(makeString(name),
+					  makeString(get_attname(foreigntableid, attnum, false)));
+}
+
+/*
+ * pushDownAggregate
+ *		Add a path returning the grouped rows computed by the fdw, if it
+ *		accepts the GROUP BY clause and the aggregates of a query on a single
+ *		foreign table.
+ */
+static void
+pushDownAggregate(PlannerInfo *root, RelOptInfo *input_rel,
+				  RelOptInfo *grouped_rel, GroupPathExtraData *extra)
+{
+	Query	   *parse = root->parse;
+	PathTarget *target = root->upper_targets[UPPERREL_GROUP_AGG];
+	MulticornPlanState *planstate = input_rel->fdw_private;
+	List	   *clauses,
+			   *quals = NIL,
+			   *groups = NIL,
+			   *aggs = NIL,
+			   *exprs = NIL,
+			   *agg_exprs = NIL,
+			   *fdw_private;
+	ListCell   *lc;
+	int			i = 0;
+	double		rows = 1;
+	Cost		startup_cost,
+				total_cost;
+	ForeignPath *path;
+
+	if (input_rel->reloptkind != RELOPT_BASEREL || parse->groupingSets ||
+		extra->havingQual != NULL ||
+		extra->patype != PARTITIONWISE_AGGREGATE_NONE)
+	{
+		return;
+	}
+	/* The fdw must aggregate exactly the rows matching the WHERE clause */
+	clauses = extract_actual_clauses(input_rel->baserestrictinfo, false);
+	if (!extractAllRestrictions(input_rel->relids, clauses, &quals))
+	{
+		return;
+	}
+	foreach(lc, target->exprs)
+	{
+		Expr	   *expr = (Expr *) lfirst(lc);
+		Index		sgref = get_pathtarget_sortgroupref(target, i++);
+
+		if (sgref && get_sortgroupref_clause_noerr(sgref, parse->groupClause))
+		{
+			AttrNumber	attnum = getAggregateColumn(expr, input_rel->relid);
+
+			if (attnum == InvalidAttrNumber)
+			{
+				return;
+			}
+			groups = lappend(groups,
+							 makeString(get_attname(planstate->foreigntableid,
+													attnum, false)));
+			exprs = lappend(exprs, expr);
+		}
+		else if (IsA(expr, Aggref))
+		{
+			List	   *agg = describeAggregate((Aggref *) expr,
+												input_rel->relid,
+												planstate->foreigntableid);
+
+			if (agg == NIL)
+			{
+				return;
+			}
+			aggs = lappend(aggs, agg);
+			agg_exprs = lappend(agg_exprs, expr);
+		}
+		else
+		{
+			/* Expressions over the aggregates are not supported */
+			return;
+		}
+	}
+	if (!canAggregate(planstate, groups, aggs, quals))
+	{
+		return;
+	}
+	if (parse->groupClause)
+	{
+		rows = estimate_num_groups(root,
+								   get_sortgrouplist_exprs(parse->groupClause,
+														   parse->targetList),
+								   input_rel->rows, NULL
+#if PG_VERSION_NUM >= 140000
+								   , NULL
+#endif
+			);
+	}
+	/* Only the aggregated rows are fetched, instead of every row */
+	startup_cost = planstate->startupCost;
+	total_cost = startup_cost +
+		(input_rel->cheapest_total_path->total_cost - startup_cost) *
+		rows / Max(input_rel->rows, 1);
+	/* The grouped columns come first in the rows, then the aggregates */
+	fdw_private = list_make2(makeInteger(input_rel->relid), clauses);
+	fdw_private = lappend(fdw_private, groups);
+	fdw_private = lappend(fdw_private, aggs);
+	fdw_private = lappend(fdw_private, list_concat(exprs, agg_exprs));
+	path = create_foreign_upper_path(root, grouped_rel, target, rows,
+									 startup_cost, total_cost,
+									 NIL,	/* no pathkeys */
+									 NULL,
+#if PG_VERSION_NUM >= 170000
+									 NIL,
+#endif
+									 fdw_private);
+	add_path(grouped_rel, (Path *) path);
+}
+
+/*
+ * getForeignAggregatePlan
+ *		Create a ForeignScan plan node returning the rows aggregated by the
+ *		fdw. It scans no relation: its rows are described by fdw_scan_tlist.
+ */
+static ForeignScan *
+getForeignAggregatePlan(PlannerInfo *root, ForeignPath *best_path,
+						List *tlist, Plan *outer_plan)
+{
+	List	   *aggregate = (List *) best_path->fdw_private;
+	Index		relid = intVal(linitial(aggregate));
+	MulticornPlanState *planstate = find_base_rel(root, relid)->fdw_private;
+	List	   *scan_tlist = NIL,
+			   *fdw_private;
+	ListCell   *lc;
+
+	foreach(lc, (List *) list_nth(aggregate, 4))
+	{
+		scan_tlist = lappend(scan_tlist,
+							 makeTargetEntry((Expr *) lfirst(lc),
+											 list_length(scan_tlist) + 1,
+											 NULL, false));
+	}
+	/*
+	 * The quals are kept in fdw_private, since their columns are not part of
+	 * the scan target list.
+	 */
+	fdw_private = lappend(serializePlanState(planstate),
+						  list_truncate(list_copy(aggregate), 4));
+	return make_foreignscan(tlist,
+							NIL,	/* no local quals */
+							0,		/* no scanned relation */
+							NIL,
+							fdw_private,
+							scan_tlist,
+							NIL,
+							outer_plan);
+}
+
+/*
+ * beginForeignAggregate
+ *		Initialize an aggregate scan. Its rows are described by the scan
+ *		tuple slot, but its quals apply to the columns of the table.
+ */
+static void
+beginForeignAggregate(ForeignScanState *node, MulticornExecState *execstate)
+{
+	ForeignScan *fscan = (ForeignScan *) node->ss.ps.plan;
+	List	   *aggregate = (List *) llast(fscan->fdw_private);
+	Oid			foreigntableid = DatumGetObjectId(((Const *) lsecond(fscan->fdw_private))->constvalue);
+	TupleDesc	scandesc = node->ss.ss_ScanTupleSlot->tts_tupleDescriptor;
+	TupleDesc	tupdesc;
+	Relation	rel;
+	ListCell   *lc;
+	int			i;
+
+	rel = RelationIdGetRelation(foreigntableid);
+	tupdesc = CreateTupleDescCopy(RelationGetDescr(rel));
+	RelationClose(rel);
+	execstate->is_aggregate = true;
+	execstate->agg_groups = copyObject(lthird(aggregate));
+	execstate->agg_functions = copyObject(lfourth(aggregate));
+	/* The rows are returned by execute_aggregate, unsorted and unlimited */
+	execstate->batch_size = 0;
+	execstate->pathkeys = NIL;
+	execstate->has_limit = false;
+	execstate->qual_list = NULL;
+	foreach(lc, (List *) lsecond(aggregate))
+	{
+		extractRestrictions(bms_make_singleton(intVal(linitial(aggregate))),
+							(Expr *) lfirst(lc),
+							&execstate->qual_list);
+	}
+	execstate->qual_cinfos = execstate->cinfos;
+	execstate->qual_ncolumns = execstate->ncolumns;
+	initConversioninfo(execstate->qual_cinfos,
+					   TupleDescGetAttInMetadata(tupdesc));
+	setNumericAsDecimal(execstate->qual_cinfos, tupdesc->natts,
+						execstate->numeric_as_decimal);
+	/* Every column of the aggregated rows is needed */
+	execstate->ncolumns = scandesc->natts;
+	execstate->cinfos = palloc0(sizeof(ConversionInfo *) * scandesc->natts);
+	execstate->columns = palloc0(sizeof(MulticornColumnData) * scandesc->natts);
+	execstate->arrow = initArrowState(scandesc->natts);
+	execstate->values = palloc(sizeof(Datum) * scandesc->natts);
+	execstate->nulls = palloc(sizeof(bool) * scandesc->natts);
+	execstate->required_attrs = NULL;
+	for (i = 1; i <= scandesc->natts; i++)
+	{
+		execstate->required_attrs = bms_add_member(execstate->required_attrs, i);
+	}
+	initConversioninfo(execstate->cinfos, TupleDescGetAttInMetadata(scandesc));
+	setNumericAsDecimal(execstate->cinfos, scandesc->natts,
+						execstate->numeric_as_decimal);
+}
+#endif
+
 /*
  * Callback used to propagate a subtransaction end.
  */
@@ -841,8 +2272,7 @@ multicorn_subxact_callback(SubXactEvent event, SubTransactionId mySubid,
 {
 	PyObject   *instance;
 	int			curlevel;
-	HASH_SEQ_STATUS status;
-	CacheEntry *entry;
+	dlist_iter	iter;
 
 	/* Nothing to do after commit or subtransaction start. */
 	if (event == SUBXACT_EVENT_COMMIT_SUB || event == SUBXACT_EVENT_START_SUB)
@@ -850,10 +2280,10 @@ multicorn_subxact_callback(SubXactEvent event, SubTransactionId mySubid,
 
 	curlevel = GetCurrentTransactionNestLevel();
 
-	hash_seq_init(&status, InstancesHash);
-
-	while ((entry = (CacheEntry *) hash_seq_search(&status)) != NULL)
+	dlist_foreach(iter, &ActiveInstances)
 	{
+		CacheEntry *entry = dlist_container(CacheEntry, xact_node, iter.cur);
+
 		if (entry->xact_depth < curlevel)
 			continue;
 
@@ -879,16 +2309,14 @@ static void
 multicorn_xact_callback(XactEvent event, void *arg)
 {
 	PyObject   *instance;
-	HASH_SEQ_STATUS status;
-	CacheEntry *entry;
+	dlist_mutable_iter iter;
 
-	hash_seq_init(&status, InstancesHash);
-	while ((entry = (CacheEntry *) hash_seq_search(&status)) != NULL)
+	/* Only the instances used by this transaction are visited */
+	dlist_foreach_modify(iter, &ActiveInstances)
 	{
-		instance = entry->value;
-		if (entry->xact_depth == 0)
-			continue;
+		CacheEntry *entry = dlist_container(CacheEntry, xact_node, iter.cur);
 
+		instance = entry->value;
 		switch (event)
 		{
 #if PG_VERSION_NUM >= 90300
@@ -899,10 +2327,12 @@ multicorn_xact_callback(XactEvent event, void *arg)
 			case XACT_EVENT_COMMIT:
 				PyObject_CallMethod(instance, "commit", "()");
 				entry->xact_depth = 0;
+				dlist_delete(&entry->xact_node);
 				break;
 			case XACT_EVENT_ABORT:
 				PyObject_CallMethod(instance, "rollback", "()");
 				entry->xact_depth = 0;
+				dlist_delete(&entry->xact_node);
 				break;
 			default:
 				break;
@@ -911,6 +2341,61 @@ multicorn_xact_callback(XactEvent event, void *arg)
 	}
 }
 
+/*
+ * Callback used to invalidate the cached instance of a foreign table whose
+ * definition changed.
+ *
+ * The instance itself is only checked, and recreated if needed, by the next
+ * getCacheEntry call.
+ */
+static void
+multicorn_relcache_callback(Datum arg, Oid relid)
+{
+	HASH_SEQ_STATUS status;
+	CacheEntry *entry;
+
+	if (OidIsValid(relid))
+	{
+		entry = hash_search(InstancesHash, &relid, HASH_FIND, NULL);
+		if (entry != NULL)
+			entry->is_valid = false;
+		return;
+	}
+	hash_seq_init(&status, InstancesHash);
+	while ((entry = (CacheEntry *) hash_seq_search(&status)) != NULL)
+	{
+		entry->is_valid = false;
+	}
+}
+
+/*
+ * Callback used to invalidate cached instances when the options of a foreign
+ * table, a server or a user mapping change.
+ */
+static void
+multicorn_syscache_callback(Datum arg, int cacheid, uint32 hashvalue)
+{
+	HASH_SEQ_STATUS status;
+	CacheEntry *entry;
+
+	hash_seq_init(&status, InstancesHash);
+	while ((entry = (CacheEntry *) hash_seq_search(&status)) != NULL)
+	{
+		/*
+		 * A user mapping may be created for a server which had none, so every
+		 * entry is invalidated.
+		 */
+		if (hashvalue == 0 || cacheid == USERMAPPINGOID ||
+			(cacheid == FOREIGNTABLEREL &&
+			 entry->table_hashvalue == hashvalue) ||
+			(cacheid == FOREIGNSERVEROID &&
+			 entry->server_hashvalue == hashvalue))
+		{
+			entry->is_valid = false;
+		}
+	}
+}
+
 #if PG_VERSION_NUM >= 90500
 static List *
 multicornImportForeignSchema(ImportForeignSchemaStmt * stmt,
@@ -1033,6 +2518,33 @@ serializePlanState(MulticornPlanState * state)
 	result = lappend(result, state->target_list);
 
 	result = lappend(result, serializeDeparsedSortGroup(state->pathkeys));
+	{
+		List	   *required_attrs = NIL;
+		int			i;
+
+		for (i = 1; i <= state->numattrs; i++)
+		{
+			if (bms_is_member(i, state->required_attrs))
+			{
+				required_attrs = lappend_int(required_attrs, i);
+			}
+		}
+		result = lappend(result, required_attrs);
+	}
+	if (state->has_limit)
+	{
+		result = lappend(result,
+						 list_make2(makeConst(INT8OID, -1, InvalidOid, 8,
+											  Int64GetDatum(state->limit),
+											  false, FLOAT8PASSBYVAL),
+									makeConst(INT8OID, -1, InvalidOid, 8,
+											  Int64GetDatum(state->offset),
+											  false, FLOAT8PASSBYVAL)));
+	}
+	else
+	{
+		result = lappend(result, NIL);
+	}
 
 	return result;
 }
@@ -1049,13 +2561,42 @@ initializeExecState(void *internalstate)
 	AttrNumber	attnum = ((Const *) linitial(values))->constvalue;
 	Oid			foreigntableid = ((Const *) lsecond(values))->constvalue;
 	List		*pathkeys;
+	CacheEntry *entry;
+	ListCell   *lc;
 
 	/* Those list must be copied, because their memory context can become */
 	/* invalid during the execution (in particular with the cursor interface) */
 	execstate->target_list = copyObject(lthird(values));
 	pathkeys = lfourth(values);
 	execstate->pathkeys = deserializeDeparsedSortGroup(pathkeys);
-	execstate->fdw_instance = getInstance(foreigntableid);
+	foreach(lc, (List *) list_nth(values, 4))
+	{
+		execstate->required_attrs = bms_add_member(execstate->required_attrs,
+												   lfirst_int(lc));
+	}
+	if (list_nth(values, 5) != NIL)
+	{
+		List	   *limit = (List *) list_nth(values, 5);
+
+		execstate->has_limit = true;
+		execstate->limit = DatumGetInt64(((Const *) linitial(limit))->constvalue);
+		execstate->offset = DatumGetInt64(((Const *) lsecond(limit))->constvalue);
+	}
+	entry = getCacheEntry(foreigntableid);
+	execstate->fdw_instance = entry->value;
+	/*
+	 * The batch_size option only changes the scans of the fdws overriding
+	 * execute_batches: the default implementation just groups the rows of
+	 * execute.
+	 */
+	execstate->batch_size = entry->execute_batches ? entry->batch_size : 0;
+	execstate->numeric_as_decimal = entry->numeric_as_decimal;
+	execstate->p_batch = NULL;
+	execstate->batch_index = 0;
+	execstate->p_column_batch = NULL;
+	execstate->columns = palloc0(sizeof(MulticornColumnData) * attnum);
+	execstate->ncolumns = attnum;
+	execstate->arrow = initArrowState(attnum);
 	execstate->buffer = makeStringInfo();
 	execstate->cinfos = palloc0(sizeof(ConversionInfo *) * attnum);
 	execstate->values = palloc(attnum * sizeof(Datum));
@@ -9,14 +9,19 @@
 #include "foreign/fdwapi.h"
 #include "foreign/foreign.h"
 #include "funcapi.h"
+#include "lib/ilist.h"
 #include "lib/stringinfo.h"
 #include "nodes/bitmapset.h"
 #include "nodes/makefuncs.h"
 #include "nodes/pg_list.h"
+#if PG_VERSION_NUM >= 90600
+#include "port/atomics.h"
+#endif
 
 #if PG_VERSION_NUM < 120000
 #include "nodes/relation.h"
 #endif
+#include "utils/array.h"
 #include "utils/builtins.h"
 #include "utils/syscache.h"
 
@@ -39,11 +44,57 @@ typedef struct CacheEntry
 	List	   *options;
 	List	   *columns;
 	int			xact_depth;
+	/*
+	 * Cleared by the invalidation callbacks when the table, its server or a
+	 * user mapping changes. The user mapping also depends on the user.
+	 */
+	bool		is_valid;
+	Oid			userid;
+	uint32		table_hashvalue;
+	uint32		server_hashvalue;
+	/* Position in InstancesLRU */
+	dlist_node	lru_node;
+	/* Position in ActiveInstances, while xact_depth > 0 */
+	dlist_node	xact_node;
+	/* Number of rows fetched per batch, 0 to fetch them one by one. */
+	int			batch_size;
+	/* Whether the instance overrides execute_batches, used by the scans. */
+	bool		execute_batches;
+	/* Convert numeric values to decimal.Decimal instead of float. */
+	bool		numeric_as_decimal;
+	/* Estimated memory of the instance, measured when it is created. */
+	Size		memory;
 	/* Keep the "options" and "columns" in a specific context to avoid leaks. */
 	MemoryContext cacheContext;
 }	CacheEntry;
 
 
+struct ConversionInfo;
+
+/* How values of a type are converted to python, see datumToPython. */
+typedef struct DatumOutputInfo
+{
+	Oid			typoid;
+	/* Element type for arrays, InvalidOid otherwise. */
+	Oid			elemoid;
+	/* Output function, for types without a native conversion. */
+	FmgrInfo	outfunc;
+#if PG_VERSION_NUM >= 90500
+	/* Element storage, for arrays */
+	ArrayMetaState elemmeta;
+#endif
+}	DatumOutputInfo;
+
+/* Build a datum from a python object, returns false if it cannot. */
+typedef bool (*PyObjectToDatumFunc) (PyObject *object,
+									 struct ConversionInfo *cinfo,
+									 Datum *value);
+
+/* Append the text representation of a python object to a buffer. */
+typedef void (*PyObjectToCStringFunc) (PyObject *object,
+									   StringInfo buffer,
+									   struct ConversionInfo *cinfo);
+
 typedef struct ConversionInfo
 {
 	char	   *attrname;
@@ -56,6 +107,23 @@ typedef struct ConversionInfo
 	bool		is_array;
 	int			attndims;
 	bool		need_quote;
+	/* Native conversion for the column type, NULL if there is none. */
+	PyObjectToDatumFunc todatum;
+	/* Last python type seen for this column, and its text conversion. */
+	PyTypeObject *pytype;
+	PyObjectToCStringFunc tocstring;
+	/* Interned python string of attrname, created on first use. */
+	PyObject   *attrkey;
+	/* Convert numeric values to decimal.Decimal instead of float. */
+	bool		numeric_as_decimal;
+	/*
+	 * The last two types converted to python: an array type and its element
+	 * type usually, or the column type and the type of a qual value.
+	 */
+	DatumOutputInfo outinfos[2];
+	int			next_outinfo;
+	/* Context the ConversionInfo lives in, for the cached FmgrInfos */
+	MemoryContext cxt;
 }	ConversionInfo;
 
 
@@ -69,6 +137,16 @@ typedef struct MulticornPlanState
 	int			startupCost;
 	ConversionInfo **cinfos;
 	List	   *pathkeys; /* list of MulticornDeparsedSortGroup) */
+	/* Attribute numbers of the columns needed by the query */
+	Bitmapset  *required_attrs;
+	/*
+	 * Paths given the LIMIT (-1 if none) and OFFSET of the query, and
+	 * whether the chosen path is one of them.
+	 */
+	List	   *limit_paths;
+	int64		limit;
+	int64		offset;
+	bool		has_limit;
 
 	/* For some reason, `baserel->reltarget->width` gets changed
 	 * outside of our control somewhere between GetForeignPaths and
@@ -80,6 +158,38 @@ typedef struct MulticornPlanState
 	int width;
 }	MulticornPlanState;
 
+/* A column of a multicorn.ColumnBatch, being read by a scan. */
+typedef struct MulticornColumnData
+{
+	/* Typed buffer holding the values, if the column provides one. */
+	Py_buffer	view;
+	bool		has_view;
+	/* Otherwise, the values as a "fast" sequence, NULL if missing. */
+	PyObject   *p_values;
+	/* Null bitmap: bit i is set if the i-th value is NULL. */
+	Py_buffer	nulls;
+	bool		has_nulls;
+}	MulticornColumnData;
+
+/* State of the arrow object being read by a scan, see arrow.c */
+typedef struct MulticornArrowState MulticornArrowState;
+
+#if PG_VERSION_NUM >= 90600
+/*
+ * Shared state of a parallel scan: the pickled partitions returned by
+ * get_partitions, and the next one to be claimed by a participant.
+ */
+typedef struct MulticornParallelState
+{
+	pg_atomic_uint32 next_partition;
+	/* False if get_partitions returned None: one participant scans it all */
+	bool		partitioned;
+	uint32		npartitions;
+	/* npartitions + 1 offsets of the pickled data, stored after them */
+	Size		offsets[FLEXIBLE_ARRAY_MEMBER];
+}	MulticornParallelState;
+#endif
+
 typedef struct MulticornExecState
 {
 	/* instance and iterator */
@@ -96,6 +206,47 @@ typedef struct MulticornExecState
 	AttrNumber	rowidAttno;
 	char	   *rowidAttrName;
 	List	   *pathkeys; /* list of MulticornDeparsedSortGroup) */
+	/* Attribute numbers of the columns needed by the query */
+	Bitmapset  *required_attrs;
+	/* Convert numeric values to decimal.Decimal instead of float. */
+	bool		numeric_as_decimal;
+	/* Memory used to convert the current row, reset for every row */
+	MemoryContext tuple_context;
+	/* Batched scans: the current batch, and the next row in it. */
+	int			batch_size;
+	PyObject   *p_batch;
+	Py_ssize_t	batch_index;
+	/* Columnar batch being read, one MulticornColumnData per attribute. */
+	PyObject   *p_column_batch;
+	MulticornColumnData *columns;
+	int			ncolumns;
+	Py_ssize_t	column_batch_size;
+	Py_ssize_t	column_batch_index;
+	/* Arrow record batch or stream being read */
+	MulticornArrowState *arrow;
+	/* LIMIT and OFFSET applied by the fdw, if has_limit is set */
+	bool		has_limit;
+	int64		limit;
+	int64		offset;
+	/*
+	 * Aggregate scans: the grouped columns and the aggregates. The cinfos
+	 * then describe the aggregated rows, and qual_cinfos the table columns.
+	 */
+	bool		is_aggregate;
+	List	   *agg_groups;
+	List	   *agg_functions;
+	ConversionInfo **qual_cinfos;
+	int			qual_ncolumns;
+#if PG_VERSION_NUM >= 90600
+	/* Direct modify: the operation, and the assigned columns and values */
+	CmdType		operation;
+	bool		has_returning;
+	List	   *assignment_attnums;
+	List	   *assignment_states;
+	/* Parallel scans: the partitions computed by the leader, and the DSM */
+	PyObject   *p_partitions;
+	MulticornParallelState *pstate;
+#endif
 }	MulticornExecState;
 
 typedef struct MulticornModifyState
@@ -107,6 +258,10 @@ typedef struct MulticornModifyState
 	AttrNumber	rowidAttno;
 	char	   *rowidAttrName;
 	ConversionInfo *rowidCinfo;
+	/* Attribute numbers of the columns returned to postgres */
+	Bitmapset  *required_attrs;
+	/* Number of rows given at once to bulk_insert, 0 if not batched */
+	int			batch_size;
 }	MulticornModifyState;
 
 
@@ -160,14 +315,46 @@ PyObject   *getInstance(Oid foreigntableid);
 PyObject   *qualToPyObject(Expr *expr, PlannerInfo *root);
 PyObject   *getClassString(const char *className);
 PyObject   *execute(ForeignScanState *state, ExplainState *es);
+PyObject   *scanResultIterator(PyObject *p_iterable);
+PyObject   *nextBatchRow(MulticornExecState * state);
+bool		isColumnBatch(PyObject *p_value);
+void		beginColumnBatch(MulticornExecState * state, PyObject *p_batch);
+bool		columnBatchToTuple(MulticornExecState * state, TupleTableSlot *slot);
+void		endColumnBatch(MulticornExecState * state);
+bool		implementsMethod(PyObject *fdw_instance, const char *method);
+#if PG_VERSION_NUM >= 140000
+bool		isAsyncInstance(PyObject *fdw_instance);
+bool		asyncScanPoll(PyObject *p_iterator);
+bool		asyncScanWait(PyObject *p_iterator, void *requestor,
+						  double timeout);
+int			asyncScanFileno(PyObject *p_iterator);
+#endif
+#if PG_VERSION_NUM >= 90600
+Size		getPartitions(ForeignScanState *node);
+void		storePartitions(MulticornExecState * state,
+							MulticornParallelState * pstate);
+bool		executeNextPartition(ForeignScanState *node);
+PyObject   *directModify(ForeignScanState *node);
+#endif
 void pythonResultToTuple(PyObject *p_value,
 					TupleTableSlot *slot,
 					ConversionInfo ** cinfos,
+					Bitmapset *required_attrs,
 					StringInfo buffer);
 PyObject   *tupleTableSlotToPyObject(TupleTableSlot *slot, ConversionInfo ** cinfos);
 char	   *getRowIdColumn(PyObject *fdw_instance);
 PyObject   *optionsListToPyDict(List *options);
+int			getBatchSize(List *options);
+bool		getNumericAsDecimal(List *options);
+bool		isSharedInstance(List *server_options);
+void		setNumericAsDecimal(ConversionInfo ** cinfos, int natts,
+								bool numeric_as_decimal);
 const char *getPythonEncodingName(void);
+PyObjectToDatumFunc getDatumConverter(Oid typeoid);
+PyObject   *getAttrKey(ConversionInfo * cinfo);
+void		releaseConversionInfo(ConversionInfo ** cinfos, int natts);
+void applyTypeHints(PyObject *fdw_instance, ConversionInfo ** cinfos,
+			   int natts);
 
 void getRelSize(MulticornPlanState * state,
 		PlannerInfo *root,
@@ -177,6 +364,10 @@ void getRelSize(MulticornPlanState * state,
 List	   *pathKeys(MulticornPlanState * state);
 
 List	   *canSort(MulticornPlanState * state, List *deparsed);
+bool		canLimit(MulticornPlanState * state, List *quals, List *pathkeys,
+					 int64 limit, int64 offset);
+bool		canAggregate(MulticornPlanState * state, List *groups, List *aggs,
+						 List *quals);
 
 CacheEntry *getCacheEntry(Oid foreigntableid);
 UserMapping *multicorn_GetUserMapping(Oid userid, Oid serverid);
@@ -185,6 +376,36 @@ UserMapping *multicorn_GetUserMapping(Oid userid, Oid serverid);
 /* Hash table mapping oid to fdw instances */
 extern PGDLLIMPORT HTAB *InstancesHash;
 
+/* Cache entries, the most recently used first */
+extern PGDLLIMPORT dlist_head InstancesLRU;
+
+/* Cache entries used by the current transaction */
+extern PGDLLIMPORT dlist_head ActiveInstances;
+
+/* Sum of the estimated memory of the cached instances */
+extern Size InstancesMemory;
+
+/* Limits on the number and size of cached instances, 0 for no limit */
+extern int	max_instances;
+extern int	max_instances_memory;
+
+Size		getInstanceMemory(PyObject *instance);
+
+/* Python modules and classes imported when the library is loaded */
+extern char *preload_modules;
+
+void		preloadModules(const char *modules);
+
+
+/* arrow.c */
+MulticornArrowState *initArrowState(int natts);
+bool		isArrowBatch(PyObject *p_value);
+void beginArrowBatch(MulticornArrowState * state, PyObject *p_value,
+				ConversionInfo ** cinfos);
+bool arrowBatchToTuple(MulticornArrowState * state, TupleTableSlot *slot,
+				  ConversionInfo ** cinfos, Bitmapset *required_attrs);
+void		endArrowBatch(MulticornArrowState * state);
+
 
 /* query.c */
 void extractRestrictions(Relids base_relids,
@@ -209,6 +430,7 @@ List	*findPaths(PlannerInfo *root, RelOptInfo *baserel, List *possiblePaths,
 List        *deparse_sortgroup(PlannerInfo *root, Oid foreigntableid, RelOptInfo *rel);
 
 PyObject   *datumToPython(Datum node, Oid typeoid, ConversionInfo * cinfo);
+DatumOutputInfo *getDatumOutputInfo(Oid type, ConversionInfo * cinfo);
 
 List	*serializeDeparsedSortGroup(List *pathkeys);
 List	*deserializeDeparsedSortGroup(List *items);
@@ -7,7 +7,12 @@
 #include "miscadmin.h"
 #include "utils/numeric.h"
 #include "utils/date.h"
+/* utils/datetime.h shares its include guard with python's datetime.h */
+#undef DATETIME_H
+#include "utils/datetime.h"
 #include "utils/timestamp.h"
+#include "utils/uuid.h"
+#include "pgtime.h"
 #include "utils/array.h"
 #include "utils/catcache.h"
 #include "utils/memutils.h"
@@ -19,7 +24,14 @@
 #include "mb/pg_wchar.h"
 #include "access/xact.h"
 #include "utils/lsyscache.h"
+#include "utils/json.h"
 
+/* Booleans are integers too, but their text representation is not. */
+#if PY_MAJOR_VERSION >= 3
+#define PyIntegral_Check(o) (PyLong_Check(o) && !PyBool_Check(o))
+#else
+#define PyIntegral_Check(o) ((PyInt_Check(o) || PyLong_Check(o)) && !PyBool_Check(o))
+#endif
 
 List	   *getOptions(Oid foreigntableid);
 bool		compareOptions(List *options1, List *options2);
@@ -29,6 +41,7 @@ bool		compareColumns(List *columns1, List *columns2);
 
 PyObject   *getClass(PyObject *className);
 PyObject   *valuesToPySet(List *targetlist);
+PyObject   *scanQualsToPython(ForeignScanState *node);
 PyObject   *qualDefsToPyList(List *quallist, ConversionInfo ** cinfo);
 PyObject *pythonQual(char *operatorname, PyObject *value,
 		   ConversionInfo * cinfo,
@@ -54,7 +67,8 @@ PyObject   *datumNumberToPython(Datum node, ConversionInfo * cinfo);
 PyObject   *datumDateToPython(Datum datum, ConversionInfo * cinfo);
 PyObject   *datumTimestampToPython(Datum datum, ConversionInfo * cinfo);
 PyObject   *datumIntToPython(Datum datum, ConversionInfo * cinfo);
-PyObject   *datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo);
+PyObject   *datumArrayToPython(Datum datum, DatumOutputInfo * outinfo,
+				   ConversionInfo * cinfo);
 PyObject   *datumByteaToPython(Datum datum, ConversionInfo * cinfo);
 PyObject   *datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type);
 
@@ -62,12 +76,15 @@ PyObject   *datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type);
 void pythonDictToTuple(PyObject *p_value,
 				  TupleTableSlot *slot,
 				  ConversionInfo ** cinfos,
+				  Bitmapset *required_attrs,
 				  StringInfo buffer);
 
 void pythonSequenceToTuple(PyObject *p_value,
 					  TupleTableSlot *slot,
 					  ConversionInfo ** cinfos,
+					  Bitmapset *required_attrs,
 					  StringInfo buffer);
+void rowWidthError(TupleDesc desc, ConversionInfo ** cinfos, Py_ssize_t size);
 
 /* Python to cstring functions */
 void pyobjectToCString(PyObject *pyobject, StringInfo buffer,
@@ -88,30 +105,102 @@ void pydateToCString(PyObject *pyobject, StringInfo buffer,
 
 void pyunknownToCstring(PyObject *pyobject, StringInfo buffer,
 				   ConversionInfo * cinfo);
+PyObjectToCStringFunc getCStringConverter(PyObject *pyobject);
+PyObjectToCStringFunc getCStringConverterForType(PyTypeObject *type);
 
 void appendBinaryStringInfoQuote(StringInfo buffer,
 							char *tempbuffer,
 							Py_ssize_t strlength,
 							bool need_quote);
 
+/* Python to datum functions, bypassing the text representation */
+bool pyintToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value);
+bool pyfloatToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value);
+bool pyboolToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value);
+bool pynumericToDatum(PyObject *object, ConversionInfo * cinfo,
+				 Datum *value);
+bool pydateToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value);
+bool pydatetimeToDatum(PyObject *object, ConversionInfo * cinfo,
+				  Datum *value);
+bool pytextToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value);
+bool pyuuidToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value);
+bool pyjsonToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value);
+
+/* JSON encoding */
+void pyobjectToJson(PyObject *pyobject, StringInfo buffer,
+			   ConversionInfo * cinfo);
+void pystringToJson(PyObject *pyobject, StringInfo buffer);
+
+/* Columnar batches */
+bool getColumnBuffer(PyObject *p_values, Py_buffer *view);
+Datum columnBufferToDatum(Py_buffer *view, Py_ssize_t index,
+					ConversionInfo * cinfo, StringInfo buffer);
+
+PyObject   *getPythonType(const char *moduleName, const char *typeName);
+
+
+char	   *pyunicodeAsServerString(PyObject *pyobject, Py_ssize_t *length,
+						PyObject **p_temp);
 
 static void begin_remote_xact(CacheEntry * entry);
+static CacheEntry *refreshCacheEntry(Oid foreigntableid);
+static void evictCacheEntries(CacheEntry * current);
+static void evictCacheEntry(CacheEntry * entry);
+static PyObject *getSharedInstance(ForeignTable *ftable, PyObject *p_class,
+				  PyObject *p_options, PyObject *p_columns);
 
 /*
  * Get a (python) encoding name for an attribute.
+ *
+ * The database encoding cannot change during the life of a backend, so
+ * the name is only looked up once.
  */
 const char *
 getPythonEncodingName()
 {
-	const char *encoding_name = GetDatabaseEncodingName();
+	static const char *encoding_name = NULL;
 
-	if (strcmp(encoding_name, "SQL_ASCII") == 0)
+	if (encoding_name == NULL)
 	{
-		encoding_name = "ascii";
+		encoding_name = GetDatabaseEncodingName();
+		if (strcmp(encoding_name, "SQL_ASCII") == 0)
+		{
+			encoding_name = "ascii";
+		}
 	}
 	return encoding_name;
 }
 
+/*
+ * Return a pointer to the server encoded representation of a unicode
+ * object, without copying it when possible.
+ *
+ * When the server encoding is UTF8, the UTF-8 buffer cached by the
+ * interpreter is returned directly and *p_temp is set to NULL. Otherwise,
+ * the string is encoded into a new bytes object, returned in *p_temp, which
+ * must be released by the caller once the buffer has been copied.
+ */
+char *
+pyunicodeAsServerString(PyObject *pyobject, Py_ssize_t *length,
+						PyObject **p_temp)
+{
+	char	   *buffer = NULL;
+
+#if PY_MAJOR_VERSION >= 3
+	if (GetDatabaseEncoding() == PG_UTF8)
+	{
+		*p_temp = NULL;
+		buffer = (char *) PyUnicode_AsUTF8AndSize(pyobject, length);
+		errorCheck();
+		return buffer;
+	}
+#endif
+	*p_temp = PyUnicode_AsEncodedString(pyobject, getPythonEncodingName(), NULL);
+	errorCheck();
+	PyBytes_AsStringAndSize(*p_temp, &buffer, length);
+	return buffer;
+}
+
 char *
 PyUnicode_AsPgString(PyObject *p_unicode)
 {
@@ -196,6 +285,60 @@ PyString_AsStringAndSize(PyObject *obj, char **buffer, Py_ssize_t *length)
 }
 #endif   /* PY_MAJOR_VERSION >= 3 */
 
+/*
+ * Import the modules and wrapper classes listed in the multicorn.preload
+ * setting, so that backends do not pay for it on their first query.
+ *
+ * This may run in the postmaster, so failures are only reported as warnings,
+ * and nothing depending on the database encoding is used.
+ */
+void
+preloadModules(const char *modules)
+{
+	PyObject   *p_multicorn,
+			   *p_errors;
+	Py_ssize_t	i;
+
+	if (modules == NULL || modules[0] == '\0')
+	{
+		return;
+	}
+	p_multicorn = PyImport_ImportModule("multicorn");
+	if (p_multicorn == NULL)
+	{
+		PyErr_Clear();
+		ereport(WARNING, (errmsg("%s", "Could not preload python modules"),
+						  errdetail("%s", "The multicorn package cannot be imported")));
+		return;
+	}
+	p_errors = PyObject_CallMethod(p_multicorn, "preload", "(s)", modules);
+	Py_DECREF(p_multicorn);
+	if (p_errors == NULL || !PyList_Check(p_errors))
+	{
+		PyErr_Clear();
+		Py_XDECREF(p_errors);
+		return;
+	}
+	for (i = 0; i < PyList_GET_SIZE(p_errors); i++)
+	{
+		PyObject   *p_error = PyList_GET_ITEM(p_errors, i);
+#if PY_MAJOR_VERSION >= 3
+		const char *message = PyUnicode_AsUTF8(p_error);
+#else
+		const char *message = PyString_AsString(p_error);
+#endif
+
+		if (message == NULL)
+		{
+			PyErr_Clear();
+			continue;
+		}
+		ereport(WARNING, (errmsg("%s", "Could not preload a python module"),
+						  errdetail("%s", message)));
+	}
+	Py_DECREF(p_errors);
+}
+
 /*
  * Utility function responsible for importing, and returning, a class by name
  *
@@ -404,6 +547,96 @@ optionsListToPyDict(List *options)
 	return p_options_dict;
 }
 
+/*
+ * Returns the value of the "batch_size" option, or 0 if it is not set.
+ */
+int
+getBatchSize(List *options)
+{
+	ListCell   *lc;
+
+	foreach(lc, options)
+	{
+		DefElem    *def = (DefElem *) lfirst(lc);
+
+		if (strcmp(def->defname, "batch_size") == 0)
+		{
+			char	   *value = defGetString(def),
+					   *endptr;
+			long		batch_size = strtol(value, &endptr, 10);
+
+			if (*value == '\0' || *endptr != '\0' || batch_size <= 0 ||
+				batch_size > INT_MAX)
+			{
+				ereport(ERROR, (errmsg("%s", "Invalid batch_size option"),
+								errhint("%s", "It must be a positive integer")));
+			}
+			return (int) batch_size;
+		}
+	}
+	return 0;
+}
+
+/*
+ * Returns the value of the "numeric_as_decimal" option, false if it is not
+ * set.
+ */
+bool
+getNumericAsDecimal(List *options)
+{
+	ListCell   *lc;
+
+	foreach(lc, options)
+	{
+		DefElem    *def = (DefElem *) lfirst(lc);
+
+		if (strcmp(def->defname, "numeric_as_decimal") == 0)
+		{
+			return defGetBoolean(def);
+		}
+	}
+	return false;
+}
+
+/*
+ * Returns true if the "shared_instance" server option is set.
+ */
+bool
+isSharedInstance(List *server_options)
+{
+	ListCell   *lc;
+
+	foreach(lc, server_options)
+	{
+		DefElem    *def = (DefElem *) lfirst(lc);
+
+		if (strcmp(def->defname, "shared_instance") == 0)
+		{
+			return defGetBoolean(def);
+		}
+	}
+	return false;
+}
+
+/*
+ * Set the numeric conversion of every column, from the "numeric_as_decimal"
+ * option.
+ */
+void
+setNumericAsDecimal(ConversionInfo ** cinfos, int natts,
+					bool numeric_as_decimal)
+{
+	int			i;
+
+	for (i = 0; i < natts; i++)
+	{
+		if (cinfos[i] != NULL)
+		{
+			cinfos[i]->numeric_as_decimal = numeric_as_decimal;
+		}
+	}
+}
+
 
 bool
 compareOptions(List *options1, List *options2)
@@ -550,8 +783,227 @@ compareColumns(List *columns1, List *columns2)
 }
 
 
+/*
+ * Returns the cache entry for a foreign table, and a new reference to its
+ * python instance.
+ *
+ * The entry is flagged as invalid whenever the table, its server or a user
+ * mapping changes (see multicorn.c). Until then, it is used as is.
+ */
 CacheEntry *
 getCacheEntry(Oid foreigntableid)
+{
+	CacheEntry *entry = hash_search(InstancesHash, &foreigntableid,
+									HASH_FIND, NULL);
+
+	if (entry == NULL || entry->value == NULL || !entry->is_valid ||
+		entry->userid != GetUserId())
+	{
+		entry = refreshCacheEntry(foreigntableid);
+		evictCacheEntries(entry);
+	}
+	dlist_move_head(&InstancesLRU, &entry->lru_node);
+	Py_INCREF(entry->value);
+
+	/*
+	 * Start a new transaction or subtransaction if needed.
+	 */
+	begin_remote_xact(entry);
+	return entry;
+}
+
+/*
+ * Returns the instance used for a foreign table on a server with the
+ * shared_instance option.
+ *
+ * The FDW class is instantiated once per server and user, with the server
+ * and user mapping options and no columns. The instance used for each table
+ * is then obtained from its for_table method. When the server or user
+ * mapping options change, the previous instance is closed and replaced.
+ * Shared instances are not evicted by the multicorn.max_instances and
+ * multicorn.max_instances_memory limits. Returns NULL if a python error
+ * occured.
+ */
+static PyObject *
+getSharedInstance(ForeignTable *ftable, PyObject *p_class,
+				  PyObject *p_options, PyObject *p_columns)
+{
+	/* Maps (server oid, user oid) to (class, options, shared instance) */
+	static PyObject *p_shared_instances = NULL;
+	ForeignServer *server = GetForeignServer(ftable->serverid);
+	UserMapping *mapping = multicorn_GetUserMapping(GetUserId(),
+													ftable->serverid);
+	List	   *options = list_copy(server->options);
+	PyObject   *p_key,
+			   *p_item,
+			   *p_shared_options,
+			   *p_shared = NULL,
+			   *p_instance;
+
+	if (p_shared_instances == NULL)
+	{
+		p_shared_instances = PyDict_New();
+	}
+	if (mapping)
+	{
+		options = list_concat(options, list_copy(mapping->options));
+	}
+	p_shared_options = optionsListToPyDict(options);
+	PyDict_DelItemString(p_shared_options, "wrapper");
+	p_key = Py_BuildValue("(I,I)", ftable->serverid, GetUserId());
+	p_item = PyDict_GetItem(p_shared_instances, p_key);
+	if (p_item != NULL &&
+		PyTuple_GET_ITEM(p_item, 0) == p_class &&
+		PyObject_RichCompareBool(PyTuple_GET_ITEM(p_item, 1),
+								 p_shared_options, Py_EQ) == 1)
+	{
+		p_shared = PyTuple_GET_ITEM(p_item, 2);
+		Py_INCREF(p_shared);
+	}
+	else
+	{
+		/* The server or user mapping changed, create a new instance */
+		PyObject   *p_no_columns = PyDict_New(),
+				   *p_old = NULL;
+
+		PyErr_Clear();
+		if (p_item != NULL)
+		{
+			p_old = PyTuple_GET_ITEM(p_item, 2);
+			Py_INCREF(p_old);
+		}
+		p_shared = PyObject_CallFunction(p_class, "(O,O)", p_shared_options,
+										 p_no_columns);
+		Py_DECREF(p_no_columns);
+		if (p_shared != NULL)
+		{
+			p_item = Py_BuildValue("(O,O,O)", p_class, p_shared_options,
+								   p_shared);
+			PyDict_SetItem(p_shared_instances, p_key, p_item);
+			Py_DECREF(p_item);
+			if (p_old != NULL)
+			{
+				/* The replaced instance is not used anymore */
+				PyObject   *p_result = PyObject_CallMethod(p_old, "close",
+														   "()");
+
+				if (p_result == NULL)
+				{
+					Py_CLEAR(p_shared);
+				}
+				Py_XDECREF(p_result);
+			}
+		}
+		Py_XDECREF(p_old);
+	}
+	Py_DECREF(p_key);
+	Py_DECREF(p_shared_options);
+	if (p_shared == NULL)
+	{
+		return NULL;
+	}
+	p_instance = PyObject_CallMethod(p_shared, "for_table", "(O,O)",
+									 p_options, p_columns);
+	Py_DECREF(p_shared);
+	return p_instance;
+}
+
+/*
+ * Evict the least recently used instances until the cache fits in the
+ * multicorn.max_instances and multicorn.max_instances_memory limits.
+ *
+ * Instances used by the current transaction are never evicted.
+ */
+static void
+evictCacheEntries(CacheEntry * current)
+{
+	long		count = hash_get_num_entries(InstancesHash);
+	Size		max_memory = (Size) max_instances_memory * 1024;
+	dlist_node *node;
+
+	if (dlist_is_empty(&InstancesLRU))
+	{
+		return;
+	}
+	node = dlist_tail_node(&InstancesLRU);
+	while ((max_instances > 0 && count > max_instances) ||
+		   (max_memory > 0 && InstancesMemory > max_memory))
+	{
+		CacheEntry *entry = dlist_container(CacheEntry, lru_node, node);
+		dlist_node *prev = NULL;
+
+		if (dlist_has_prev(&InstancesLRU, node))
+		{
+			prev = dlist_prev_node(&InstancesLRU, node);
+		}
+		if (entry != current && entry->xact_depth == 0)
+		{
+			count--;
+			evictCacheEntry(entry);
+		}
+		if (prev == NULL)
+		{
+			break;
+		}
+		node = prev;
+	}
+}
+
+/*
+ * Remove an entry from the cache, and call the close method of its python
+ * instance.
+ */
+static void
+evictCacheEntry(CacheEntry * entry)
+{
+	PyObject   *p_instance = entry->value;
+	Oid			foreigntableid = entry->hashkey;
+
+	dlist_delete(&entry->lru_node);
+	InstancesMemory -= entry->memory;
+	if (entry->cacheContext != NULL)
+	{
+		MemoryContextDelete(entry->cacheContext);
+	}
+	hash_search(InstancesHash, &foreigntableid, HASH_REMOVE, NULL);
+	if (p_instance != NULL)
+	{
+		PyObject   *p_result = PyObject_CallMethod(p_instance, "close", "()");
+
+		Py_XDECREF(p_result);
+		Py_DECREF(p_instance);
+		errorCheck();
+	}
+}
+
+/*
+ * Estimate the memory used by a python instance, and by the objects it
+ * references, with multicorn.instance_memory.
+ */
+Size
+getInstanceMemory(PyObject *instance)
+{
+	PyObject   *p_multicorn = PyImport_ImportModule("multicorn"),
+			   *p_size;
+	Size		memory;
+
+	errorCheck();
+	p_size = PyObject_CallMethod(p_multicorn, "instance_memory", "(O)",
+								 instance);
+	Py_DECREF(p_multicorn);
+	errorCheck();
+	memory = PyNumber_AsSsize_t(p_size, NULL);
+	Py_DECREF(p_size);
+	errorCheck();
+	return memory;
+}
+
+/*
+ * Check the options and columns of a foreign table against its cache
+ * entry, and (re)create the python instance if they changed.
+ */
+static CacheEntry *
+refreshCacheEntry(Oid foreigntableid)
 {
 	/*
 	 * create a temporary context. If we have to (re)create the python
@@ -577,12 +1029,28 @@ getCacheEntry(Oid foreigntableid)
 	entry = hash_search(InstancesHash, &foreigntableid, HASH_ENTER,
 						&found);
 
+	/*
+	 * Mark the entry as valid before looking at the catalogs, so that an
+	 * invalidation received meanwhile is not lost.
+	 */
+	entry->is_valid = true;
+	entry->userid = GetUserId();
+	entry->table_hashvalue = GetSysCacheHashValue1(FOREIGNTABLEREL,
+											ObjectIdGetDatum(foreigntableid));
+	entry->server_hashvalue = GetSysCacheHashValue1(FOREIGNSERVEROID,
+										   ObjectIdGetDatum(ftable->serverid));
+
+	if (!found)
+	{
+		dlist_push_head(&InstancesLRU, &entry->lru_node);
+	}
 	if (!found || entry->value == NULL)
 	{
 		entry->options = NULL;
 		entry->columns = NULL;
 		entry->cacheContext = NULL;
 		entry->xact_depth = 0;
+		entry->memory = 0;
 		needInitialization = true;
 	}
 	else
@@ -617,10 +1085,20 @@ getCacheEntry(Oid foreigntableid)
 				   *p_instance;
 
 		entry->value = NULL;
+		InstancesMemory -= entry->memory;
+		entry->memory = 0;
 		getColumnsFromTable(desc, &p_columns, &columns);
 		PyDict_DelItemString(p_options, "wrapper");
-		p_instance = PyObject_CallFunction(p_class, "(O,O)", p_options,
+		if (isSharedInstance(GetForeignServer(ftable->serverid)->options))
+		{
+			p_instance = getSharedInstance(ftable, p_class, p_options,
 										   p_columns);
+		}
+		else
+		{
+			p_instance = PyObject_CallFunction(p_class, "(O,O)", p_options,
+											   p_columns);
+		}
 		errorCheck();
 		/* Cleanup the old context, containing the old columns and options */
 		/* values */
@@ -633,13 +1111,28 @@ getCacheEntry(Oid foreigntableid)
 		entry->cacheContext = tempContext;
 		entry->options = options;
 		entry->columns = columns;
+		if (entry->xact_depth > 0)
+		{
+			dlist_delete(&entry->xact_node);
+		}
 		entry->xact_depth = 0;
+		entry->batch_size = getBatchSize(options);
+		entry->numeric_as_decimal = getNumericAsDecimal(options);
 		Py_DECREF(p_class);
 		Py_DECREF(p_options);
 		Py_DECREF(p_columns);
 		errorCheck();
 		entry->value = p_instance;
 		MemoryContextSwitchTo(oldContext);
+
+		/*
+		 * The instance is measured once, so that looking it up again does not
+		 * walk the objects it references.
+		 */
+		entry->memory = getInstanceMemory(p_instance);
+		InstancesMemory += entry->memory;
+		entry->execute_batches = implementsMethod(p_instance,
+												  "execute_batches");
 	}
 	else
 	{
@@ -647,12 +1140,6 @@ getCacheEntry(Oid foreigntableid)
 		MemoryContextDelete(tempContext);
 	}
 	RelationClose(rel);
-	Py_INCREF(entry->value);
-
-	/*
-	 * Start a new transaction or subtransaction if needed.
-	 */
-	begin_remote_xact(entry);
 	return entry;
 }
 
@@ -682,6 +1169,7 @@ begin_remote_xact(CacheEntry * entry)
 		Py_XDECREF(rv);
 		errorCheck();
 		entry->xact_depth = 1;
+		dlist_push_tail(&ActiveInstances, &entry->xact_node);
 	}
 
 	while (entry->xact_depth < curlevel)
@@ -894,21 +1382,24 @@ getDeparsedSortGroup(PyObject *sortKey)
 
 
 /*
- * Execute the query in the python fdw, and returns an iterator.
+ * Build the list of Qual objects passed to the python side for a scan,
+ * evaluating the parameters they may depend on.
+ *
+ * Returns a new reference to a list.
  */
 PyObject *
-execute(ForeignScanState *node, ExplainState *es)
+scanQualsToPython(ForeignScanState *node)
 {
 	MulticornExecState *state = node->fdw_state;
-	PyObject   *p_targets_set,
-			   *p_quals = PyList_New(0),
-			   *p_pathkeys = PyList_New(0),
-			   *p_iterable,
-			   *p_method;
+	PyObject   *p_quals = PyList_New(0);
 	ListCell   *lc;
 
 	ExprContext *econtext = node->ss.ps.ps_ExprContext;
 
+	/* The quals of an aggregate scan apply to the columns of the table */
+	ConversionInfo **cinfos = state->is_aggregate ? state->qual_cinfos :
+		state->cinfos;
+
 	foreach(lc, state->qual_list)
 	{
 		MulticornBaseQual *qual = lfirst(lc);
@@ -944,7 +1435,7 @@ execute(ForeignScanState *node, ExplainState *es)
 		}
 		if (newqual != NULL)
 		{
-			PyObject   *python_qual = qualdefToPython((MulticornConstQual *) newqual, state->cinfos);
+			PyObject   *python_qual = qualdefToPython((MulticornConstQual *) newqual, cinfos);
 
 			if (python_qual != NULL)
 			{
@@ -953,25 +1444,136 @@ execute(ForeignScanState *node, ExplainState *es)
 			}
 		}
 	}
-	/* Transform every object to a suitable python representation */
-	p_targets_set = valuesToPySet(state->target_list);
+	return p_quals;
+}
 
-	foreach(lc, state->pathkeys)
+/*
+ * Get an iterator over the rows (or batches) returned from the python side
+ * by a scan.
+ *
+ * Returns a new reference.
+ */
+PyObject *
+scanResultIterator(PyObject *p_iterable)
+{
+	if (PyObject_HasAttrString(p_iterable, "__aiter__"))
 	{
-		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
-		PyObject *python_sortkey = getSortKey(pathkey);
-		PyList_Append(p_pathkeys, python_sortkey);
-		Py_DECREF(python_sortkey);
+		/* Asynchronous iterables are driven by the backend event loop. */
+		PyObject   *p_class = getClassString("multicorn.asyncfdw.AsyncScan"),
+				   *p_scan = PyObject_CallFunctionObjArgs(p_class, p_iterable,
+														  NULL);
+
+		Py_DECREF(p_class);
+		return p_scan;
 	}
+	if (isColumnBatch(p_iterable) || isArrowBatch(p_iterable))
 	{
-		PyObject * args,
-				 * kwargs = PyDict_New();
-		if(PyList_Size(p_pathkeys) > 0){
-			PyDict_SetItemString(kwargs, "sortkeys", p_pathkeys);
-		}
-		if(es != NULL){
-			PyObject * verbose;
-			if(es->verbose){
+		/* A single batch was returned, instead of an iterable of them. */
+		PyObject   *p_batches = PyTuple_Pack(1, p_iterable),
+				   *p_iterator = PyObject_GetIter(p_batches);
+
+		Py_DECREF(p_batches);
+		return p_iterator;
+	}
+	return PyObject_GetIter(p_iterable);
+}
+
+/*
+ * Convert the description of an aggregate scan to python: a list of the
+ * grouped column names, and a list of (function, column) tuples, the column
+ * being None for count(*).
+ */
+static void
+aggregateToPython(List *groups, List *aggs, PyObject **p_groups,
+				  PyObject **p_aggs)
+{
+	ListCell   *lc;
+
+	*p_groups = PyList_New(0);
+	*p_aggs = PyList_New(0);
+	foreach(lc, groups)
+	{
+		PyObject   *p_column = PyString_FromString(strVal(lfirst(lc)));
+
+		PyList_Append(*p_groups, p_column);
+		Py_DECREF(p_column);
+	}
+	foreach(lc, aggs)
+	{
+		List	   *agg = (List *) lfirst(lc);
+		PyObject   *p_function = PyString_FromString(strVal(linitial(agg))),
+				   *p_column,
+				   *p_agg;
+
+		if (list_length(agg) > 1)
+		{
+			p_column = PyString_FromString(strVal(lsecond(agg)));
+		}
+		else
+		{
+			p_column = Py_None;
+			Py_INCREF(p_column);
+		}
+		p_agg = PyTuple_Pack(2, p_function, p_column);
+		PyList_Append(*p_aggs, p_agg);
+		Py_DECREF(p_function);
+		Py_DECREF(p_column);
+		Py_DECREF(p_agg);
+	}
+}
+
+/*
+ * Execute the query in the python fdw, and returns an iterator.
+ */
+PyObject *
+execute(ForeignScanState *node, ExplainState *es)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *p_targets_set,
+			   *p_quals = scanQualsToPython(node),
+			   *p_pathkeys = PyList_New(0),
+			   *p_iterable,
+			   *p_method;
+	ListCell   *lc;
+
+	/* Transform every object to a suitable python representation */
+	p_targets_set = valuesToPySet(state->target_list);
+
+	foreach(lc, state->pathkeys)
+	{
+		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
+		PyObject *python_sortkey = getSortKey(pathkey);
+		PyList_Append(p_pathkeys, python_sortkey);
+		Py_DECREF(python_sortkey);
+	}
+	{
+		PyObject * args,
+				 * kwargs = PyDict_New();
+		if(PyList_Size(p_pathkeys) > 0){
+			PyDict_SetItemString(kwargs, "sortkeys", p_pathkeys);
+		}
+		if (state->has_limit && es == NULL)
+		{
+			PyObject   *p_limit,
+					   *p_offset = PyLong_FromLongLong(state->offset);
+
+			if (state->limit < 0)
+			{
+				p_limit = Py_None;
+				Py_INCREF(p_limit);
+			}
+			else
+			{
+				p_limit = PyLong_FromLongLong(state->limit);
+			}
+			PyDict_SetItemString(kwargs, "limit", p_limit);
+			PyDict_SetItemString(kwargs, "offset", p_offset);
+			Py_DECREF(p_limit);
+			Py_DECREF(p_offset);
+		}
+		if(es != NULL){
+			PyObject * verbose;
+			if(es->verbose){
 				verbose = Py_True;
 			} else {
 				verbose = Py_False;
@@ -980,6 +1582,26 @@ execute(ForeignScanState *node, ExplainState *es)
 			args = PyTuple_Pack(2, p_quals, p_targets_set);
 			PyDict_SetItemString(kwargs, "verbose", verbose);
 			errorCheck();
+		} else if (state->is_aggregate) {
+			PyObject   *p_groups,
+					   *p_aggs;
+
+			aggregateToPython(state->agg_groups, state->agg_functions,
+							  &p_groups, &p_aggs);
+			p_method = PyObject_GetAttrString(state->fdw_instance, "execute_aggregate");
+			errorCheck();
+			args = PyTuple_Pack(3, p_groups, p_aggs, p_quals);
+			Py_DECREF(p_groups);
+			Py_DECREF(p_aggs);
+			errorCheck();
+		} else if (state->batch_size > 0) {
+			PyObject * batch_size = PyLong_FromLong(state->batch_size);
+			p_method = PyObject_GetAttrString(state->fdw_instance, "execute_batches");
+			errorCheck();
+			args = PyTuple_Pack(2, p_quals, p_targets_set);
+			PyDict_SetItemString(kwargs, "batch_size", batch_size);
+			Py_DECREF(batch_size);
+			errorCheck();
 		} else {
 			p_method = PyObject_GetAttrString(state->fdw_instance, "execute");
 			errorCheck();
@@ -997,6 +1619,10 @@ execute(ForeignScanState *node, ExplainState *es)
 	if (p_iterable == Py_None){
 		state->p_iterator = p_iterable;
 	}
+	else if (es == NULL)
+	{
+		state->p_iterator = scanResultIterator(p_iterable);
+	}
 	else
 	{
 		state->p_iterator = PyObject_GetIter(p_iterable);
@@ -1009,309 +1635,1890 @@ execute(ForeignScanState *node, ExplainState *es)
 	return state->p_iterator;
 }
 
-void
-pynumberToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
+#if PG_VERSION_NUM >= 140000
+/*
+ * Check whether the fdw is an AsyncForeignDataWrapper.
+ */
+bool
+isAsyncInstance(PyObject *fdw_instance)
 {
-	PyObject   *pTempStr;
-	char	   *tempbuffer;
-	Py_ssize_t	strlength = 0;
+#if PY_MAJOR_VERSION >= 3
+	PyObject   *p_class = getClassString("multicorn.asyncfdw."
+										 "AsyncForeignDataWrapper");
+	int			result = PyObject_IsInstance(fdw_instance, p_class);
 
-	pTempStr = PyObject_Str(pyobject);
-	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
-	appendBinaryStringInfo(buffer, tempbuffer, strlength);
-	Py_DECREF(pTempStr);
+	Py_DECREF(p_class);
+	errorCheck();
+	return result == 1;
+#else
+	return false;
+#endif
 }
 
-void
-pyunicodeToCString(PyObject *pyobject, StringInfo buffer,
-				   ConversionInfo * cinfo)
+/*
+ * Check whether the next row of an asynchronous scan has been fetched,
+ * starting to fetch it if needed. Rows of other scans are always there.
+ */
+bool
+asyncScanPoll(PyObject *p_iterator)
 {
-	char	   *tempbuffer;
-	Py_ssize_t	strlength = 0;
-	PyObject   *pTempStr;
-	pTempStr = PyUnicode_AsEncodedString(pyobject, getPythonEncodingName(), NULL);
+	PyObject   *p_result;
+	bool		result;
+
+	if (!PyObject_HasAttrString(p_iterator, "poll"))
+	{
+		return true;
+	}
+	p_result = PyObject_CallMethod(p_iterator, "poll", "()");
 	errorCheck();
-	PyBytes_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
-	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
-	Py_DECREF(pTempStr);
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
 }
 
-void
-pystringToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
+/*
+ * Run the event loop for at most timeout seconds, until the next row of
+ * this scan, or of another scan of the same requestor, has been fetched.
+ */
+bool
+asyncScanWait(PyObject *p_iterator, void *requestor, double timeout)
 {
-	char	   *tempbuffer;
-	Py_ssize_t	strlength = 0;
+	PyObject   *p_requestor = PyLong_FromVoidPtr(requestor),
+			   *p_result;
+	bool		result;
 
-	if (PyString_AsStringAndSize(pyobject, &tempbuffer, &strlength) < 0)
-	{
-		ereport(WARNING,
-				(errmsg("An error occured while decoding the %s column",
-						cinfo->attrname),
-				 errhint("You should maybe return unicode instead?")));
-	}
-	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+	p_result = PyObject_CallMethod(p_iterator, "wait", "(Od)", p_requestor,
+								   timeout);
+	Py_DECREF(p_requestor);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
 }
 
-void
-pysequenceToCString(PyObject *pyobject, StringInfo buffer,
-					ConversionInfo * cinfo)
+/*
+ * Returns the file descriptor becoming readable once the next row of an
+ * asynchronous scan has been fetched.
+ */
+int
+asyncScanFileno(PyObject *p_iterator)
 {
-	/* Its an array */
-	Py_ssize_t	i,
-				size = PySequence_Size(pyobject);
-	PyObject   *p_item;
-	int			previous_dims = cinfo->attndims,
-				previous_needquote = cinfo->need_quote;
+	int			fd = PyObject_AsFileDescriptor(p_iterator);
 
-	if (cinfo->attndims == 0)
+	errorCheck();
+	return fd;
+}
+#endif
+
+/*
+ * Check whether the fdw class overrides an optional method of
+ * ForeignDataWrapper.
+ */
+bool
+implementsMethod(PyObject *fdw_instance, const char *method)
+{
+	PyObject   *p_multicorn = PyImport_ImportModule("multicorn"),
+			   *p_result;
+	bool		result;
+
+	errorCheck();
+	p_result = PyObject_CallMethod(p_multicorn, "implements", "(Os)",
+								   fdw_instance, method);
+	Py_DECREF(p_multicorn);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
+}
+
+#if PG_VERSION_NUM >= 90600
+/*
+ * Call get_partitions on the python side, and pickle every partition it
+ * returned so that they can be copied to the dynamic shared memory.
+ *
+ * Returns the size needed to store them.
+ */
+Size
+getPartitions(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	PyObject   *p_quals = scanQualsToPython(node),
+			   *p_targets_set = valuesToPySet(state->target_list),
+			   *p_partitions;
+	Size		size = 0;
+	int			npartitions = 1;
+
+	p_partitions = PyObject_CallMethod(state->fdw_instance, "get_partitions",
+									   "(OO)", p_quals, p_targets_set);
+	Py_DECREF(p_quals);
+	Py_DECREF(p_targets_set);
+	errorCheck();
+	Py_XDECREF(state->p_partitions);
+	if (p_partitions == Py_None)
 	{
-		/* We are not supposed to be converted to an array. */
-		pyunknownToCstring(pyobject, buffer, cinfo);
-		return;
+		/* The whole scan is a single partition */
+		state->p_partitions = p_partitions;
 	}
-	appendStringInfoChar(buffer, '{');
-	/* We are an array, so we need to quote stuff */
-	cinfo->need_quote = true;
-	cinfo->attndims = cinfo->attndims - 1;
-	for (i = 0; i < size; i++)
+	else
 	{
-		p_item = PySequence_GetItem(pyobject, i);
-		pyobjectToCString(p_item, buffer, cinfo);
-		Py_DECREF(p_item);
-		if (i != size - 1)
+		PyObject   *p_iterator = PyObject_GetIter(p_partitions),
+				   *p_pickle = PyImport_ImportModule("pickle"),
+				   *p_partition;
+
+		Py_DECREF(p_partitions);
+		errorCheck();
+		state->p_partitions = PyList_New(0);
+		while ((p_partition = PyIter_Next(p_iterator)))
 		{
-			appendBinaryStringInfo(buffer, ", ", 2);
+			PyObject   *p_data = PyObject_CallMethod(p_pickle, "dumps", "(Oi)",
+													 p_partition, -1);
+
+			Py_DECREF(p_partition);
+			if (p_data == NULL)
+			{
+				break;
+			}
+			PyList_Append(state->p_partitions, p_data);
+			size = add_size(size, PyBytes_Size(p_data));
+			Py_DECREF(p_data);
 		}
+		Py_DECREF(p_iterator);
+		Py_DECREF(p_pickle);
+		errorCheck();
+		npartitions = PyList_Size(state->p_partitions);
 	}
-	appendStringInfoChar(buffer, '}');
-	cinfo->attndims = previous_dims;
-	cinfo->need_quote = previous_needquote;
+	return add_size(add_size(offsetof(MulticornParallelState, offsets),
+							 mul_size(sizeof(Size), npartitions + 1)),
+					size);
 }
 
+/*
+ * Copy the partitions computed by getPartitions to the shared state.
+ */
 void
-pymappingToCString(PyObject *pyobject, StringInfo buffer,
-				   ConversionInfo * cinfo)
+storePartitions(MulticornExecState * state, MulticornParallelState * pstate)
 {
-	PyObject   *items = PyMapping_Items(pyobject);
-	PyObject   *current_tuple;
-	Py_ssize_t	i;
-	Py_ssize_t	size = PyList_Size(items);
-	bool		need_quote = cinfo->need_quote;
+	char	   *data;
+	uint32		i;
 
-	cinfo->need_quote = true;
-	for (i = 0; i < size; i++)
+	pg_atomic_init_u32(&pstate->next_partition, 0);
+	pstate->partitioned = state->p_partitions != Py_None;
+	pstate->npartitions = 1;
+	if (pstate->partitioned)
 	{
-		current_tuple = PySequence_GetItem(items, i);
-		pyobjectToCString(PyTuple_GetItem(current_tuple, 0),
-						  buffer, cinfo);
-		appendBinaryStringInfo(buffer, "=>", 2);
-		pyobjectToCString(PyTuple_GetItem(current_tuple, 1),
-						  buffer, cinfo);
-		if (i != size - 1)
+		pstate->npartitions = PyList_Size(state->p_partitions);
+	}
+	data = (char *) &pstate->offsets[pstate->npartitions + 1];
+	pstate->offsets[0] = 0;
+	for (i = 0; i < pstate->npartitions; i++)
+	{
+		char	   *buffer;
+		Py_ssize_t	length = 0;
+
+		if (pstate->partitioned)
 		{
-			appendBinaryStringInfo(buffer, ", ", 2);
+			PyBytes_AsStringAndSize(PyList_GET_ITEM(state->p_partitions, i),
+									&buffer, &length);
+			memcpy(data + pstate->offsets[i], buffer, length);
 		}
-		Py_DECREF(current_tuple);
+		pstate->offsets[i + 1] = pstate->offsets[i] + length;
 	}
-	Py_DECREF(items);
-	cinfo->need_quote = need_quote;
+	Py_CLEAR(state->p_partitions);
+	errorCheck();
 }
 
-void
-pydateToCString(PyObject *pyobject, StringInfo buffer,
-				ConversionInfo * cinfo)
+/*
+ * Claim the next partition of a parallel scan, and call execute_partition
+ * for it.
+ *
+ * Returns false once every partition has been claimed.
+ */
+bool
+executeNextPartition(ForeignScanState *node)
 {
-	char	   *tempbuffer;
-	Py_ssize_t	strlength = 0;
-	PyObject   *formatted_date;
-
-	formatted_date = PyObject_CallMethod(pyobject, "isoformat", "()");
-	PyString_AsStringAndSize(formatted_date, &tempbuffer, &strlength);
-	appendBinaryStringInfo(buffer, tempbuffer, strlength);
-	Py_DECREF(formatted_date);
-}
-
+	MulticornExecState *state = node->fdw_state;
+	MulticornParallelState *pstate = state->pstate;
+	uint32		index = pg_atomic_fetch_add_u32(&pstate->next_partition, 1);
+	char	   *data;
+	PyObject   *p_pickle,
+			   *p_data,
+			   *p_partition,
+			   *p_quals,
+			   *p_targets_set,
+			   *p_iterable;
 
-void
-pyobjectToCString(PyObject *pyobject, StringInfo buffer,
-				  ConversionInfo * cinfo)
-{
-	if (pyobject == NULL || pyobject == Py_None)
-	{
-		return;
-	}
-	if (PyNumber_Check(pyobject))
-	{
-		pynumberToCString(pyobject, buffer, cinfo);
-		return;
-	}
-	if (PyUnicode_Check(pyobject))
+	if (index >= pstate->npartitions)
 	{
-		pyunicodeToCString(pyobject, buffer, cinfo);
-		return;
-	}
-	if (PyBytes_Check(pyobject))
-	{
-		pystringToCString(pyobject, buffer, cinfo);
-		return;
+		return false;
 	}
-	if (PySequence_Check(pyobject))
+	if (!pstate->partitioned)
 	{
-		pysequenceToCString(pyobject, buffer, cinfo);
-		return;
+		execute(node, NULL);
+		return true;
 	}
-	if (PyMapping_Check(pyobject))
+	data = (char *) &pstate->offsets[pstate->npartitions + 1];
+	p_data = PyBytes_FromStringAndSize(data + pstate->offsets[index],
+									   pstate->offsets[index + 1] -
+									   pstate->offsets[index]);
+	p_pickle = PyImport_ImportModule("pickle");
+	errorCheck();
+	p_partition = PyObject_CallMethod(p_pickle, "loads", "(O)", p_data);
+	Py_DECREF(p_pickle);
+	Py_DECREF(p_data);
+	errorCheck();
+	p_quals = scanQualsToPython(node);
+	p_targets_set = valuesToPySet(state->target_list);
+	p_iterable = PyObject_CallMethod(state->fdw_instance, "execute_partition",
+									 "(OOO)", p_partition, p_quals,
+									 p_targets_set);
+	Py_DECREF(p_partition);
+	Py_DECREF(p_quals);
+	Py_DECREF(p_targets_set);
+	errorCheck();
+	if (p_iterable == Py_None)
 	{
-		pymappingToCString(pyobject, buffer, cinfo);
-		return;
+		Py_DECREF(p_iterable);
+		p_iterable = PyTuple_New(0);
 	}
-	PyDateTime_IMPORT;
-	if (PyDate_Check(pyobject))
+	state->p_iterator = scanResultIterator(p_iterable);
+	Py_DECREF(p_iterable);
+	errorCheck();
+	return true;
+}
+
+/*
+ * Call the direct_modify method of the fdw, to execute an UPDATE or a
+ * DELETE as a whole.
+ *
+ * Returns a new reference to its result: the number of modified rows, or an
+ * iterable of the modified rows.
+ */
+PyObject *
+directModify(ForeignScanState *node)
+{
+	MulticornExecState *state = node->fdw_state;
+	ExprContext *econtext = node->ss.ps.ps_ExprContext;
+	PyObject   *p_quals = scanQualsToPython(node),
+			   *p_assignments = PyDict_New(),
+			   *p_returning = PyList_New(0),
+			   *p_result;
+	ListCell   *lc,
+			   *lc2;
+	int			attnum = -1;
+
+	forboth(lc, state->assignment_attnums, lc2, state->assignment_states)
+	{
+		ConversionInfo *cinfo = state->cinfos[lfirst_int(lc) - 1];
+		ExprState  *expr_state = (ExprState *) lfirst(lc2);
+		PyObject   *p_value;
+		Datum		value;
+		bool		isnull;
+
+#if PG_VERSION_NUM >= 100000
+		value = ExecEvalExpr(expr_state, econtext, &isnull);
+#else
+		value = ExecEvalExpr(expr_state, econtext, &isnull, NULL);
+#endif
+		if (isnull)
+		{
+			p_value = Py_None;
+			Py_INCREF(p_value);
+		}
+		else
+		{
+			p_value = datumToPython(value, cinfo->atttypoid, cinfo);
+		}
+		PyDict_SetItem(p_assignments, getAttrKey(cinfo), p_value);
+		Py_DECREF(p_value);
+	}
+	while ((attnum = bms_next_member(state->required_attrs, attnum)) >= 0)
+	{
+		PyList_Append(p_returning, getAttrKey(state->cinfos[attnum - 1]));
+	}
+	p_result = PyObject_CallMethod(state->fdw_instance, "direct_modify",
+								   "(sOOO)",
+								   state->operation == CMD_UPDATE ?
+								   "update" : "delete",
+								   p_quals, p_assignments, p_returning);
+	Py_DECREF(p_quals);
+	Py_DECREF(p_assignments);
+	Py_DECREF(p_returning);
+	errorCheck();
+	return p_result;
+}
+#endif
+
+/*
+ * Returns the next row of a batched scan, fetching the next batch from the
+ * iterator once the current one is exhausted.
+ *
+ * Returns a new reference, or NULL at the end of the scan.
+ */
+PyObject *
+nextBatchRow(MulticornExecState * state)
+{
+	PyObject   *p_row;
+
+	while (state->p_batch == NULL ||
+		   state->batch_index >= PySequence_Fast_GET_SIZE(state->p_batch))
+	{
+		PyObject   *p_next = PyIter_Next(state->p_iterator);
+
+		Py_XDECREF(state->p_batch);
+		state->p_batch = NULL;
+		state->batch_index = 0;
+		errorCheck();
+		if (p_next == NULL)
+		{
+			return NULL;
+		}
+		/* Columnar batches are read by the caller. */
+		if (isColumnBatch(p_next))
+		{
+			return p_next;
+		}
+		state->p_batch = PySequence_Fast(p_next,
+							   "execute_batches must return sequences of rows");
+		Py_DECREF(p_next);
+		errorCheck();
+	}
+	p_row = PySequence_Fast_GET_ITEM(state->p_batch, state->batch_index);
+	state->batch_index++;
+	Py_INCREF(p_row);
+	return p_row;
+}
+
+/*
+ * Returns true if the value is a multicorn.ColumnBatch.
+ */
+bool
+isColumnBatch(PyObject *p_value)
+{
+	static PyObject *p_batch_type = NULL;
+
+	if (p_batch_type == NULL)
+	{
+		p_batch_type = getPythonType("multicorn", "ColumnBatch");
+	}
+	return PyObject_TypeCheck(p_value, (PyTypeObject *) p_batch_type);
+}
+
+/*
+ * Get a one-dimensional typed buffer from a column of a batch.
+ *
+ * Returns false if the object does not expose one, or if its item format is
+ * not a native scalar we know how to read.
+ */
+bool
+getColumnBuffer(PyObject *p_values, Py_buffer *view)
+{
+	const char *format;
+
+	if (!PyObject_CheckBuffer(p_values))
+	{
+		return false;
+	}
+	if (PyObject_GetBuffer(p_values, view, PyBUF_RECORDS_RO) < 0)
+	{
+		PyErr_Clear();
+		return false;
+	}
+	format = view->format;
+	if (format != NULL && (*format == '@' || *format == '='))
+	{
+		format++;
+	}
+	if (view->ndim != 1 || format == NULL || format[0] == '\0' ||
+		format[1] != '\0' || strchr("bBhHiIlLqQnNfd?", format[0]) == NULL)
+	{
+		PyBuffer_Release(view);
+		return false;
+	}
+	return true;
+}
+
+/*
+ * Convert the index-th item of a typed buffer to a datum.
+ *
+ * Integers, floats and booleans going to columns of the same kind are
+ * converted directly, anything else is converted through the corresponding
+ * python object.
+ */
+Datum
+columnBufferToDatum(Py_buffer *view, Py_ssize_t index, ConversionInfo * cinfo,
+					StringInfo buffer)
+{
+	const char *ptr = (const char *) view->buf + index * view->strides[0];
+	char		format = view->format[0];
+	int64		intvalue = 0;
+	uint64		uintvalue = 0;
+	double		floatvalue = 0;
+	bool		isfloat = false,
+				isunsigned = false;
+	PyObject   *p_object;
+	Datum		result;
+
+	if (format == '@' || format == '=')
+	{
+		format = view->format[1];
+	}
+	switch (format)
+	{
+#define READ_BUFFER_VALUE(ctype, target) \
+		do { \
+			ctype tmp; \
+			memcpy(&tmp, ptr, sizeof(ctype)); \
+			target = tmp; \
+		} while (0)
+		case 'b':
+			READ_BUFFER_VALUE(signed char, intvalue);
+			break;
+		case 'B':
+			READ_BUFFER_VALUE(unsigned char, intvalue);
+			break;
+		case 'h':
+			READ_BUFFER_VALUE(short, intvalue);
+			break;
+		case 'H':
+			READ_BUFFER_VALUE(unsigned short, intvalue);
+			break;
+		case 'i':
+			READ_BUFFER_VALUE(int, intvalue);
+			break;
+		case 'I':
+			READ_BUFFER_VALUE(unsigned int, intvalue);
+			break;
+		case 'l':
+			READ_BUFFER_VALUE(long, intvalue);
+			break;
+		case 'q':
+			READ_BUFFER_VALUE(PY_LONG_LONG, intvalue);
+			break;
+		case 'n':
+			READ_BUFFER_VALUE(Py_ssize_t, intvalue);
+			break;
+		case 'L':
+			READ_BUFFER_VALUE(unsigned long, uintvalue);
+			isunsigned = true;
+			break;
+		case 'Q':
+			READ_BUFFER_VALUE(unsigned PY_LONG_LONG, uintvalue);
+			isunsigned = true;
+			break;
+		case 'N':
+			READ_BUFFER_VALUE(size_t, uintvalue);
+			isunsigned = true;
+			break;
+		case 'f':
+			READ_BUFFER_VALUE(float, floatvalue);
+			isfloat = true;
+			break;
+		case 'd':
+			READ_BUFFER_VALUE(double, floatvalue);
+			isfloat = true;
+			break;
+		case '?':
+			{
+				bool		boolvalue;
+
+				READ_BUFFER_VALUE(bool, boolvalue);
+				if (cinfo->atttypoid == BOOLOID)
+				{
+					return BoolGetDatum(boolvalue);
+				}
+				p_object = PyBool_FromLong(boolvalue);
+				result = pyobjectToDatum(p_object, buffer, cinfo);
+				Py_DECREF(p_object);
+				return result;
+			}
+#undef READ_BUFFER_VALUE
+	}
+	if (isunsigned)
+	{
+		if (uintvalue > (uint64) INT64CONST(0x7FFFFFFFFFFFFFFF))
+		{
+			p_object = PyLong_FromUnsignedLongLong(uintvalue);
+			result = pyobjectToDatum(p_object, buffer, cinfo);
+			Py_DECREF(p_object);
+			return result;
+		}
+		intvalue = (int64) uintvalue;
+	}
+	switch (cinfo->atttypoid)
+	{
+		case INT2OID:
+			if (!isfloat && intvalue >= SHRT_MIN && intvalue <= SHRT_MAX)
+			{
+				return Int16GetDatum((int16) intvalue);
+			}
+			break;
+		case INT4OID:
+			if (!isfloat && intvalue >= INT_MIN && intvalue <= INT_MAX)
+			{
+				return Int32GetDatum((int32) intvalue);
+			}
+			break;
+		case INT8OID:
+			if (!isfloat)
+			{
+				return Int64GetDatum(intvalue);
+			}
+			break;
+		case FLOAT4OID:
+			{
+				double		doublevalue = isfloat ? floatvalue : (double) intvalue;
+				float4		shortvalue = (float4) doublevalue;
+
+				/* Let float4in complain about overflows and underflows */
+				if ((isinf(shortvalue) && !isinf(doublevalue)) ||
+					(shortvalue == 0.0 && doublevalue != 0.0))
+				{
+					break;
+				}
+				return Float4GetDatum(shortvalue);
+			}
+		case FLOAT8OID:
+			return Float8GetDatum(isfloat ? floatvalue : (float8) intvalue);
+		default:
+			break;
+	}
+	if (isfloat)
+	{
+		p_object = PyFloat_FromDouble(floatvalue);
+	}
+	else
+	{
+		p_object = PyLong_FromLongLong(intvalue);
+	}
+	result = pyobjectToDatum(p_object, buffer, cinfo);
+	Py_DECREF(p_object);
+	return result;
+}
+
+/*
+ * Start reading a multicorn.ColumnBatch.
+ *
+ * Every column is either read from a typed buffer, or converted value by
+ * value from a sequence.
+ */
+void
+beginColumnBatch(MulticornExecState * state, PyObject *p_batch)
+{
+	PyObject   *p_columns = PyObject_GetAttrString(p_batch, "columns"),
+			   *p_nulls = PyObject_GetAttrString(p_batch, "nulls"),
+			   *p_size = PyObject_GetAttrString(p_batch, "size");
+	const char *error = NULL;
+	char	   *attrname = NULL;
+	int			i;
+
+	endColumnBatch(state);
+	if (p_columns == NULL || p_nulls == NULL || p_size == NULL)
+	{
+		Py_XDECREF(p_columns);
+		Py_XDECREF(p_nulls);
+		Py_XDECREF(p_size);
+		errorCheck();
+	}
+	state->column_batch_size = PyNumber_AsSsize_t(p_size, NULL);
+	Py_DECREF(p_size);
+	if (PyErr_Occurred())
+	{
+		Py_DECREF(p_columns);
+		Py_DECREF(p_nulls);
+		errorCheck();
+	}
+	Py_INCREF(p_batch);
+	state->p_column_batch = p_batch;
+	state->column_batch_index = 0;
+	for (i = 0; i < state->ncolumns && error == NULL && !PyErr_Occurred(); i++)
+	{
+		MulticornColumnData *column = &state->columns[i];
+		ConversionInfo *cinfo = state->cinfos[i];
+		PyObject   *p_values,
+				   *p_bitmap;
+
+		memset(column, 0, sizeof(MulticornColumnData));
+		if (cinfo == NULL || !bms_is_member(i + 1, state->required_attrs))
+		{
+			continue;
+		}
+		attrname = cinfo->attrname;
+		/* Missing columns are NULL, as with dicts. */
+		p_values = PyObject_GetItem(p_columns, getAttrKey(cinfo));
+		if (p_values == NULL)
+		{
+			PyErr_Clear();
+			continue;
+		}
+		if (getColumnBuffer(p_values, &column->view))
+		{
+			column->has_view = true;
+			if (column->view.shape[0] != state->column_batch_size)
+			{
+				error = "Invalid length for column %s in batch";
+			}
+		}
+		else
+		{
+			column->p_values = PySequence_Fast(p_values,
+								 "The columns of a batch must be sequences");
+			if (column->p_values != NULL &&
+				PySequence_Fast_GET_SIZE(column->p_values) != state->column_batch_size)
+			{
+				error = "Invalid length for column %s in batch";
+			}
+		}
+		Py_DECREF(p_values);
+		if (error != NULL || PyErr_Occurred() || p_nulls == Py_None)
+		{
+			continue;
+		}
+		p_bitmap = PyObject_GetItem(p_nulls, getAttrKey(cinfo));
+		if (p_bitmap == NULL)
+		{
+			PyErr_Clear();
+			continue;
+		}
+		if (PyObject_GetBuffer(p_bitmap, &column->nulls, PyBUF_SIMPLE) == 0)
+		{
+			column->has_nulls = true;
+			if (column->nulls.len < (state->column_batch_size + 7) / 8)
+			{
+				error = "Null bitmap too short for column %s in batch";
+			}
+		}
+		Py_DECREF(p_bitmap);
+	}
+	Py_DECREF(p_columns);
+	Py_DECREF(p_nulls);
+	/* Release the buffers and sequences of a rejected batch */
+	if (error != NULL || PyErr_Occurred())
+	{
+		endColumnBatch(state);
+		errorCheck();
+		ereport(ERROR, (errmsg(error, attrname)));
+	}
+}
+
+/*
+ * Fill the slot with the next row of the current columnar batch.
+ *
+ * Returns false, after releasing the batch, once it is exhausted.
+ */
+bool
+columnBatchToTuple(MulticornExecState * state, TupleTableSlot *slot)
+{
+	Py_ssize_t	index = state->column_batch_index;
+	int			i;
+
+	if (state->p_column_batch == NULL)
+	{
+		return false;
+	}
+	if (index >= state->column_batch_size)
+	{
+		endColumnBatch(state);
+		return false;
+	}
+	for (i = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	{
+		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor, i);
+		AttrNumber	cinfo_idx = attr->attnum - 1;
+		ConversionInfo *cinfo = state->cinfos[cinfo_idx];
+		MulticornColumnData *column = &state->columns[cinfo_idx];
+
+		slot->tts_values[i] = (Datum) 0;
+		slot->tts_isnull[i] = true;
+		if (cinfo == NULL)
+		{
+			continue;
+		}
+		if (column->has_nulls &&
+			(((const unsigned char *) column->nulls.buf)[index >> 3] & (1 << (index & 7))))
+		{
+			continue;
+		}
+		if (column->has_view)
+		{
+			resetStringInfo(state->buffer);
+			slot->tts_values[i] = columnBufferToDatum(&column->view, index,
+													  cinfo, state->buffer);
+			slot->tts_isnull[i] = false;
+		}
+		else if (column->p_values != NULL)
+		{
+			PyObject   *p_object = PySequence_Fast_GET_ITEM(column->p_values, index);
+
+			if (p_object != Py_None)
+			{
+				resetStringInfo(state->buffer);
+				slot->tts_values[i] = pyobjectToDatum(p_object, state->buffer,
+													  cinfo);
+				slot->tts_isnull[i] = false;
+			}
+		}
+	}
+	state->column_batch_index++;
+	return true;
+}
+
+/*
+ * Release the current columnar batch, if any.
+ */
+void
+endColumnBatch(MulticornExecState * state)
+{
+	int			i;
+
+	if (state->p_column_batch == NULL)
 	{
-		pydateToCString(pyobject, buffer, cinfo);
 		return;
 	}
-	pyunknownToCstring(pyobject, buffer, cinfo);
+	for (i = 0; i < state->ncolumns; i++)
+	{
+		MulticornColumnData *column = &state->columns[i];
+
+		if (column->has_view)
+		{
+			PyBuffer_Release(&column->view);
+		}
+		if (column->has_nulls)
+		{
+			PyBuffer_Release(&column->nulls);
+		}
+		Py_XDECREF(column->p_values);
+		memset(column, 0, sizeof(MulticornColumnData));
+	}
+	Py_DECREF(state->p_column_batch);
+	state->p_column_batch = NULL;
+}
+
+void
+pynumberToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
+	PyObject   *pTempStr;
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+
+	pTempStr = PyObject_Str(pyobject);
+	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+	appendBinaryStringInfo(buffer, tempbuffer, strlength);
+	Py_DECREF(pTempStr);
+}
+
+void
+pyunicodeToCString(PyObject *pyobject, StringInfo buffer,
+				   ConversionInfo * cinfo)
+{
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+	PyObject   *pTempStr;
+
+	tempbuffer = pyunicodeAsServerString(pyobject, &strlength, &pTempStr);
+	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+	Py_XDECREF(pTempStr);
+}
+
+void
+pystringToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+
+	if (PyString_AsStringAndSize(pyobject, &tempbuffer, &strlength) < 0)
+	{
+		ereport(WARNING,
+				(errmsg("An error occured while decoding the %s column",
+						cinfo->attrname),
+				 errhint("You should maybe return unicode instead?")));
+	}
+	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+}
+
+void
+pysequenceToCString(PyObject *pyobject, StringInfo buffer,
+					ConversionInfo * cinfo)
+{
+	/* Its an array */
+	Py_ssize_t	i,
+				size = PySequence_Size(pyobject);
+	PyObject   *p_item;
+	int			previous_dims = cinfo->attndims,
+				previous_needquote = cinfo->need_quote;
+
+	if (cinfo->attndims == 0)
+	{
+		/* We are not supposed to be converted to an array. */
+		pyunknownToCstring(pyobject, buffer, cinfo);
+		return;
+	}
+	appendStringInfoChar(buffer, '{');
+	/* We are an array, so we need to quote stuff */
+	cinfo->need_quote = true;
+	cinfo->attndims = cinfo->attndims - 1;
+	for (i = 0; i < size; i++)
+	{
+		p_item = PySequence_GetItem(pyobject, i);
+		pyobjectToCString(p_item, buffer, cinfo);
+		Py_DECREF(p_item);
+		if (i != size - 1)
+		{
+			appendBinaryStringInfo(buffer, ", ", 2);
+		}
+	}
+	appendStringInfoChar(buffer, '}');
+	cinfo->attndims = previous_dims;
+	cinfo->need_quote = previous_needquote;
+}
+
+void
+pymappingToCString(PyObject *pyobject, StringInfo buffer,
+				   ConversionInfo * cinfo)
+{
+	PyObject   *items = PyMapping_Items(pyobject);
+	PyObject   *current_tuple;
+	Py_ssize_t	i;
+	Py_ssize_t	size = PyList_Size(items);
+	bool		need_quote = cinfo->need_quote;
+
+	cinfo->need_quote = true;
+	for (i = 0; i < size; i++)
+	{
+		current_tuple = PySequence_GetItem(items, i);
+		pyobjectToCString(PyTuple_GetItem(current_tuple, 0),
+						  buffer, cinfo);
+		appendBinaryStringInfo(buffer, "=>", 2);
+		pyobjectToCString(PyTuple_GetItem(current_tuple, 1),
+						  buffer, cinfo);
+		if (i != size - 1)
+		{
+			appendBinaryStringInfo(buffer, ", ", 2);
+		}
+		Py_DECREF(current_tuple);
+	}
+	Py_DECREF(items);
+	cinfo->need_quote = need_quote;
+}
+
+void
+pydateToCString(PyObject *pyobject, StringInfo buffer,
+				ConversionInfo * cinfo)
+{
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+	PyObject   *formatted_date;
+
+	formatted_date = PyObject_CallMethod(pyobject, "isoformat", "()");
+	PyString_AsStringAndSize(formatted_date, &tempbuffer, &strlength);
+	appendBinaryStringInfo(buffer, tempbuffer, strlength);
+	Py_DECREF(formatted_date);
+}
+
+
+/*
+ * Returns the function used to convert the given python object to its
+ * text representation.
+ */
+PyObjectToCStringFunc
+getCStringConverter(PyObject *pyobject)
+{
+	if (PyNumber_Check(pyobject))
+	{
+		return pynumberToCString;
+	}
+	if (PyUnicode_Check(pyobject))
+	{
+		return pyunicodeToCString;
+	}
+	if (PyBytes_Check(pyobject))
+	{
+		return pystringToCString;
+	}
+	if (PySequence_Check(pyobject))
+	{
+		return pysequenceToCString;
+	}
+	if (PyMapping_Check(pyobject))
+	{
+		return pymappingToCString;
+	}
+	if (PyDateTimeAPI == NULL)
+	{
+		PyDateTime_IMPORT;
+	}
+	if (PyDate_Check(pyobject))
+	{
+		return pydateToCString;
+	}
+	return pyunknownToCstring;
+}
+
+/*
+ * Same as getCStringConverter, but from the python type alone.
+ *
+ * Only the exact builtin types are known, NULL is returned for anything
+ * else.
+ */
+PyObjectToCStringFunc
+getCStringConverterForType(PyTypeObject *type)
+{
+	if (PyDateTimeAPI == NULL)
+	{
+		PyDateTime_IMPORT;
+	}
+	if (type == &PyLong_Type || type == &PyFloat_Type ||
+#if PY_MAJOR_VERSION < 3
+		type == &PyInt_Type ||
+#endif
+		type == &PyBool_Type)
+	{
+		return pynumberToCString;
+	}
+	if (type == &PyUnicode_Type)
+	{
+		return pyunicodeToCString;
+	}
+	if (type == &PyBytes_Type)
+	{
+		return pystringToCString;
+	}
+	if (type == &PyList_Type || type == &PyTuple_Type)
+	{
+		return pysequenceToCString;
+	}
+	if (type == &PyDict_Type)
+	{
+		return pymappingToCString;
+	}
+	if (type == PyDateTimeAPI->DateType || type == PyDateTimeAPI->DateTimeType)
+	{
+		return pydateToCString;
+	}
+	return NULL;
+}
+
+void
+pyobjectToCString(PyObject *pyobject, StringInfo buffer,
+				  ConversionInfo * cinfo)
+{
+	if (pyobject == NULL || pyobject == Py_None)
+	{
+		return;
+	}
+	getCStringConverter(pyobject) (pyobject, buffer, cinfo);
+}
+
+void
+pyunknownToCstring(PyObject *pyobject, StringInfo buffer,
+				   ConversionInfo * cinfo)
+{
+	PyObject   *pTempStr = PyObject_Str(pyobject);
+	char	   *tempbuffer;
+	Py_ssize_t	strlength;
+
+	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
+	errorCheck();
+	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
+	Py_DECREF(pTempStr);
+	return;
+}
+
+/*
+ * Returns the interned python string for the attribute name, used as a key
+ * in dict rows.
+ *
+ * The key is kept in the ConversionInfo until releaseConversionInfo is
+ * called.
+ */
+PyObject *
+getAttrKey(ConversionInfo * cinfo)
+{
+	if (cinfo->attrkey == NULL)
+	{
+		cinfo->attrkey = PyString_FromString(cinfo->attrname);
+		errorCheck();
+#if PY_MAJOR_VERSION >= 3
+		PyUnicode_InternInPlace(&cinfo->attrkey);
+#else
+		PyString_InternInPlace(&cinfo->attrkey);
+#endif
+	}
+	return cinfo->attrkey;
+}
+
+/*
+ * Release the python objects held by an array of ConversionInfo.
+ */
+void
+releaseConversionInfo(ConversionInfo ** cinfos, int natts)
+{
+	int			i;
+
+	for (i = 0; i < natts; i++)
+	{
+		if (cinfos[i] != NULL)
+		{
+			Py_CLEAR(cinfos[i]->attrkey);
+		}
+	}
+}
+
+void
+pythonDictToTuple(PyObject *p_value,
+				  TupleTableSlot *slot,
+				  ConversionInfo ** cinfos,
+				  Bitmapset *required_attrs,
+				  StringInfo buffer)
+{
+	int			i;
+	PyObject   *p_object;
+	Datum	   *values = slot->tts_values;
+	bool	   *nulls = slot->tts_isnull;
+	bool		is_dict = PyDict_CheckExact(p_value);
+
+	for (i = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	{
+		PyObject   *key;
+		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor,i);
+		AttrNumber	cinfo_idx = attr->attnum - 1;
+
+		if (cinfos[cinfo_idx] == NULL)
+		{
+			continue;
+		}
+		/* Columns not needed by the query are left NULL. */
+		if (!bms_is_member(attr->attnum, required_attrs))
+		{
+			values[i] = (Datum) 0;
+			nulls[i] = true;
+			continue;
+		}
+		key = getAttrKey(cinfos[cinfo_idx]);
+		if (is_dict)
+		{
+			/* Borrowed reference, released with the others below. */
+#if PY_MAJOR_VERSION >= 3
+			p_object = PyDict_GetItemWithError(p_value, key);
+#else
+			p_object = PyDict_GetItem(p_value, key);
+#endif
+			Py_XINCREF(p_object);
+		}
+		else
+		{
+			p_object = PyObject_GetItem(p_value, key);
+		}
+		if (p_object != NULL && p_object != Py_None)
+		{
+			resetStringInfo(buffer);
+			values[i] = pyobjectToDatum(p_object,
+										buffer,
+										cinfos[cinfo_idx]);
+			if (buffer->data == NULL)
+			{
+				nulls[i] = true;
+			}
+			else
+			{
+				nulls[i] = false;
+			}
+		}
+		else
+		{
+			/* "KeyError", doesnt matter. */
+			PyErr_Clear();
+			values[i] = (Datum) NULL;
+			nulls[i] = true;
+		}
+		Py_XDECREF(p_object);
+	}
+}
+
+void
+pythonSequenceToTuple(PyObject *p_value,
+					  TupleTableSlot *slot,
+					  ConversionInfo ** cinfos,
+					  Bitmapset *required_attrs,
+					  StringInfo buffer)
+{
+	int			i,
+				j;
+	Datum	   *values = slot->tts_values;
+	bool	   *nulls = slot->tts_isnull;
+	/* Exact tuples and lists are read directly. */
+	bool		is_fast = PyTuple_CheckExact(p_value) || PyList_CheckExact(p_value);
+
+	for (i = 0, j = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	{
+		PyObject   *p_object;
+		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor,i);
+		AttrNumber	cinfo_idx = attr->attnum - 1;
+
+		if (cinfos[cinfo_idx] == NULL)
+		{
+			continue;
+		}
+		/* The list may be modified while converting its items. */
+		if (is_fast && j >= PySequence_Fast_GET_SIZE(p_value))
+		{
+			rowWidthError(slot->tts_tupleDescriptor, cinfos,
+						  PySequence_Fast_GET_SIZE(p_value));
+		}
+		/* Columns not needed by the query are left NULL. */
+		if (!bms_is_member(attr->attnum, required_attrs))
+		{
+			values[i] = (Datum) 0;
+			nulls[i] = true;
+			j++;
+			continue;
+		}
+		if (is_fast)
+		{
+			p_object = PySequence_Fast_GET_ITEM(p_value, j);
+			Py_INCREF(p_object);
+		}
+		else
+		{
+			p_object = PySequence_GetItem(p_value, j);
+		}
+		if(p_object == NULL || p_object == Py_None){
+			nulls[i] = true;
+			values[i] = 0;
+		}
+		else
+		{
+			resetStringInfo(buffer);
+			values[i] = pyobjectToDatum(p_object, buffer,
+										cinfos[cinfo_idx]);
+			if (buffer->data == NULL)
+			{
+				nulls[i] = true;
+			}
+			else
+			{
+				nulls[i] = false;
+			}
+		}
+		errorCheck();
+		Py_DECREF(p_object);
+		j++;
+	}
+	if (is_fast && j != PySequence_Fast_GET_SIZE(p_value))
+	{
+		rowWidthError(slot->tts_tupleDescriptor, cinfos,
+					  PySequence_Fast_GET_SIZE(p_value));
+	}
+}
+
+/*
+ * Report a tuple or list row whose length does not match the number of
+ * columns.
+ */
+void
+rowWidthError(TupleDesc desc, ConversionInfo ** cinfos, Py_ssize_t size)
+{
+	int			i,
+				width = 0;
+
+	for (i = 0; i < desc->natts; i++)
+	{
+		if (cinfos[TupleDescAttr(desc, i)->attnum - 1] != NULL)
+		{
+			width++;
+		}
+	}
+	ereport(ERROR, (errmsg("Invalid row returned by the foreign data wrapper"),
+					errdetail("Expected %d values, got %d", width, (int) size),
+					errhint("Sequence rows must contain every column of the table")));
+}
+
+/*
+ * Convert a python result (a sequence or a dictionary) to a tupletableslot.
+ *
+ * Only the attributes in required_attrs are converted, the others are set to
+ * NULL.
+ */
+void
+pythonResultToTuple(PyObject *p_value,
+					TupleTableSlot *slot,
+					ConversionInfo ** cinfos,
+					Bitmapset *required_attrs,
+					StringInfo buffer)
+{
+	if (PySequence_Check(p_value))
+	{
+		pythonSequenceToTuple(p_value, slot, cinfos, required_attrs, buffer);
+	}
+	else
+	{
+
+		if (PyMapping_Check(p_value))
+		{
+			pythonDictToTuple(p_value, slot, cinfos, required_attrs, buffer);
+		}
+		else
+		{
+			elog(ERROR, "Cannot transform anything else than mappings and"
+				 "sequences to rows");
+		}
+	}
+}
+
+/*
+ * Import a type from a python module.
+ *
+ * Returns a new reference to the type.
+ */
+PyObject *
+getPythonType(const char *moduleName, const char *typeName)
+{
+	PyObject   *p_module = PyImport_ImportModule(moduleName),
+			   *p_type;
+
+	errorCheck();
+	p_type = PyObject_GetAttrString(p_module, typeName);
+	Py_DECREF(p_module);
+	errorCheck();
+	return p_type;
+}
+
+/*
+ * Convert a python integer to an int2, int4 or int8 datum.
+ *
+ * Out of range values are left to the type input function, which will raise
+ * the appropriate error.
+ */
+bool
+pyintToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	PY_LONG_LONG result;
+	int			overflow;
+
+	if (!PyIntegral_Check(object))
+	{
+		return false;
+	}
+	result = PyLong_AsLongLongAndOverflow(object, &overflow);
+	if (overflow != 0 || (result == -1 && PyErr_Occurred()))
+	{
+		PyErr_Clear();
+		return false;
+	}
+	switch (cinfo->atttypoid)
+	{
+		case INT2OID:
+			if (result < SHRT_MIN || result > SHRT_MAX)
+			{
+				return false;
+			}
+			*value = Int16GetDatum((int16) result);
+			break;
+		case INT4OID:
+			if (result < INT_MIN || result > INT_MAX)
+			{
+				return false;
+			}
+			*value = Int32GetDatum((int32) result);
+			break;
+		default:
+			*value = Int64GetDatum((int64) result);
+			break;
+	}
+	return true;
+}
+
+/*
+ * Convert a python float (or integer) to a float4 or float8 datum.
+ */
+bool
+pyfloatToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	double		result;
+
+	if (PyFloat_Check(object))
+	{
+		result = PyFloat_AS_DOUBLE(object);
+	}
+	else if (PyIntegral_Check(object))
+	{
+		result = PyFloat_AsDouble(object);
+		if (result == -1.0 && PyErr_Occurred())
+		{
+			PyErr_Clear();
+			return false;
+		}
+	}
+	else
+	{
+		return false;
+	}
+	if (cinfo->atttypoid == FLOAT4OID)
+	{
+		float4		shortresult = (float4) result;
+
+		/* Let float4in complain about overflows and underflows */
+		if ((isinf(shortresult) && !isinf(result)) ||
+			(shortresult == 0.0 && result != 0.0))
+		{
+			return false;
+		}
+		*value = Float4GetDatum(shortresult);
+	}
+	else
+	{
+		*value = Float8GetDatum(result);
+	}
+	return true;
+}
+
+bool
+pyboolToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	if (!PyBool_Check(object))
+	{
+		return false;
+	}
+	*value = BoolGetDatum(object == Py_True);
+	return true;
+}
+
+/*
+ * Convert a python integer, float or Decimal to a numeric datum.
+ *
+ * Numeric internals are private to PostgreSQL, so only integers are built
+ * directly. Floats and decimals still go through numeric_in, but without the
+ * intermediate python string and StringInfo copies.
+ */
+bool
+pynumericToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	static PyObject *p_decimal_type = NULL;
+	char	   *tempbuffer;
+
+	if (PyIntegral_Check(object))
+	{
+		PY_LONG_LONG result;
+		int			overflow;
+
+		result = PyLong_AsLongLongAndOverflow(object, &overflow);
+		if (overflow != 0 || (result == -1 && PyErr_Occurred()))
+		{
+			PyErr_Clear();
+			return false;
+		}
+		*value = DirectFunctionCall1(int8_numeric, Int64GetDatum((int64) result));
+		if (cinfo->atttypmod >= 0)
+		{
+			*value = DirectFunctionCall2(numeric, *value,
+										 Int32GetDatum(cinfo->atttypmod));
+		}
+		return true;
+	}
+	if (PyFloat_Check(object))
+	{
+		/* Use the same representation as str(float) */
+#if PY_MAJOR_VERSION >= 3
+		char	   *repr = PyOS_double_to_string(PyFloat_AS_DOUBLE(object),
+												 'r', 0, Py_DTSF_ADD_DOT_0,
+												 NULL);
+#else
+		char	   *repr = PyOS_double_to_string(PyFloat_AS_DOUBLE(object),
+												 'g', 12, Py_DTSF_ADD_DOT_0,
+												 NULL);
+#endif
+
+		if (repr == NULL)
+		{
+			PyErr_Clear();
+			return false;
+		}
+		tempbuffer = pstrdup(repr);
+		PyMem_Free(repr);
+	}
+	else
+	{
+		PyObject   *p_str;
+
+		if (p_decimal_type == NULL)
+		{
+			p_decimal_type = getPythonType("decimal", "Decimal");
+		}
+		if (!PyObject_TypeCheck(object, (PyTypeObject *) p_decimal_type))
+		{
+			return false;
+		}
+		p_str = PyObject_Str(object);
+		errorCheck();
+		/* The decimal text form only contains ascii characters. */
+#if PY_MAJOR_VERSION >= 3
+		tempbuffer = pstrdup(PyUnicode_AsUTF8(p_str));
+#else
+		tempbuffer = pstrdup(PyString_AsString(p_str));
+#endif
+		Py_DECREF(p_str);
+		errorCheck();
+	}
+	*value = InputFunctionCall(cinfo->attinfunc,
+							   tempbuffer,
+							   cinfo->attioparam,
+							   cinfo->atttypmod);
+	pfree(tempbuffer);
+	return true;
+}
+
+bool
+pydateToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	if (PyDateTimeAPI == NULL)
+	{
+		PyDateTime_IMPORT;
+	}
+	/* Datetimes are left to date_in */
+	if (!PyDate_Check(object) || PyDateTime_Check(object))
+	{
+		return false;
+	}
+	*value = DateADTGetDatum(date2j(PyDateTime_GET_YEAR(object),
+									PyDateTime_GET_MONTH(object),
+									PyDateTime_GET_DAY(object))
+							 - POSTGRES_EPOCH_JDATE);
+	return true;
+}
+
+/*
+ * Convert a python datetime to a timestamp or timestamptz datum.
+ *
+ * Like timestamp_in, the timezone is ignored for timestamp columns.
+ * Naive datetimes are considered to be in the session timezone for
+ * timestamptz columns.
+ */
+bool
+pydatetimeToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+#ifdef HAVE_INT64_TIMESTAMP
+	struct pg_tm tm;
+	fsec_t		fsec;
+	int			tz;
+	Timestamp	result;
+	PyDateTime_DateTime *p_datetime = (PyDateTime_DateTime *) object;
+
+	if (PyDateTimeAPI == NULL)
+	{
+		PyDateTime_IMPORT;
+	}
+	/* Precision modifiers are left to the input function. */
+	if (!PyDateTime_Check(object) || cinfo->atttypmod >= 0)
+	{
+		return false;
+	}
+	MemSet(&tm, 0, sizeof(struct pg_tm));
+	tm.tm_year = PyDateTime_GET_YEAR(object);
+	tm.tm_mon = PyDateTime_GET_MONTH(object);
+	tm.tm_mday = PyDateTime_GET_DAY(object);
+	tm.tm_hour = PyDateTime_DATE_GET_HOUR(object);
+	tm.tm_min = PyDateTime_DATE_GET_MINUTE(object);
+	tm.tm_sec = PyDateTime_DATE_GET_SECOND(object);
+	fsec = PyDateTime_DATE_GET_MICROSECOND(object);
+	if (cinfo->atttypoid == TIMESTAMPOID)
+	{
+		if (tm2timestamp(&tm, fsec, NULL, &result) != 0)
+		{
+			return false;
+		}
+		*value = TimestampGetDatum(result);
+		return true;
+	}
+	if (!p_datetime->hastzinfo || p_datetime->tzinfo == Py_None)
+	{
+		tz = DetermineTimeZoneOffset(&tm, session_timezone);
+	}
+	else
+	{
+		PyObject   *p_offset = PyObject_CallMethod(object, "utcoffset", "()");
+		PyDateTime_Delta *p_delta = (PyDateTime_Delta *) p_offset;
+
+		if (p_offset == NULL)
+		{
+			PyErr_Clear();
+			return false;
+		}
+		if (!PyDelta_Check(p_offset) || p_delta->microseconds != 0)
+		{
+			Py_DECREF(p_offset);
+			return false;
+		}
+		tz = -(p_delta->days * SECS_PER_DAY + p_delta->seconds);
+		Py_DECREF(p_offset);
+	}
+	if (tm2timestamp(&tm, fsec, &tz, &result) != 0)
+	{
+		return false;
+	}
+	*value = TimestampTzGetDatum(result);
+	return true;
+#else
+	return false;
+#endif
+}
+
+/*
+ * Convert a python string, or any object exposing a contiguous buffer, to a
+ * text, varchar or bytea datum.
+ */
+bool
+pytextToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	char	   *tempbuffer;
+	Py_ssize_t	strlength = 0;
+
+	if (PyUnicode_Check(object))
+	{
+		PyObject   *pTempStr;
+
+		tempbuffer = pyunicodeAsServerString(object, &strlength, &pTempStr);
+		*value = PointerGetDatum(cstring_to_text_with_len(tempbuffer, strlength));
+		Py_XDECREF(pTempStr);
+		return true;
+	}
+	if (PyBytes_Check(object))
+	{
+		PyBytes_AsStringAndSize(object, &tempbuffer, &strlength);
+		*value = PointerGetDatum(cstring_to_text_with_len(tempbuffer, strlength));
+		return true;
+	}
+	if (PyObject_CheckBuffer(object))
+	{
+		/* bytearray, memoryview and other contiguous buffers */
+		Py_buffer	view;
+
+		if (PyObject_GetBuffer(object, &view, PyBUF_SIMPLE) < 0)
+		{
+			PyErr_Clear();
+			return false;
+		}
+		*value = PointerGetDatum(cstring_to_text_with_len(view.buf, view.len));
+		PyBuffer_Release(&view);
+		return true;
+	}
+	return false;
+}
+
+bool
+pyuuidToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
+{
+	static PyObject *p_uuid_type = NULL;
+	PyObject   *p_bytes;
+	pg_uuid_t  *uuid;
+
+	if (p_uuid_type == NULL)
+	{
+		p_uuid_type = getPythonType("uuid", "UUID");
+	}
+	if (!PyObject_TypeCheck(object, (PyTypeObject *) p_uuid_type))
+	{
+		return false;
+	}
+	p_bytes = PyObject_GetAttrString(object, "bytes");
+	if (p_bytes == NULL || !PyBytes_Check(p_bytes) ||
+		PyBytes_GET_SIZE(p_bytes) != UUID_LEN)
+	{
+		PyErr_Clear();
+		Py_XDECREF(p_bytes);
+		return false;
+	}
+	uuid = (pg_uuid_t *) palloc(sizeof(pg_uuid_t));
+	memcpy(uuid->data, PyBytes_AS_STRING(p_bytes), UUID_LEN);
+	Py_DECREF(p_bytes);
+	*value = UUIDPGetDatum(uuid);
+	return true;
 }
 
-void
-pyunknownToCstring(PyObject *pyobject, StringInfo buffer,
-				   ConversionInfo * cinfo)
+/*
+ * Convert a dict, list or tuple to a json or jsonb datum.
+ *
+ * The value is serialized as JSON text, which is then parsed by the
+ * column's input function. Other values, notably strings which already
+ * contain a JSON document, go through the usual conversion path.
+ */
+bool
+pyjsonToDatum(PyObject *object, ConversionInfo * cinfo, Datum *value)
 {
-	PyObject   *pTempStr = PyObject_Str(pyobject);
-	char	   *tempbuffer;
-	Py_ssize_t	strlength;
+	StringInfoData buffer;
 
-	PyString_AsStringAndSize(pTempStr, &tempbuffer, &strlength);
-	errorCheck();
-	appendBinaryStringInfoQuote(buffer, tempbuffer, strlength, cinfo->need_quote);
-	Py_DECREF(pTempStr);
-	return;
+	if (!PyDict_Check(object) && !PyList_Check(object) &&
+		!PyTuple_Check(object))
+	{
+		return false;
+	}
+	initStringInfo(&buffer);
+	pyobjectToJson(object, &buffer, cinfo);
+	*value = InputFunctionCall(cinfo->attinfunc, buffer.data,
+							   cinfo->attioparam, cinfo->atttypmod);
+	pfree(buffer.data);
+	return true;
 }
 
+/*
+ * Serialize a python object as JSON text.
+ *
+ * Objects without a JSON equivalent, such as dates, are written as strings
+ * using their usual text representation.
+ */
 void
-pythonDictToTuple(PyObject *p_value,
-				  TupleTableSlot *slot,
-				  ConversionInfo ** cinfos,
-				  StringInfo buffer)
+pyobjectToJson(PyObject *pyobject, StringInfo buffer, ConversionInfo * cinfo)
 {
-	int			i;
-	PyObject   *p_object;
-	Datum	   *values = slot->tts_values;
-	bool	   *nulls = slot->tts_isnull;
+	static PyObject *p_decimal_type = NULL;
 
-	for (i = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	check_stack_depth();
+	if (p_decimal_type == NULL)
 	{
-		char	   *key;
-		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor,i);
-		AttrNumber	cinfo_idx = attr->attnum - 1;
+		p_decimal_type = getPythonType("decimal", "Decimal");
+	}
+	if (pyobject == Py_None)
+	{
+		appendStringInfoString(buffer, "null");
+	}
+	else if (PyBool_Check(pyobject))
+	{
+		appendStringInfoString(buffer,
+							   pyobject == Py_True ? "true" : "false");
+	}
+	else if (PyIntegral_Check(pyobject) || PyFloat_Check(pyobject) ||
+			 PyObject_TypeCheck(pyobject, (PyTypeObject *) p_decimal_type))
+	{
+		PyObject   *p_number = pyobject;
+		PyObject   *p_str;
+		PyObject   *pTempStr = NULL;
+		char	   *tempbuffer;
+		Py_ssize_t	strlength;
 
-		if (cinfos[cinfo_idx] == NULL)
+		if (PyFloat_Check(pyobject))
 		{
-			continue;
+			double		number = PyFloat_AsDouble(pyobject);
+
+			if (isnan(number) || isinf(number))
+			{
+				ereport(ERROR, (errmsg("Cannot convert %s to JSON",
+									   isnan(number) ? "NaN" : "Infinity"),
+								errhint("JSON numbers must be finite")));
+			}
+			p_str = PyObject_Repr(pyobject);
 		}
-		key = cinfos[cinfo_idx]->attrname;
-		p_object = PyMapping_GetItemString(p_value, key);
-		if (p_object != NULL && p_object != Py_None)
+		else
 		{
-			resetStringInfo(buffer);
-			values[i] = pyobjectToDatum(p_object,
-										buffer,
-										cinfos[cinfo_idx]);
-			if (buffer->data == NULL)
+			/* Int subclasses (enums...) may override __str__ */
+			if (PyIntegral_Check(pyobject))
 			{
-				nulls[i] = true;
+				p_number = PyNumber_Long(pyobject);
+				errorCheck();
 			}
 			else
 			{
-				nulls[i] = false;
+				Py_INCREF(p_number);
 			}
+			p_str = PyObject_Str(p_number);
+			Py_DECREF(p_number);
+		}
+		errorCheck();
+		if (PyUnicode_Check(p_str))
+		{
+			tempbuffer = pyunicodeAsServerString(p_str, &strlength, &pTempStr);
 		}
 		else
 		{
-			/* "KeyError", doesnt matter. */
-			PyErr_Clear();
-			values[i] = (Datum) NULL;
-			nulls[i] = true;
+			PyBytes_AsStringAndSize(p_str, &tempbuffer, &strlength);
 		}
-		Py_XDECREF(p_object);
+		appendBinaryStringInfo(buffer, tempbuffer, strlength);
+		Py_XDECREF(pTempStr);
+		Py_DECREF(p_str);
 	}
-}
-
-void
-pythonSequenceToTuple(PyObject *p_value,
-					  TupleTableSlot *slot,
-					  ConversionInfo ** cinfos,
-					  StringInfo buffer)
-{
-	int			i,
-				j;
-	Datum	   *values = slot->tts_values;
-	bool	   *nulls = slot->tts_isnull;
-
-	for (i = 0, j = 0; i < slot->tts_tupleDescriptor->natts; i++)
+	else if (PyUnicode_Check(pyobject) || PyBytes_Check(pyobject))
 	{
-		PyObject   *p_object;
-		Form_pg_attribute attr = TupleDescAttr(slot->tts_tupleDescriptor,i);
-		AttrNumber	cinfo_idx = attr->attnum - 1;
+		pystringToJson(pyobject, buffer);
+	}
+	else if (PyDict_Check(pyobject))
+	{
+		PyObject   *p_key,
+				   *p_item;
+		Py_ssize_t	pos = 0;
+		bool		first = true;
 
-		if (cinfos[cinfo_idx] == NULL)
-		{
-			continue;
-		}
-		p_object = PySequence_GetItem(p_value, j);
-		if(p_object == NULL || p_object == Py_None){
-			nulls[i] = true;
-			values[i] = 0;
-		}
-		else
+		appendStringInfoChar(buffer, '{');
+		while (PyDict_Next(pyobject, &pos, &p_key, &p_item))
 		{
-			resetStringInfo(buffer);
-			values[i] = pyobjectToDatum(p_object, buffer,
-										cinfos[cinfo_idx]);
-			if (buffer->data == NULL)
+			if (!first)
 			{
-				nulls[i] = true;
+				appendStringInfoString(buffer, ", ");
+			}
+			first = false;
+			if (PyUnicode_Check(p_key) || PyBytes_Check(p_key))
+			{
+				pystringToJson(p_key, buffer);
 			}
 			else
 			{
-				nulls[i] = false;
+				/* JSON keys are always strings */
+				PyObject   *p_str = PyObject_Str(p_key);
+
+				errorCheck();
+				pystringToJson(p_str, buffer);
+				Py_DECREF(p_str);
 			}
+			appendStringInfoString(buffer, ": ");
+			pyobjectToJson(p_item, buffer, cinfo);
 		}
-		errorCheck();
-		Py_DECREF(p_object);
-		j++;
+		appendStringInfoChar(buffer, '}');
+	}
+	else if (PyList_Check(pyobject) || PyTuple_Check(pyobject))
+	{
+		Py_ssize_t	i,
+					size = PySequence_Fast_GET_SIZE(pyobject);
+
+		appendStringInfoChar(buffer, '[');
+		for (i = 0; i < size; i++)
+		{
+			if (i > 0)
+			{
+				appendStringInfoString(buffer, ", ");
+			}
+			pyobjectToJson(PySequence_Fast_GET_ITEM(pyobject, i), buffer,
+						   cinfo);
+		}
+		appendStringInfoChar(buffer, ']');
+	}
+	else
+	{
+		StringInfoData tempbuffer;
+		bool		need_quote = cinfo->need_quote;
+
+		initStringInfo(&tempbuffer);
+		cinfo->need_quote = false;
+		pyobjectToCString(pyobject, &tempbuffer, cinfo);
+		cinfo->need_quote = need_quote;
+		escape_json(buffer, tempbuffer.data);
+		pfree(tempbuffer.data);
 	}
 }
 
 /*
- * Convert a python result (a sequence or a dictionary) to a tupletableslot.
+ * Write a unicode or byte string as a quoted and escaped JSON string.
  */
 void
-pythonResultToTuple(PyObject *p_value,
-					TupleTableSlot *slot,
-					ConversionInfo ** cinfos,
-					StringInfo buffer)
+pystringToJson(PyObject *pyobject, StringInfo buffer)
 {
-	if (PySequence_Check(p_value))
+	char	   *tempbuffer;
+	Py_ssize_t	strlength;
+	PyObject   *pTempStr = NULL;
+
+	if (PyUnicode_Check(pyobject))
 	{
-		pythonSequenceToTuple(p_value, slot, cinfos, buffer);
+		tempbuffer = pyunicodeAsServerString(pyobject, &strlength, &pTempStr);
 	}
 	else
 	{
+		tempbuffer = PyBytes_AsString(pyobject);
+		errorCheck();
+	}
+	escape_json(buffer, tempbuffer);
+	Py_XDECREF(pTempStr);
+}
+
+/*
+ * Returns the function building a datum of the given type directly from a
+ * python object, without going through its text representation.
+ *
+ * Returns NULL if the type is not handled natively, in which case the type
+ * input function is used.
+ */
+PyObjectToDatumFunc
+getDatumConverter(Oid typeoid)
+{
+	switch (typeoid)
+	{
+		case INT2OID:
+		case INT4OID:
+		case INT8OID:
+			return pyintToDatum;
+		case FLOAT4OID:
+		case FLOAT8OID:
+			return pyfloatToDatum;
+		case BOOLOID:
+			return pyboolToDatum;
+		case NUMERICOID:
+			return pynumericToDatum;
+		case DATEOID:
+			return pydateToDatum;
+		case TIMESTAMPOID:
+		case TIMESTAMPTZOID:
+			return pydatetimeToDatum;
+		case TEXTOID:
+		case VARCHAROID:
+		case BYTEAOID:
+			return pytextToDatum;
+		case UUIDOID:
+			return pyuuidToDatum;
+		case JSONOID:
+#if PG_VERSION_NUM >= 90400
+		case JSONBOID:
+#endif
+			return pyjsonToDatum;
+		default:
+			return NULL;
+	}
+}
 
-		if (PyMapping_Check(p_value))
+/*
+ * Seed the per-column python type guess from the types the fdw declares
+ * for its columns.
+ */
+void
+applyTypeHints(PyObject *fdw_instance, ConversionInfo ** cinfos, int natts)
+{
+	PyObject   *p_hints = PyObject_CallMethod(fdw_instance, "get_type_hints",
+											  "()");
+	int			i;
+
+	errorCheck();
+	if (p_hints == Py_None)
+	{
+		Py_DECREF(p_hints);
+		return;
+	}
+	if (!PyMapping_Check(p_hints))
+	{
+		Py_DECREF(p_hints);
+		elog(ERROR, "get_type_hints must return a mapping");
+	}
+	for (i = 0; i < natts; i++)
+	{
+		ConversionInfo *cinfo = cinfos[i];
+		PyObject   *p_type;
+
+		if (cinfo == NULL)
 		{
-			pythonDictToTuple(p_value, slot, cinfos, buffer);
+			continue;
 		}
-		else
+		p_type = PyMapping_GetItemString(p_hints, cinfo->attrname);
+		if (p_type == NULL)
 		{
-			elog(ERROR, "Cannot transform anything else than mappings and"
-				 "sequences to rows");
+			PyErr_Clear();
+			continue;
 		}
+		if (PyType_Check(p_type))
+		{
+			PyObjectToCStringFunc converter = getCStringConverterForType((PyTypeObject *) p_type);
+
+			if (converter != NULL)
+			{
+				cinfo->pytype = (PyTypeObject *) p_type;
+				cinfo->tocstring = converter;
+			}
+		}
+		Py_DECREF(p_type);
 	}
+	Py_DECREF(p_hints);
 }
 
 Datum
@@ -1320,8 +3527,24 @@ pyobjectToDatum(PyObject *object, StringInfo buffer,
 {
 	Datum		value = 0;
 
-	pyobjectToCString(object, buffer,
-					  cinfo);
+	if (cinfo->todatum != NULL && cinfo->todatum(object, cinfo, &value))
+	{
+		return value;
+	}
+	if (Py_TYPE(object) != cinfo->pytype || cinfo->pytype == NULL)
+	{
+		cinfo->tocstring = getCStringConverter(object);
+		/* Heap types may go away, only remember the static ones. */
+		if (PyType_HasFeature(Py_TYPE(object), Py_TPFLAGS_HEAPTYPE))
+		{
+			cinfo->pytype = NULL;
+		}
+		else
+		{
+			cinfo->pytype = Py_TYPE(object);
+		}
+	}
+	cinfo->tocstring(object, buffer, cinfo);
 
 	if (buffer->len >= 0)
 	{
@@ -1365,32 +3588,39 @@ datumUnknownToPython(Datum datum, ConversionInfo * cinfo, Oid type)
 	char	   *temp;
 	ssize_t		size;
 	PyObject   *result;
-	Oid			outfuncoid;
-	bool		isvarlena;
-	FmgrInfo   *fmout = palloc0(sizeof(FmgrInfo));
+	DatumOutputInfo *outinfo = getDatumOutputInfo(type, cinfo);
 
-	getTypeOutputInfo(type, &outfuncoid, &isvarlena);
-	fmgr_info(outfuncoid, fmout);
-	temp = OutputFunctionCall(fmout, datum);
+	temp = OutputFunctionCall(&outinfo->outfunc, datum);
 	size = strlen(temp);
 	result = PyUnicode_Decode(temp, size, getPythonEncodingName(), NULL);
-	pfree(fmout);
+	pfree(temp);
 	return result;
 }
 
+/*
+ * Convert a numeric to a python float, or to a decimal.Decimal if the
+ * numeric_as_decimal option is set.
+ */
 PyObject *
 datumNumberToPython(Datum datum, ConversionInfo * cinfo)
 {
-	ssize_t		numvalue = (ssize_t) DatumGetNumeric(datum);
-	char	   *tempvalue = (char *) DirectFunctionCall1(numeric_out,
-														 numvalue);
-	PyObject   *buffer = PyString_FromString(tempvalue),
-#if PY_MAJOR_VERSION >= 3
-			   *value = PyFloat_FromString(buffer);
-#else
-			   *value = PyFloat_FromString(buffer, NULL);
-#endif
-	Py_DECREF(buffer);
+	static PyObject *p_decimal_type = NULL;
+	char	   *tempvalue;
+	PyObject   *value;
+
+	if (cinfo == NULL || !cinfo->numeric_as_decimal)
+	{
+		return PyFloat_FromDouble(DatumGetFloat8(
+						DirectFunctionCall1(numeric_float8_no_overflow, datum)));
+	}
+	if (p_decimal_type == NULL)
+	{
+		p_decimal_type = getPythonType("decimal", "Decimal");
+	}
+	/* The numeric text form only contains ascii characters. */
+	tempvalue = DatumGetCString(DirectFunctionCall1(numeric_out, datum));
+	value = PyObject_CallFunction(p_decimal_type, "(s)", tempvalue);
+	pfree(tempvalue);
 	return value;
 }
 
@@ -1437,12 +3667,73 @@ datumIntToPython(Datum datum, ConversionInfo * cinfo)
 	return PyLong_FromLong(DatumGetInt32(datum));
 }
 
+/*
+ * Returns the output information for a type, looking it up only if it is
+ * not one of the last two types converted with this ConversionInfo. The
+ * least recently used of the two is replaced.
+ */
+DatumOutputInfo *
+getDatumOutputInfo(Oid type, ConversionInfo * cinfo)
+{
+	DatumOutputInfo *outinfo;
+	HeapTuple	tuple;
+	Form_pg_type typeStruct;
+
+	if (cinfo->outinfos[0].typoid == type)
+	{
+		cinfo->next_outinfo = 1;
+		return &cinfo->outinfos[0];
+	}
+	if (cinfo->outinfos[1].typoid == type)
+	{
+		cinfo->next_outinfo = 0;
+		return &cinfo->outinfos[1];
+	}
+	outinfo = &cinfo->outinfos[cinfo->next_outinfo];
+	cinfo->next_outinfo = 1 - cinfo->next_outinfo;
+	/* Invalidate the slot first, in case of an error during the lookup */
+	outinfo->typoid = InvalidOid;
+	tuple = SearchSysCache1(TYPEOID, ObjectIdGetDatum(type));
+	if (!HeapTupleIsValid(tuple))
+	{
+		elog(ERROR, "lookup failed for type %u",
+			 type);
+	}
+	typeStruct = (Form_pg_type) GETSTRUCT(tuple);
+	if ((typeStruct->typelem != 0) && (typeStruct->typlen == -1))
+	{
+		/* Its an array. */
+		outinfo->elemoid = typeStruct->typelem;
+#if PG_VERSION_NUM >= 90500
+		outinfo->elemmeta.element_type = typeStruct->typelem;
+		get_typlenbyvalalign(typeStruct->typelem,
+							 &outinfo->elemmeta.typlen,
+							 &outinfo->elemmeta.typbyval,
+							 &outinfo->elemmeta.typalign);
+#endif
+	}
+	else
+	{
+		Oid			outfuncoid;
+		bool		isvarlena;
+
+		outinfo->elemoid = InvalidOid;
+		getTypeOutputInfo(type, &outfuncoid, &isvarlena);
+		fmgr_info_cxt(outfuncoid, &outinfo->outfunc, cinfo->cxt);
+	}
+	ReleaseSysCache(tuple);
+	outinfo->typoid = type;
+	return outinfo;
+}
+
 PyObject *
-datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
+datumArrayToPython(Datum datum, DatumOutputInfo * outinfo,
+				   ConversionInfo * cinfo)
 {
+	Oid			elemoid = outinfo->elemoid;
 #if PG_VERSION_NUM >= 90500
 	ArrayIterator iterator = array_create_iterator(DatumGetArrayTypeP(datum),
-												   0, NULL);
+												   0, &outinfo->elemmeta);
 # else
 	ArrayIterator iterator = array_create_iterator(DatumGetArrayTypeP(datum),
 												   0);
@@ -1461,23 +3752,12 @@ datumArrayToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 		}
 		else
 		{
-			HeapTuple	tuple;
-			Form_pg_type typeStruct;
-
-			tuple = SearchSysCache1(TYPEOID, ObjectIdGetDatum(type));
-			if (!HeapTupleIsValid(tuple))
-			{
-				elog(ERROR, "lookup failed for type %u",
-					 type);
-			}
-			typeStruct = (Form_pg_type) GETSTRUCT(tuple);
-			pyitem = datumToPython(elem, typeStruct->typelem, cinfo);
-			ReleaseSysCache(tuple);
-
+			pyitem = datumToPython(elem, elemoid, cinfo);
 			PyList_Append(result, pyitem);
 			Py_DECREF(pyitem);
 		}
 	}
+	array_free_iterator(iterator);
 	return result;
 }
 
@@ -1500,8 +3780,7 @@ datumByteaToPython(Datum datum, ConversionInfo * cinfo)
 PyObject *
 datumToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 {
-	HeapTuple	tuple;
-	Form_pg_type typeStruct;
+	DatumOutputInfo *outinfo;
 
 	switch (type)
 	{
@@ -1519,19 +3798,10 @@ datumToPython(Datum datum, Oid type, ConversionInfo * cinfo)
 		case INT4OID:
 			return datumIntToPython(datum, cinfo);
 		default:
-			/* Case for the array ? */
-			tuple = SearchSysCache1(TYPEOID, ObjectIdGetDatum(type));
-			if (!HeapTupleIsValid(tuple))
-			{
-				elog(ERROR, "lookup failed for type %u",
-					 type);
-			}
-			typeStruct = (Form_pg_type) GETSTRUCT(tuple);
-			ReleaseSysCache(tuple);
-			if ((typeStruct->typelem != 0) && (typeStruct->typlen == -1))
+			outinfo = getDatumOutputInfo(type, cinfo);
+			if (OidIsValid(outinfo->elemoid))
 			{
-				/* Its an array. */
-				return datumArrayToPython(datum, type, cinfo);
+				return datumArrayToPython(datum, outinfo, cinfo);
 			}
 			return datumUnknownToPython(datum, cinfo, type);
 	}
@@ -1642,6 +3912,78 @@ canSort(MulticornPlanState * state, List *deparsed)
 	return result;
 }
 
+/*
+ * Call the can_limit method from the python implementation, to know whether
+ * the fdw can apply the LIMIT and OFFSET of the query to a scan with the
+ * given quals and pathkeys. A negative limit means there is no LIMIT.
+ */
+bool
+canLimit(MulticornPlanState * state, List *quals, List *pathkeys,
+		 int64 limit, int64 offset)
+{
+	ListCell   *lc;
+	bool		result;
+	PyObject   *p_quals = qualDefsToPyList(quals, state->cinfos),
+			   *p_pathkeys = PyList_New(0),
+			   *p_limit,
+			   *p_result;
+
+	foreach(lc, pathkeys)
+	{
+		MulticornDeparsedSortGroup *pathkey = (MulticornDeparsedSortGroup *) lfirst(lc);
+		PyObject   *python_sortkey = getSortKey(pathkey);
+
+		PyList_Append(p_pathkeys, python_sortkey);
+		Py_DECREF(python_sortkey);
+	}
+	if (limit < 0)
+	{
+		p_limit = Py_None;
+		Py_INCREF(p_limit);
+	}
+	else
+	{
+		p_limit = PyLong_FromLongLong(limit);
+	}
+	p_result = PyObject_CallMethod(state->fdw_instance, "can_limit", "(OLOO)",
+								   p_limit, (PY_LONG_LONG) offset,
+								   p_quals, p_pathkeys);
+	Py_DECREF(p_limit);
+	Py_DECREF(p_quals);
+	Py_DECREF(p_pathkeys);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
+}
+
+/*
+ * Call the can_aggregate method from the python implementation, to know
+ * whether the fdw can compute the aggregates of the query, grouped by the
+ * given columns, over the rows matching the quals.
+ */
+bool
+canAggregate(MulticornPlanState * state, List *groups, List *aggs,
+			 List *quals)
+{
+	bool		result;
+	PyObject   *p_quals = qualDefsToPyList(quals, state->cinfos),
+			   *p_groups,
+			   *p_aggs,
+			   *p_result;
+
+	aggregateToPython(groups, aggs, &p_groups, &p_aggs);
+	p_result = PyObject_CallMethod(state->fdw_instance, "can_aggregate",
+								   "(OOO)", p_groups, p_aggs, p_quals);
+	Py_DECREF(p_groups);
+	Py_DECREF(p_aggs);
+	Py_DECREF(p_quals);
+	errorCheck();
+	result = PyObject_IsTrue(p_result);
+	Py_DECREF(p_result);
+	return result;
+}
+
 PyObject *
 tupleTableSlotToPyObject(TupleTableSlot *slot, ConversionInfo ** cinfos)
 {
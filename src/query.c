@@ -134,6 +134,15 @@ initConversioninfo(ConversionInfo ** cinfos, AttInMetadata *attinmeta)
 			cinfo->attnum = i + 1;
 			cinfo->attndims = attr->attndims;
 			cinfo->need_quote = false;
+			cinfo->todatum = getDatumConverter(attr->atttypid);
+			cinfo->pytype = NULL;
+			cinfo->tocstring = NULL;
+			cinfo->attrkey = NULL;
+			cinfo->numeric_as_decimal = false;
+			cinfo->outinfos[0].typoid = InvalidOid;
+			cinfo->outinfos[1].typoid = InvalidOid;
+			cinfo->next_outinfo = 0;
+			cinfo->cxt = CurrentMemoryContext;
 			cinfos[i] = cinfo;
 		}
 		else
@@ -0,0 +1,46 @@
+# Load multicorn with shared_preload_libraries, so that it is initialized
+# by the postmaster, and check that the backends can use it.
+use strict;
+use warnings;
+
+use PostgreSQL::Test::Cluster;
+use PostgreSQL::Test::Utils;
+use Test::More;
+
+my $node = PostgreSQL::Test::Cluster->new('preload');
+$node->init;
+$node->append_conf(
+	'postgresql.conf', q{
+shared_preload_libraries = 'multicorn'
+multicorn.preload = 'multicorn.testfdw.TestForeignDataWrapper'
+});
+$node->start;
+
+$node->safe_psql(
+	'postgres', q{
+CREATE EXTENSION multicorn;
+CREATE SERVER multicorn_srv FOREIGN DATA WRAPPER multicorn OPTIONS (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE FOREIGN TABLE testmulticorn (
+    test1 character varying,
+    test2 character varying
+) SERVER multicorn_srv;
+});
+
+is($node->safe_psql('postgres', 'SELECT test1 FROM testmulticorn LIMIT 1'),
+	'test1 1 0', 'a backend scans a foreign table');
+
+# Every backend inherits the state initialized by the postmaster
+is( $node->safe_psql(
+		'postgres', q{
+SET multicorn.max_instances = 1;
+SELECT count(*) FROM testmulticorn;
+SELECT count(*) FROM multicorn_cache_stats();
+}),
+	"20\n1",
+	'another backend scans it and caches its instance');
+
+$node->stop;
+
+done_testing();
@@ -80,5 +80,44 @@ select * from testalchemy order by avarchar nulls last;
 
 select count(*) from testalchemy;
 
+-- The tables of a shared server use the engine of the server
+create or replace function create_shared_server() returns void as $block$
+  DECLARE
+    current_db varchar;
+  BEGIN
+    SELECT into current_db current_database();
+    EXECUTE $$
+    CREATE server multicorn_shared_srv foreign data wrapper multicorn options (
+        wrapper 'multicorn.sqlalchemyfdw.SqlAlchemyFdw',
+        shared_instance 'true',
+        db_url 'postgresql://$$ || current_user || '@localhost/' || current_db || $$'
+    );
+    $$;
+  END;
+$block$ language plpgsql;
+select create_shared_server();
+
+create foreign table testalchemy_shared (
+  id integer,
+  avarchar varchar
+) server multicorn_shared_srv options (
+  tablename 'basetable'
+);
+
+create foreign table testalchemy_shared2 (
+  id integer,
+  anumeric numeric
+) server multicorn_shared_srv options (
+  tablename 'basetable'
+);
+
+select * from testalchemy_shared order by id;
+
+select * from testalchemy_shared2 where anumeric > 0 order by id;
+
+DROP foreign table testalchemy_shared;
+DROP foreign table testalchemy_shared2;
+DROP SERVER multicorn_shared_srv;
+
 DROP EXTENSION multicorn cascade;
 DROP table basetable;
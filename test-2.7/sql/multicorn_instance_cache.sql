@@ -0,0 +1,76 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1'
+);
+
+CREATE foreign table testmulticorn2 (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option2'
+);
+
+-- Only keep one instance
+SET multicorn.max_instances = 1;
+select * from testmulticorn limit 1;
+
+select * from testmulticorn2 limit 1;
+
+select foreign_table, in_transaction from multicorn_cache_stats();
+
+-- The evicted instance is created again
+select * from testmulticorn limit 1;
+
+RESET multicorn.max_instances;
+select * from testmulticorn2 limit 1;
+
+-- The most recently used instance comes first
+select foreign_table, memory > 0 as has_memory from multicorn_cache_stats();
+
+CREATE server multicorn_shared foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper',
+    shared_instance 'true'
+);
+CREATE user mapping FOR current_user server multicorn_shared options (usermapping 'shared');
+
+CREATE foreign table testmulticorn_shared (
+    test1 character varying,
+    test2 character varying
+) server multicorn_shared options (
+    option1 'option1'
+);
+
+CREATE foreign table testmulticorn_shared2 (
+    test1 character varying,
+    test2 character varying
+) server multicorn_shared options (
+    option1 'option2'
+);
+
+-- The server instance is created once, and gives an instance per table
+select * from testmulticorn_shared limit 1;
+
+select * from testmulticorn_shared2 limit 1;
+
+-- The replaced server instance is closed
+ALTER SERVER multicorn_shared options (ADD serveroption 'changed');
+select * from testmulticorn_shared2 limit 1;
+
+ALTER foreign table testmulticorn_shared options (ADD shared_instance 'false');
+
+DROP foreign table testmulticorn_shared;
+DROP foreign table testmulticorn_shared2;
+DROP USER MAPPING FOR current_user SERVER multicorn_shared;
+DROP SERVER multicorn_shared;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
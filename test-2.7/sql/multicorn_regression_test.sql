@@ -93,6 +93,18 @@ ALTER FOREIGN TABLE testmulticorn alter test1 type bytea;
 
 select encode(test1, 'escape') from testmulticorn where test2 = 'test2 1 19'::bytea;
 
+-- Buffers are copied as they are
+ALTER FOREIGN TABLE testmulticorn options (add test_type 'buffer');
+
+select encode(test1, 'escape'), encode(test2, 'escape') from testmulticorn limit 1;
+
+ALTER FOREIGN TABLE testmulticorn alter test1 type text;
+
+select test1 from testmulticorn limit 1;
+
+ALTER FOREIGN TABLE testmulticorn alter test1 type bytea;
+ALTER FOREIGN TABLE testmulticorn options (drop test_type);
+
 -- Test operations with None
 ALTER FOREIGN TABLE testmulticorn options (add test_type 'None');
 
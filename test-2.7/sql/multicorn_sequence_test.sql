@@ -58,5 +58,15 @@ CREATE foreign table testmulticorn3 (
 );
 select * from testmulticorn3 limit 1;
 
+CREATE foreign table testmulticorn4 (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    option1 'option1',
+    test_type 'sequence',
+    test_subtype 'short'
+);
+select * from testmulticorn4;
+
 DROP USER MAPPING FOR current_user SERVER multicorn_srv;
 DROP EXTENSION multicorn cascade;
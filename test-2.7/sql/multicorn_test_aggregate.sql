@@ -0,0 +1,24 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.AggregateTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 integer
+) server multicorn_srv;
+
+-- The groups are computed by the fdw
+explain (costs off) select test1, count(*), sum(test2) from testmulticorn group by test1;
+
+select test1, count(*), sum(test2) from testmulticorn group by test1 order by test1;
+
+select count(test2), min(test2), max(test2) from testmulticorn where test1 = 'group 1';
+
+-- Quals refused by the fdw prevent the pushdown
+select count(*) from testmulticorn where test1 like 'group%';
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
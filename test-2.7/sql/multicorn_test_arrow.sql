@@ -0,0 +1,50 @@
+SET client_min_messages=NOTICE;
+SET timezone TO 'UTC';
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.ArrowTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testarrow (
+    id bigint,
+    name text,
+    ratio double precision,
+    day date,
+    stamp timestamp,
+    stamptz timestamptz,
+    flag boolean
+) server multicorn_srv options (
+    test_type 'array'
+);
+
+-- Record batches are read in place
+select * from testarrow;
+
+CREATE foreign table testarrow_stream (
+    id bigint,
+    name text,
+    day date,
+    missing text
+) server multicorn_srv options (
+    test_type 'stream'
+);
+
+-- Streams are read one batch at a time
+select * from testarrow_stream;
+
+CREATE foreign table testarrow_convert (
+    id text,
+    ratio real,
+    day timestamp
+) server multicorn_srv options (
+    test_type 'array'
+);
+
+-- Other types go through the text representation
+select id, day from testarrow_convert;
+
+select ratio from testarrow_convert;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,67 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 integer,
+    test2 integer
+) server multicorn_srv options (
+    test_type 'int',
+    batch_size '7'
+);
+
+-- Without execute_batches, rows are fetched one by one
+select * from testmulticorn;
+
+select * from testmulticorn where test1 > 15;
+
+select * from testmulticorn limit 3;
+
+CREATE server multicorn_batch_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.BatchTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_batch_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn_batch (
+    test1 integer,
+    test2 integer
+) server multicorn_batch_srv options (
+    test_type 'int',
+    batch_size '7'
+);
+
+-- Rows are fetched in batches of 7
+select * from testmulticorn_batch where test1 > 15;
+
+select * from testmulticorn_batch limit 3;
+
+DROP foreign table testmulticorn_batch;
+DROP USER MAPPING FOR current_user SERVER multicorn_batch_srv;
+DROP SERVER multicorn_batch_srv;
+
+-- Invalid batch sizes are rejected
+ALTER foreign table testmulticorn options (SET batch_size '0');
+
+ALTER foreign table testmulticorn options (SET batch_size 'abc');
+
+CREATE foreign table testmulticorn_columnar (
+    test1 integer,
+    test2 double precision,
+    test3 text
+) server multicorn_srv options (
+    test_type 'columnar'
+);
+
+-- Rows are returned as column batches
+select * from testmulticorn_columnar;
+
+select * from testmulticorn_columnar where test1 > 15;
+
+select test3 from testmulticorn_columnar where test2 < 1.5;
+
+DROP foreign table testmulticorn_columnar;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,46 @@
+SET client_min_messages=NOTICE;
+SET timezone TO 'UTC';
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.ValuesTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testvalues (
+    small_int2 int2 options (value '123'),
+    big_int2 int2 options (value '40000'),
+    big_int4 int4 options (value '2 ** 31'),
+    big_int8 int8 options (value '2 ** 31'),
+    int_numeric numeric(5, 1) options (value '42'),
+    bool_int4 int4 options (value 'True'),
+    bool_numeric numeric options (value 'True'),
+    small_float4 float4 options (value '0.5'),
+    tiny_float4 float4 options (value '1e-50'),
+    huge_float4 float4 options (value '1e50'),
+    naive_timestamptz timestamptz options (value 'datetime(2011, 1, 1, 12, 30)'),
+    aware_timestamptz timestamptz options (value 'datetime(2011, 1, 1, 12, 30, tzinfo=FixedOffset(120))'),
+    aware_timestamp timestamp options (value 'datetime(2011, 1, 1, 12, 30, tzinfo=FixedOffset(120))')
+) server multicorn_srv;
+
+-- Values fitting in the column type are built directly
+select small_int2, big_int8, int_numeric, small_float4 from testvalues;
+
+-- Others are given to the input function, which raises the error
+select big_int2 from testvalues;
+
+select big_int4 from testvalues;
+
+select tiny_float4 from testvalues;
+
+select huge_float4 from testvalues;
+
+-- Booleans are not converted to integers
+select bool_int4 from testvalues;
+
+select bool_numeric from testvalues;
+
+-- Naive datetimes are in the session timezone
+select naive_timestamptz, aware_timestamptz, aware_timestamp from testvalues;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,22 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 json,
+    test2 jsonb
+) server multicorn_srv options (
+    test_type 'json'
+);
+
+-- Dicts and lists are encoded as JSON
+select * from testmulticorn limit 3;
+
+select test2->>'column' as name, (test2->>'index')::int as idx
+from testmulticorn where (test2->>'index')::int > 17;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
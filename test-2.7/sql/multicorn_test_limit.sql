@@ -0,0 +1,25 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.LimitTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv;
+
+-- The limit and the offset are given to the fdw
+select * from testmulticorn limit 2 offset 1;
+
+select * from testmulticorn where test1 = 'test1 1 0' limit 1;
+
+-- Top-N: the fdw sorts the rows, then applies the limit
+select * from testmulticorn order by test1 desc limit 3;
+
+-- Conditions checked by PostgreSQL prevent the pushdown
+select * from testmulticorn where length(test1) > 9 limit 1;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
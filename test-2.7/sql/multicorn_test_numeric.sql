@@ -0,0 +1,34 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 numeric(10,2),
+    test2 numeric
+) server multicorn_srv options (
+    test_type 'int'
+);
+
+-- Numeric quals are floats by default
+select * from testmulticorn where test1 = 3.00;
+
+CREATE foreign table testmulticorn_decimal (
+    test1 numeric(10,2),
+    test2 numeric
+) server multicorn_srv options (
+    test_type 'int',
+    numeric_as_decimal 'true'
+);
+
+-- And decimals with the numeric_as_decimal option
+select * from testmulticorn_decimal where test1 = 3.00;
+
+select * from testmulticorn_decimal where test2 = 0.1000000000000000000001;
+
+ALTER foreign table testmulticorn_decimal options (SET numeric_as_decimal 'maybe');
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,35 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.PartitionedTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv;
+
+-- Workers log in no particular order
+SET client_min_messages=WARNING;
+SET parallel_setup_cost = 0;
+SET parallel_tuple_cost = 0;
+SET max_parallel_workers_per_gather = 2;
+
+-- The scan is split between the workers
+EXPLAIN (COSTS OFF) select count(*) from testmulticorn;
+
+-- Every partition is scanned exactly once
+select count(*), count(distinct test2), sum(split_part(test1, ' ', 3)::int) from testmulticorn;
+
+SET max_parallel_workers_per_gather = 0;
+EXPLAIN (COSTS OFF) select count(*) from testmulticorn;
+
+select count(*), count(distinct test2), sum(split_part(test1, ' ', 3)::int) from testmulticorn;
+
+RESET max_parallel_workers_per_gather;
+RESET parallel_tuple_cost;
+RESET parallel_setup_cost;
+SET client_min_messages=NOTICE;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
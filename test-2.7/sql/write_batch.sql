@@ -0,0 +1,23 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.TestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    row_id_column 'test1',
+    batch_size '2'
+);
+
+-- Rows are inserted by batches of 2
+insert into testmulticorn(test1, test2) VALUES ('a', '1'), ('b', '2'), ('c', '3');
+
+-- Rows are inserted one at a time when they are returned
+insert into testmulticorn(test1, test2) VALUES ('d', '4'), ('e', '5') RETURNING test1;
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,24 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testfdw.DirectModifyTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testmulticorn (
+    test1 character varying,
+    test2 character varying
+) server multicorn_srv options (
+    row_id_column 'test1'
+);
+
+-- The whole statement is given to the fdw
+update testmulticorn set test2 = 'new' where test1 = 'test1 1 0';
+
+delete from testmulticorn where test1 in ('test1 1 0', 'test1 3 1') returning test1, test2;
+
+-- New values computed from the rows are not supported
+update testmulticorn set test2 = test2 || ' updated' where test1 = 'test1 1 0';
+
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1,37 @@
+SET client_min_messages=NOTICE;
+CREATE EXTENSION multicorn;
+CREATE server multicorn_srv foreign data wrapper multicorn options (
+    wrapper 'multicorn.testasyncfdw.AsyncTestForeignDataWrapper'
+);
+CREATE user mapping FOR current_user server multicorn_srv options (usermapping 'test');
+
+CREATE foreign table testasync1 (
+    test1 character varying,
+    test2 integer
+) server multicorn_srv options (
+    name 'first',
+    delay '0.01'
+);
+
+CREATE foreign table testasync2 (
+    test1 character varying,
+    test2 integer
+) server multicorn_srv options (
+    name 'second'
+);
+
+-- A single scan is iterated synchronously
+select * from testasync1 where test2 < 3;
+
+-- Scans below an Append run concurrently
+explain (costs off) select count(*) from (select * from testasync1 union all select * from testasync2) as t;
+
+select count(*), sum(test2), count(distinct test1) from (select * from testasync1 union all select * from testasync2) as t;
+
+-- The batch_size option does not change the scans
+ALTER foreign table testasync1 options (ADD batch_size '5');
+select * from testasync1 where test2 < 3;
+
+DROP foreign table testasync2;
+DROP USER MAPPING FOR current_user SERVER multicorn_srv;
+DROP EXTENSION multicorn cascade;
@@ -0,0 +1 @@
+../../test-2.7/sql/write_batch.sql
\ No newline at end of file